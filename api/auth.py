@@ -0,0 +1,119 @@
+import asyncio
+import base64
+import json
+import logging
+import time
+from typing import Dict, Optional, Tuple
+from bot_config import TOKEN_REFRESH_MARGIN, TOKEN_REFRESH_RETRY_INTERVAL
+from database.db import get_panel_credentials, update_panel_token
+
+logger = logging.getLogger(__name__)
+
+# Old token -> the token that replaced it, for callers still holding a panel row read before a refresh
+_replaced_tokens: Dict[str, str] = {}
+_failed_refreshes: Dict[str, float] = {}
+_refreshes: Dict[Tuple[str, str], asyncio.Future] = {}
+# (panel_url, token) -> username of the panel admin the token was issued to
+_panel_admins: Dict[Tuple[str, str], str] = {}
+
+def token_expiry(token: str) -> Optional[int]:
+    """Return the `exp` claim of a JWT as a Unix timestamp, or None if it cannot be read."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, KeyError, TypeError, ValueError):
+        return None
+
+def current_token(token: str) -> str:
+    """Follow refreshes so a stale token resolves to the one that replaced it."""
+    return _replaced_tokens.get(token, token)
+
+def panel_admin(panel_url: str, token: str) -> Optional[str]:
+    """
+    Return the username of the panel admin a token belongs to, or None if no panel row holds it.
+
+    Non-sudo Marzban admins only see their own users, so anything cached from
+    a panel's user list must be scoped by this rather than by URL alone.
+    """
+    panel_url = panel_url.rstrip('/')
+    key = (panel_url, token)
+    admin = _panel_admins.get(key)
+    if admin is None:
+        credentials = get_panel_credentials(panel_url, current_token(token))
+        if not credentials:
+            return None
+        admin = _panel_admins[key] = credentials[0]
+    return admin
+
+async def ensure_fresh_token(client, token: str) -> str:
+    """
+    Return a token that is not about to expire, refreshing it first when needed.
+
+    Args:
+        client: MarzbanClient of the panel the token belongs to.
+        token: Token the caller holds.
+
+    Returns:
+        The current token; unchanged if it is not near expiry or cannot be refreshed.
+    """
+    token = current_token(token)
+    expires_at = token_expiry(token)
+    now = time.time()
+    if expires_at is None or expires_at - now > TOKEN_REFRESH_MARGIN:
+        return token
+    if now - _failed_refreshes.get(token, 0) < TOKEN_REFRESH_RETRY_INTERVAL:
+        return token
+    return await refresh_token(client, token)
+
+async def refresh_token(client, token: str) -> str:
+    """
+    Log in again with the panel's stored credentials and return the new token.
+
+    Concurrent refreshes of the same token share one login. The new token is
+    written back to every panel row that held the old one.
+
+    Args:
+        client: MarzbanClient of the panel the token belongs to.
+        token: Token to replace.
+
+    Returns:
+        The new token, or `token` itself if the refresh failed.
+    """
+    latest = current_token(token)
+    if latest != token:
+        return latest
+    key = (client.panel_url, token)
+    pending = _refreshes.get(key)
+    if pending is None:
+        pending = asyncio.ensure_future(_refresh(client, token))
+        _refreshes[key] = pending
+        pending.add_done_callback(lambda _: _refreshes.pop(key, None))
+    return await asyncio.shield(pending)
+
+async def _refresh(client, token: str) -> str:
+    credentials = await asyncio.to_thread(get_panel_credentials, client.panel_url, token)
+    if not credentials:
+        logger.warning(f"No stored credentials for token refresh on {client.panel_url}")
+        _failed_refreshes[token] = time.time()
+        return token
+    username, password = credentials
+    try:
+        status, data = await client.login(username, password)
+    except Exception as e:
+        logger.warning(f"Token refresh failed for {client.panel_url}: {str(e)}")
+        _failed_refreshes[token] = time.time()
+        return token
+    new_token = data.get("access_token") if status == 200 else None
+    if not new_token:
+        logger.warning(f"Token refresh rejected by {client.panel_url} (status {status})")
+        _failed_refreshes[token] = time.time()
+        return token
+    for old, replacement in list(_replaced_tokens.items()):
+        if replacement == token:
+            _replaced_tokens[old] = new_token
+    _replaced_tokens[token] = new_token
+    _failed_refreshes.pop(token, None)
+    await asyncio.to_thread(update_panel_token, client.panel_url, token, new_token)
+    logger.info(f"Access token refreshed for {client.panel_url}")
+    return new_token
@@ -0,0 +1,296 @@
+import asyncio
+import logging
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Iterable, List, Optional, Tuple
+from api.client import get_client, background_traffic
+from api.scan import iter_user_batches
+from bot_config import BULK_CONCURRENCY, SCAN_PAGE_SIZE
+
+logger = logging.getLogger(__name__)
+
+ProgressCallback = Callable[[int, int], Awaitable[None]]
+
+async def collect_usernames(panel_url: str, token: str, predicate: Callable[[dict], bool], page_size: int = SCAN_PAGE_SIZE) -> List[str]:
+    """
+    Scan every page of /api/users and collect the usernames matching a predicate.
+
+    The scan finishes before anything is modified, so deletions cannot shift
+    users into pages that were already read.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        predicate: Function returning True for users to collect.
+        page_size: Number of users to fetch per page.
+
+    Returns:
+        List of matching usernames.
+    """
+    usernames = []
+    with background_traffic():
+        async for users in iter_user_batches(panel_url, token, page_size, compact=True):
+            usernames.extend(user["username"] for user in users if user.get("username") and predicate(user))
+    return usernames
+
+async def run_bounded(items: Iterable, action: Callable[[object], Awaitable[bool]], concurrency: int = BULK_CONCURRENCY, progress: Optional[ProgressCallback] = None, total: Optional[int] = None) -> Tuple[int, int]:
+    """
+    Apply `action` to every item with at most `concurrency` calls in flight.
+
+    A fixed pool of workers pulls from one shared iterator, so memory stays
+    flat no matter how many items there are.
+
+    Args:
+        items: Items to process; may be a lazy iterable.
+        action: Coroutine returning True on success and False on failure.
+        concurrency: Number of workers.
+        progress: Optional coroutine called with (done, total) after each item.
+        total: Total item count reported to `progress`; defaults to len(items).
+
+    Returns:
+        Tuple of (succeeded_count, failed_count).
+    """
+    if total is None:
+        total = len(items) if hasattr(items, "__len__") else 0
+    iterator = iter(items)
+    counts = {"ok": 0, "failed": 0}
+
+    async def worker():
+        for item in iterator:
+            try:
+                ok = await action(item)
+            except Exception as e:
+                logger.warning(f"Bulk action failed for {item}: {str(e)}")
+                ok = False
+            counts["ok" if ok else "failed"] += 1
+            if progress:
+                try:
+                    await progress(counts["ok"] + counts["failed"], total)
+                except Exception as e:
+                    logger.warning(f"Progress callback failed: {str(e)}")
+
+    await asyncio.gather(*[worker() for _ in range(max(1, concurrency))])
+    return counts["ok"], counts["failed"]
+
+async def bulk_delete_users(panel_url: str, token: str, usernames: List[str], concurrency: int = BULK_CONCURRENCY, progress: Optional[ProgressCallback] = None) -> Tuple[List[str], List[str]]:
+    """
+    Delete users concurrently with at most `concurrency` requests in flight.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        usernames: Usernames to delete.
+        concurrency: Maximum number of concurrent DELETE requests.
+        progress: Optional coroutine called with (done, total) after each user.
+
+    Returns:
+        Tuple of (deleted_usernames, failed_usernames).
+    """
+    client = get_client(panel_url)
+    deleted, failed = [], []
+
+    async def delete_one(username: str) -> bool:
+        try:
+            status, result = await client.delete(f"/api/user/{username}", token)
+        except Exception as e:
+            logger.warning(f"Failed to delete user {username}: {str(e)}")
+            failed.append(username)
+            return False
+        if status != 200:
+            logger.warning(f"Failed to delete user {username}: {result}")
+            failed.append(username)
+            return False
+        deleted.append(username)
+        return True
+
+    with background_traffic():
+        await run_bounded(usernames, delete_one, concurrency, progress)
+    return deleted, failed
+
+BULK_EXPIRED_DELETE = "bulk_expired_delete"
+
+def _format_query_datetime(moment: datetime) -> str:
+    # Marzban parses naive datetimes in query strings as UTC
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+async def supports_bulk_expired_delete(panel_url: str, token: str) -> bool:
+    """
+    Check once per panel whether it serves /api/users/expired (newer Marzban releases).
+
+    The probe asks for users that expired before 1970, so it is cheap and
+    returns an empty list on supporting panels. Only definitive answers are
+    cached; auth or server errors are retried on the next call.
+    """
+    client = get_client(panel_url)
+    if BULK_EXPIRED_DELETE in client.capabilities:
+        return client.capabilities[BULK_EXPIRED_DELETE]
+    params = {"expired_before": "1970-01-02T00:00:00"}
+    status, _ = await client.get("/api/users/expired", token, params=params, timeout=5)
+    if status == 200:
+        client.capabilities[BULK_EXPIRED_DELETE] = True
+    elif status in (404, 405):
+        client.capabilities[BULK_EXPIRED_DELETE] = False
+    else:
+        logger.warning(f"Could not probe bulk expired delete on {panel_url} (status {status})")
+        return False
+    logger.info(f"Panel {panel_url} bulk expired delete support: {client.capabilities[BULK_EXPIRED_DELETE]}")
+    return client.capabilities[BULK_EXPIRED_DELETE]
+
+async def delete_expired_server_side(panel_url: str, token: str, expired_before: datetime) -> Optional[List[str]]:
+    """
+    Delete expired users with a single DELETE /api/users/expired request.
+
+    The panel only removes users whose status is expired or limited and whose
+    expire time is before `expired_before`.
+
+    Returns:
+        List of deleted usernames, or None when the panel has no bulk endpoint
+        and the caller should fall back to client-side deletion.
+    """
+    if not await supports_bulk_expired_delete(panel_url, token):
+        return None
+    client = get_client(panel_url)
+    params = {"expired_before": _format_query_datetime(expired_before)}
+    status, result = await client.delete("/api/users/expired", token, params=params, timeout=60)
+    if status in (404, 405):
+        client.capabilities[BULK_EXPIRED_DELETE] = False
+        return None
+    if status != 200:
+        raise ValueError(f"حذف گروهی کاربران منقضی ناموفق: {result.get('detail', 'No details') if isinstance(result, dict) else result}")
+    return result if isinstance(result, list) else []
+
+async def bulk_create_users(panel_url: str, token: str, payloads: List[dict], concurrency: int = BULK_CONCURRENCY, progress: Optional[ProgressCallback] = None) -> Tuple[List[dict], List[Tuple[str, str]]]:
+    """
+    Create users concurrently with at most `concurrency` requests in flight.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        payloads: POST /api/user bodies, one per user.
+        concurrency: Maximum number of concurrent POST requests.
+        progress: Optional coroutine called with (done, total) after each user.
+
+    Returns:
+        Tuple of (created_users as returned by the panel, [(username, error)] for failures).
+    """
+    client = get_client(panel_url)
+    created, failed = [], []
+
+    async def create_one(payload: dict) -> bool:
+        username = payload["username"]
+        try:
+            status, result = await client.post("/api/user", token, json=payload)
+        except Exception as e:
+            logger.warning(f"Failed to create user {username}: {str(e)}")
+            failed.append((username, str(e) or type(e).__name__))
+            return False
+        if status != 200:
+            detail = result.get("detail", f"HTTP {status}") if isinstance(result, dict) else f"HTTP {status}"
+            logger.warning(f"Failed to create user {username}: {detail}")
+            failed.append((username, str(detail)))
+            return False
+        created.append(result)
+        return True
+
+    with background_traffic():
+        await run_bounded(payloads, create_one, concurrency, progress)
+    return created, failed
+
+async def collect_users(panel_url: str, token: str, predicate: Callable[[dict], bool], params: Optional[dict] = None, page_size: int = SCAN_PAGE_SIZE) -> List[dict]:
+    """
+    Scan /api/users (optionally pre-filtered by `params`) and collect the users matching a predicate.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        predicate: Function returning True for users to collect.
+        params: Optional /api/users query filters, e.g. {"status": "active"}.
+        page_size: Number of users to fetch per page.
+
+    Returns:
+        List of matching user dicts.
+    """
+    matched = []
+    with background_traffic():
+        async for users in iter_user_batches(panel_url, token, page_size, params=params, compact=True):
+            matched.extend(user for user in users if user.get("username") and predicate(user))
+    return matched
+
+BULK_MODIFY_ACTIONS = ("extend_expire", "add_traffic", "reset_usage", "enable", "disable")
+
+def user_modification(user: dict, action: str, amount: float, now: int) -> Optional[dict]:
+    """
+    PUT /api/user body applying a bulk action to one user, or None if it does not apply.
+
+    extend_expire adds `amount` days, counted from now for users that already
+    expired; add_traffic adds `amount` bytes. Users with unlimited expiry or
+    traffic are left alone. reset_usage has no PUT body and is handled separately.
+    """
+    if action == "extend_expire":
+        expire = user.get("expire") or 0
+        if expire <= 0:
+            return None
+        return {"expire": int(max(expire, now) + amount * 86400)}
+    if action == "add_traffic":
+        data_limit = user.get("data_limit") or 0
+        if data_limit <= 0:
+            return None
+        return {"data_limit": int(data_limit + amount)}
+    if action == "enable":
+        return {"status": "active"} if user.get("status") == "disabled" else None
+    if action == "disable":
+        return {"status": "disabled"} if user.get("status") in ("active", "on_hold") else None
+    raise ValueError(f"Unknown bulk action: {action}")
+
+async def bulk_modify_users(panel_url: str, token: str, users: List[dict], action: str, amount: float = 0, concurrency: int = BULK_CONCURRENCY, progress: Optional[ProgressCallback] = None) -> Tuple[List[dict], List[str], int]:
+    """
+    Apply one of BULK_MODIFY_ACTIONS to every user with at most `concurrency` requests in flight.
+
+    Only the changed fields are sent, so edits made to other fields since the
+    scan are not overwritten.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        users: User dicts from a scan.
+        action: One of BULK_MODIFY_ACTIONS.
+        amount: Days for extend_expire, bytes for add_traffic; ignored otherwise.
+        concurrency: Maximum number of concurrent requests.
+        progress: Optional coroutine called with (done, total) after each user.
+
+    Returns:
+        Tuple of (modified users as returned by the panel, failed usernames, skipped count).
+    """
+    if action not in BULK_MODIFY_ACTIONS:
+        raise ValueError(f"Unknown bulk action: {action}")
+    client = get_client(panel_url)
+    now = int(datetime.now(timezone.utc).timestamp())
+    modified, failed = [], []
+    skipped = 0
+
+    async def modify_one(user: dict) -> bool:
+        nonlocal skipped
+        username = user["username"]
+        if action == "reset_usage":
+            request = client.post(f"/api/user/{username}/reset", token)
+        else:
+            body = user_modification(user, action, amount, now)
+            if body is None:
+                skipped += 1
+                return True
+            request = client.put(f"/api/user/{username}", token, json=body)
+        try:
+            status, result = await request
+        except Exception as e:
+            logger.warning(f"Failed to modify user {username}: {str(e)}")
+            failed.append(username)
+            return False
+        if status != 200:
+            logger.warning(f"Failed to modify user {username}: {result}")
+            failed.append(username)
+            return False
+        modified.append(result)
+        return True
+
+    with background_traffic():
+        await run_bounded(users, modify_one, concurrency, progress)
+    return modified, failed, skipped
@@ -0,0 +1,350 @@
+import asyncio
+import contextlib
+import contextvars
+import copy
+import logging
+import random
+import time
+from typing import Any, Dict, Optional, Tuple
+import aiohttp
+try:
+    # Several times faster than json on large /api/users pages, and parses bytes without decoding to str first
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+from api.auth import ensure_fresh_token, refresh_token
+from bot_config import (
+    HTTP_TIMEOUT, HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL, HTTP_KEEPALIVE_TIMEOUT,
+    HTTP_RETRY_ATTEMPTS, HTTP_RETRY_BASE_DELAY, HTTP_RETRY_MAX_DELAY, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_TIMEOUT,
+    PANEL_INTERACTIVE_RATE, PANEL_INTERACTIVE_BURST, PANEL_INTERACTIVE_MAX_INFLIGHT,
+    PANEL_BACKGROUND_RATE, PANEL_BACKGROUND_BURST, PANEL_BACKGROUND_MAX_INFLIGHT
+)
+
+logger = logging.getLogger(__name__)
+
+# Only these are retried; a repeated POST could create or reset something twice
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT"}
+# Gateway errors mean the panel (or its proxy) is unhealthy, not that the request was wrong
+RETRYABLE_STATUSES = {502, 503, 504}
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+TRAFFIC_BUDGETS = {
+    INTERACTIVE: (PANEL_INTERACTIVE_RATE, PANEL_INTERACTIVE_BURST, PANEL_INTERACTIVE_MAX_INFLIGHT),
+    BACKGROUND: (PANEL_BACKGROUND_RATE, PANEL_BACKGROUND_BURST, PANEL_BACKGROUND_MAX_INFLIGHT),
+}
+
+# Which budget the current task's panel calls are charged to. Tasks inherit it from their creator.
+_traffic_class: contextvars.ContextVar[str] = contextvars.ContextVar("traffic_class", default=INTERACTIVE)
+
+@contextlib.contextmanager
+def background_traffic():
+    """Charge panel calls made inside this block (and tasks started from it) to the background budget."""
+    token = _traffic_class.set(BACKGROUND)
+    try:
+        yield
+    finally:
+        _traffic_class.reset(token)
+
+class TokenBucket:
+    """Async token bucket: `rate` tokens per second, holding at most `burst`. A rate <= 0 means unlimited."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        if self.rate <= 0:
+            return
+        # Waiters queue on the lock, so tokens are handed out first come, first served
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class PanelLimiter:
+    """Rate limit plus in-flight cap for one traffic class of one panel."""
+
+    def __init__(self, rate: float, burst: int, max_inflight: int):
+        self.bucket = TokenBucket(rate, burst)
+        self.slots = asyncio.Semaphore(max(1, max_inflight))
+
+    @contextlib.asynccontextmanager
+    async def slot(self):
+        async with self.slots:
+            await self.bucket.acquire()
+            yield
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a panel whose circuit breaker is open."""
+
+    def __init__(self, panel_url: str, retry_after: float):
+        self.panel_url = panel_url
+        self.retry_after = retry_after
+        super().__init__(f"پنل در دسترس نیست؛ {int(retry_after) + 1} ثانیه دیگر دوباره تلاش کنید.")
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one panel.
+
+    closed: requests pass; CIRCUIT_FAILURE_THRESHOLD failures in a row open it.
+    open: requests fail fast with CircuitOpenError until CIRCUIT_RESET_TIMEOUT passes.
+    half_open: a single probe request is let through; success closes the
+    circuit, failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, panel_url: str, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_TIMEOUT):
+        self.panel_url = panel_url
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    def current_state(self) -> str:
+        """State as seen by the next request: an open circuit past its timeout reads as half_open."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            return self.HALF_OPEN
+        return self.state
+
+    def before_request(self):
+        """Raise CircuitOpenError unless a request may be sent now."""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(self.panel_url, remaining)
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuit for {self.panel_url} half-open, probing")
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                raise CircuitOpenError(self.panel_url, self.reset_timeout)
+            self._probing = True
+
+    def record_success(self):
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for {self.panel_url} closed")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"Circuit for {self.panel_url} opened after {self.failures} consecutive failures")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def record_retried_failure(self):
+        """
+        A failed attempt the caller is about to retry.
+
+        Failures count once per logical request, when its last attempt fails,
+        so one slow click cannot use up most of the threshold. A failed probe
+        still reopens the circuit straight away.
+        """
+        if self.state == self.HALF_OPEN:
+            self.record_failure()
+
+    def release_probe(self):
+        """Forget an unfinished probe (e.g. a cancelled request) so the next call can probe again."""
+        self._probing = False
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(max, base * 2^attempt)]."""
+    return random.uniform(0, min(HTTP_RETRY_MAX_DELAY, HTTP_RETRY_BASE_DELAY * (2 ** attempt)))
+
+class MarzbanClient:
+    """
+    Long-lived HTTP client for a single Marzban panel.
+
+    Owns one keep-alive connection pool, so repeated calls to the same panel
+    reuse open TCP/TLS connections instead of paying a new handshake per click.
+    Identical GETs issued while one is already in flight share its response.
+    Idempotent calls are retried with jittered backoff, and a circuit breaker
+    fails fast while the panel is down. Every request is rate limited against
+    the interactive or background budget, so bulk jobs cannot starve clicks.
+    Access tokens are refreshed shortly before they expire and once after a 401.
+    """
+
+    def __init__(self, panel_url: str):
+        self.panel_url = panel_url.rstrip('/')
+        self._session: Optional[aiohttp.ClientSession] = None
+        # Optional panel features discovered by probing, e.g. {"bulk_expired_delete": True}
+        self.capabilities: Dict[str, bool] = {}
+        self._inflight: Dict[tuple, dict] = {}
+        self.breaker = CircuitBreaker(self.panel_url)
+        self.limiters = {name: PanelLimiter(*budget) for name, budget in TRAFFIC_BUDGETS.items()}
+        self.metrics = {"requests": 0, "coalesced": 0, "retries": 0}
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=HTTP_POOL_LIMIT,
+                limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+            )
+            self._session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+        return self._session
+
+    async def request(self, method: str, path: str, token: str, params: Optional[dict] = None, json: Any = None, timeout: Optional[float] = None) -> Tuple[int, Any]:
+        """
+        Send a request to the panel.
+
+        Args:
+            method: HTTP method.
+            path: API path starting with '/', e.g. '/api/users'.
+            token: Authorization token for the API.
+            params: Optional query parameters.
+            json: Optional JSON body.
+            timeout: Optional total timeout in seconds overriding HTTP_TIMEOUT.
+
+        Returns:
+            Tuple of (status_code, decoded JSON body or {} when the body is not JSON).
+
+        Raises:
+            CircuitOpenError: If the panel's circuit breaker is open.
+            aiohttp.ClientError, asyncio.TimeoutError: If the last attempt failed.
+        """
+        if token:
+            token = await ensure_fresh_token(self, token)
+        status, data = await self._request(method, path, token, params, json, timeout)
+        if status == 401 and token:
+            new_token = await refresh_token(self, token)
+            if new_token != token:
+                status, data = await self._request(method, path, new_token, params, json, timeout)
+        return status, data
+
+    async def _request(self, method: str, path: str, token: str, params: Optional[dict], json: Any, timeout: Optional[float]) -> Tuple[int, Any]:
+        if method != "GET":
+            return await self._send(method, path, token, params, json, timeout)
+        # Keyed by traffic class too, so a click never waits on a request queued in the background budget
+        key = (path, tuple(sorted((params or {}).items())), token, _traffic_class.get())
+        entry = self._inflight.get(key)
+        if entry is not None:
+            self.metrics["coalesced"] += 1
+            entry["joiners"] += 1
+            status, data = await asyncio.shield(entry["task"])
+            return status, copy.deepcopy(data)
+        task = asyncio.ensure_future(self._send(method, path, token, params, json, timeout))
+        entry = {"task": task, "joiners": 0}
+        self._inflight[key] = entry
+        task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        status, data = await asyncio.shield(task)
+        # Callers may modify what they get back, so a shared result is only ever handed out as copies
+        return status, copy.deepcopy(data) if entry["joiners"] else data
+
+    async def _send(self, method: str, path: str, token: Optional[str], params: Optional[dict], json: Any, timeout: Optional[float], data: Optional[dict] = None) -> Tuple[int, Any]:
+        attempts = HTTP_RETRY_ATTEMPTS if method in IDEMPOTENT_METHODS else 1
+        for attempt in range(attempts):
+            if attempt:
+                self.metrics["retries"] += 1
+                await asyncio.sleep(backoff_delay(attempt - 1))
+            self.breaker.before_request()
+            try:
+                status, result = await self._send_once(method, path, token, params, json, timeout, data)
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt + 1 >= attempts:
+                    self.breaker.record_failure()
+                    raise
+                self.breaker.record_retried_failure()
+                logger.warning(f"{method} {self.panel_url}{path} failed (attempt {attempt + 1}/{attempts}): {str(e) or type(e).__name__}")
+                continue
+            except BaseException:
+                self.breaker.release_probe()
+                raise
+            if status not in RETRYABLE_STATUSES:
+                self.breaker.record_success()
+                return status, result
+            if attempt + 1 >= attempts:
+                self.breaker.record_failure()
+                return status, result
+            self.breaker.record_retried_failure()
+            logger.warning(f"{method} {self.panel_url}{path} returned {status} (attempt {attempt + 1}/{attempts})")
+
+    async def _send_once(self, method: str, path: str, token: Optional[str], params: Optional[dict], json: Any, timeout: Optional[float], data: Optional[dict] = None) -> Tuple[int, Any]:
+        async with self.limiters[_traffic_class.get()].slot():
+            self.metrics["requests"] += 1
+            session = self._get_session()
+            headers = {"Authorization": f"Bearer {token}"} if token else {}
+            kwargs = {}
+            if timeout is not None:
+                kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+            async with session.request(method, f"{self.panel_url}{path}", headers=headers, params=params, json=json, data=data, **kwargs) as response:
+                raw_body = await response.read()
+                try:
+                    body = json_loads(raw_body) if raw_body.strip() else None
+                except ValueError:
+                    body = None
+                return response.status, body if body is not None else {}
+
+    async def login(self, username: str, password: str) -> Tuple[int, Any]:
+        """Exchange admin credentials for an access token (POST /api/admin/token)."""
+        return await self._send("POST", "/api/admin/token", None, None, None, None, data={"username": username, "password": password})
+
+    async def get(self, path: str, token: str, **kwargs) -> Tuple[int, Any]:
+        return await self.request("GET", path, token, **kwargs)
+
+    async def post(self, path: str, token: str, **kwargs) -> Tuple[int, Any]:
+        return await self.request("POST", path, token, **kwargs)
+
+    async def put(self, path: str, token: str, **kwargs) -> Tuple[int, Any]:
+        return await self.request("PUT", path, token, **kwargs)
+
+    async def delete(self, path: str, token: str, **kwargs) -> Tuple[int, Any]:
+        return await self.request("DELETE", path, token, **kwargs)
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+_clients: Dict[str, MarzbanClient] = {}
+
+def get_client(panel_url: str) -> MarzbanClient:
+    """Return the shared client for a panel, creating it on first use."""
+    key = panel_url.rstrip('/')
+    client = _clients.get(key)
+    if client is None:
+        client = MarzbanClient(key)
+        _clients[key] = client
+    return client
+
+async def close_clients():
+    """Close every pooled panel client. Called once at bot shutdown."""
+    clients = list(_clients.values())
+    metrics = get_client_metrics()
+    _clients.clear()
+    results = await asyncio.gather(*[client.close() for client in clients], return_exceptions=True)
+    for client, result in zip(clients, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Failed to close client for {client.panel_url}: {str(result)}")
+    logger.info(f"Closed {len(clients)} panel clients ({metrics['requests']} requests sent, {metrics['retries']} retries, {metrics['coalesced']} saved by coalescing)")
+
+def circuit_state(panel_url: str) -> str:
+    """Circuit breaker state of a panel: 'closed', 'open' or 'half_open'."""
+    client = _clients.get(panel_url.rstrip('/'))
+    return client.breaker.current_state() if client else CircuitBreaker.CLOSED
+
+def get_client_metrics() -> Dict[str, int]:
+    """Request counters summed over every panel client."""
+    totals = {"requests": 0, "coalesced": 0, "retries": 0}
+    for client in _clients.values():
+        for name, value in client.metrics.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
@@ -0,0 +1,63 @@
+import csv
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Optional
+from api.client import background_traffic
+from api.scan import iter_user_batches
+
+logger = logging.getLogger(__name__)
+
+EXPORT_FIELDS = ["username", "status", "used_traffic", "data_limit", "expire", "note", "subscription_url"]
+EXPORT_FORMATS = ("csv", "json")
+
+def format_export_expire(expire: Optional[int]) -> str:
+    """Expire timestamp as ISO 8601 UTC for CSV, or an empty string for users that never expire."""
+    if not expire:
+        return ""
+    return datetime.fromtimestamp(expire, tz=timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+def export_row(user: dict) -> dict:
+    return {field: user.get(field) for field in EXPORT_FIELDS}
+
+async def export_users(panel_url: str, token: str, path: str, fmt: str = "csv") -> int:
+    """
+    Stream every user of a panel into a CSV or JSON file.
+
+    Pages are written as they arrive and then dropped, so memory stays at a
+    few pages however many users the panel has. Row order follows page
+    arrival, not the panel's order.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        path: File to write.
+        fmt: "csv" or "json" (a JSON array of objects).
+
+    Returns:
+        Number of users written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    count = 0
+    # utf-8-sig so spreadsheet apps detect UTF-8 in Persian notes
+    with open(path, "w", encoding="utf-8-sig" if fmt == "csv" else "utf-8", newline="") as output:
+        if fmt == "csv":
+            writer = csv.DictWriter(output, fieldnames=EXPORT_FIELDS)
+            writer.writeheader()
+        else:
+            output.write("[")
+        with background_traffic():
+            async for users in iter_user_batches(panel_url, token):
+                for user in users:
+                    row = export_row(user)
+                    if fmt == "csv":
+                        row["expire"] = format_export_expire(row["expire"])
+                        writer.writerow(row)
+                    else:
+                        output.write(("," if count else "") + "\n" + json.dumps(row, ensure_ascii=False))
+                    count += 1
+        if fmt == "json":
+            output.write("\n]\n")
+    logger.info(f"Exported {count} users from {panel_url} as {fmt}")
+    return count
@@ -0,0 +1,218 @@
+import csv
+import io
+import logging
+import os
+import re
+import tempfile
+from datetime import datetime, timezone
+from typing import List, Tuple
+from aiogram import Bot, types
+from api.bulk import run_bounded
+from api.client import get_client, background_traffic
+from api.marzban_api import get_inbounds, new_user_payload, invalidate_inbounds_after_failed_create
+from bot_config import BULK_CONCURRENCY, BULK_PROGRESS_INTERVAL, IMPORT_MAX_FILE_SIZE
+from database.db import get_panels
+from utils.message_utils import make_progress_reporter
+from utils.user_events import users_updated
+
+logger = logging.getLogger(__name__)
+
+# Marzban's own username rule: 3-32 characters of letters, digits and _ @ . -
+USERNAME_PATTERN = re.compile(r"[A-Za-z0-9_@.\-]{3,32}")
+# Statuses an admin can set; expired/limited are computed by the panel
+SETTABLE_STATUSES = ("active", "disabled", "on_hold")
+
+def parse_import_expire(value: str) -> int:
+    """Accept empty/0 (never), a Unix timestamp, or an ISO 8601 date as written by the export."""
+    value = value.strip()
+    if not value or value == "0":
+        return 0
+    if value.isdigit():
+        return int(value)
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"تاریخ انقضای نامعتبر: {value}")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp())
+
+def parse_import_data_limit(value: str) -> int:
+    """Accept empty/0 (unlimited), bytes, or a number of gigabytes with a GB suffix."""
+    value = value.strip().lower()
+    if not value:
+        return 0
+    try:
+        if value.endswith("gb"):
+            return int(float(value[:-2]) * 1e9)
+        return int(float(value))
+    except ValueError:
+        raise ValueError(f"حجم نامعتبر: {value}")
+
+def parse_import_row(row: dict) -> dict:
+    """
+    Validate one CSV row and return the fields to apply.
+
+    Only username is required; data_limit, expire, note and status are
+    optional columns. Columns the panel computes (used_traffic,
+    subscription_url) are ignored, so an export file can be imported as is.
+
+    Raises:
+        ValueError: With a Persian message describing the problem.
+    """
+    username = (row.get("username") or "").strip()
+    if not USERNAME_PATTERN.fullmatch(username):
+        raise ValueError(f"نام کاربری نامعتبر: «{username}»")
+    # Only columns present in the file are applied, so updates never blank out other fields
+    fields = {"username": username}
+    if row.get("data_limit") is not None:
+        fields["data_limit"] = parse_import_data_limit(row["data_limit"])
+        if fields["data_limit"] < 0:
+            raise ValueError("حجم نمی‌تواند منفی باشد")
+    if row.get("expire") is not None:
+        fields["expire"] = parse_import_expire(row["expire"])
+    if row.get("note") is not None:
+        fields["note"] = row["note"].strip()
+    status = (row.get("status") or "").strip().lower()
+    if status in SETTABLE_STATUSES:
+        fields["status"] = status
+    return fields
+
+async def import_users_csv(panel_url: str, token: str, path: str, inbounds_data: dict, concurrency: int = BULK_CONCURRENCY, progress=None) -> Tuple[int, int, List[Tuple[int, str, str]]]:
+    """
+    Create or update users from a CSV file, reading it row by row.
+
+    A username that does not exist yet is created on every vless/vmess
+    inbound; an existing one has its limit, expiry, note and status updated.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        path: CSV file with a header row.
+        inbounds_data: Panel inbounds for new users.
+        concurrency: Maximum number of requests in flight.
+        progress: Optional coroutine called with (done, total) after each row.
+
+    Returns:
+        Tuple of (created_count, updated_count, [(line_number, username, error)]).
+    """
+    client = get_client(panel_url)
+    counts = {"created": 0, "updated": 0}
+    errors = []
+    seen = set()
+    # Users the panel returned, propagated to the local copies in one batch at the end
+    applied = []
+
+    with open(path, encoding="utf-8-sig", newline="") as source:
+        total = max(0, sum(1 for line in csv.reader(source) if line) - 1)
+
+    async def apply_row(numbered_row: Tuple[int, dict]) -> bool:
+        line_number, row = numbered_row
+        try:
+            fields = parse_import_row(row)
+        except ValueError as e:
+            errors.append((line_number, (row.get("username") or "").strip(), str(e)))
+            return False
+        username = fields["username"]
+        if username in seen:
+            errors.append((line_number, username, "نام کاربری تکراری در فایل"))
+            return False
+        seen.add(username)
+        try:
+            payload = new_user_payload(username, inbounds_data, fields.get("data_limit", 0), fields.get("expire", 0), fields.get("note", ""))
+            if fields.get("status") in ("active", "on_hold"):
+                payload["status"] = fields["status"]
+            status, result = await client.post("/api/user", token, json=payload)
+            if status == 409:
+                changes = {key: value for key, value in fields.items() if key != "username"}
+                status, result = await client.put(f"/api/user/{username}", token, json=changes)
+                kind = "updated"
+            else:
+                kind = "created"
+                if status != 200:
+                    invalidate_inbounds_after_failed_create(panel_url)
+        except Exception as e:
+            errors.append((line_number, username, str(e) or type(e).__name__))
+            return False
+        if status != 200:
+            detail = result.get("detail", f"HTTP {status}") if isinstance(result, dict) else f"HTTP {status}"
+            errors.append((line_number, username, str(detail)))
+            return False
+        if kind == "created" and fields.get("status") == "disabled":
+            # New users cannot be created disabled; disable them right after
+            disable_status, disabled_user = await client.put(f"/api/user/{username}", token, json={"status": "disabled"})
+            if disable_status == 200:
+                result = disabled_user
+            else:
+                errors.append((line_number, username, "کاربر ایجاد شد ولی غیرفعال نشد"))
+        counts[kind] += 1
+        applied.append(result)
+        return True
+
+    with open(path, encoding="utf-8-sig", newline="") as source:
+        reader = csv.DictReader(source)
+        if not reader.fieldnames or "username" not in [name.strip() for name in reader.fieldnames]:
+            raise ValueError("فایل باید سطر عنوان با ستون username داشته باشد.")
+        reader.fieldnames = [name.strip() for name in reader.fieldnames]
+        # Rows are read lazily as workers pull them; line_num is the file line the row ended on
+        rows = ((reader.line_num, row) for row in reader)
+        try:
+            with background_traffic():
+                await run_bounded(rows, apply_row, concurrency, progress, total)
+        finally:
+            await users_updated(panel_url, token, applied)
+    errors.sort()
+    return counts["created"], counts["updated"], errors
+
+async def import_users_logic(chat_id: int, selected_panel_alias: str, document: types.Document, bot: Bot) -> bool:
+    """
+    Download an uploaded CSV and import its users into the selected panel.
+
+    Args:
+        chat_id: Telegram chat ID.
+        selected_panel_alias: Alias of the selected panel.
+        document: The uploaded CSV document.
+        bot: Telegram bot instance.
+
+    Returns:
+        Boolean indicating whether any row was applied.
+    """
+    panels = get_panels(chat_id)
+    panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+    if not panel:
+        await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+        return False
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        await bot.send_message(chat_id, f"⚠️ حجم فایل بیش از {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} مگابایت است.")
+        return False
+
+    title = "📥 ورود کاربران از CSV"
+    fd, path = tempfile.mkstemp(suffix=".csv")
+    os.close(fd)
+    try:
+        await bot.download(document, destination=path)
+        inbounds_data = await get_inbounds(panel[1], panel[2])
+        progress_message = await bot.send_message(chat_id, f"{title}\n🔍 در حال خواندن فایل...")
+        report = make_progress_reporter(bot, chat_id, progress_message.message_id, title, BULK_PROGRESS_INTERVAL)
+        created, updated, errors = await import_users_csv(panel[1], panel[2], path, inbounds_data, BULK_CONCURRENCY, report)
+    except Exception as e:
+        logger.error(f"Import users error: {str(e)}")
+        await bot.send_message(chat_id, f"❌ خطا در ورود کاربران: {str(e)}")
+        return False
+    finally:
+        os.remove(path)
+
+    response_text = f"✅ {created} کاربر ایجاد و {updated} کاربر به‌روزرسانی شد."
+    if errors:
+        response_text += f"\n⚠️ {len(errors)} سطر اعمال نشد:\n" + "\n".join(
+            f"سطر {line_number} ({username}): {error}" for line_number, username, error in errors[:10]
+        ) + ("\n..." if len(errors) > 10 else "")
+    await bot.send_message(chat_id, response_text[:4000])
+    if len(errors) > 10:
+        report_file = io.StringIO()
+        writer = csv.writer(report_file)
+        writer.writerow(["line", "username", "error"])
+        writer.writerows(errors)
+        document = types.BufferedInputFile(report_file.getvalue().encode("utf-8-sig"), filename="import_errors.csv")
+        await bot.send_document(chat_id, document, caption="📋 فهرست کامل خطاها")
+    return bool(created or updated)
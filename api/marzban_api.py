@@ -1,15 +1,30 @@
-import aiohttp
+import copy
 import logging
-import socket
 import asyncio
+import os
+import tempfile
+import time
 from datetime import datetime, timezone
 from uuid import uuid4
 from typing import List, Tuple, Optional
-from database.db import get_panels
-from utils.formatting import format_traffic, format_expire_time
-from bot.menus import main_menu, user_action_menu
-from bot_config import ADMIN_IDS
-from utils.message_utils import cleanup_messages
+from database.db import get_panels, get_all_panels
+from api.client import get_client, background_traffic
+from api.auth import panel_admin
+from api.scan import fetch_users_page, iter_user_batches
+from utils.formatting import format_traffic, format_expire_time, format_usage_forecast, format_age
+from bot.menus import main_menu, user_action_menu, BULK_MODIFY_LABELS
+from bot_config import ADMIN_IDS, CACHE_DURATION, BULK_CONCURRENCY, BULK_PROGRESS_INTERVAL, INBOUNDS_CACHE_TTL, USER_CACHE_TTL, OVERVIEW_PANEL_TIMEOUT, PAGE_CACHE_TTL
+from utils.cache import get_inbounds_cache, set_inbounds_cache, invalidate_inbounds_cache, get_user_cache, set_user_cache, get_page_cache, set_page_cache, get_users_total_cache, set_users_total_cache
+from utils.message_utils import cleanup_messages, make_progress_reporter
+from utils.user_mirror import mirror_owner
+from utils.alerts import observe_users, finish_panel_scan
+from utils.usage_store import record_usage_samples, usage_forecast
+from utils.user_events import user_updated, user_deleted, users_updated, users_deleted
+from database.db import get_panel_users_page, get_panel_users_stats, count_panel_users
+from api.bulk import collect_usernames, collect_users, bulk_delete_users, bulk_create_users, bulk_modify_users, user_modification, delete_expired_server_side
+from api.export import export_users
+from api.reports import get_usage_report, histogram_labels
+from utils.user_filter import user_matches, panel_query_params, describe_user_filter
 from aiogram.fsm.context import FSMContext
 from aiogram import Bot, types
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
@@ -20,6 +35,97 @@ def is_owner(chat_id: int) -> bool:
     """Check if the user is an owner based on ADMIN_IDS."""
     return chat_id in ADMIN_IDS
 
+async def get_inbounds(panel_url: str, token: str, force_refresh: bool = False) -> dict:
+    """
+    Get the panel's inbounds ({protocol: [inbound settings]}), cached for INBOUNDS_CACHE_TTL.
+    
+    Concurrent misses for the same panel are coalesced by the client into one request.
+    
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        force_refresh: Whether to bypass cache.
+    
+    Returns:
+        Dictionary of inbounds keyed by protocol.
+    """
+    if not force_refresh:
+        cached_inbounds = get_inbounds_cache(panel_url, INBOUNDS_CACHE_TTL)
+        if cached_inbounds is not None:
+            return cached_inbounds
+    status, inbounds_data = await get_client(panel_url).get("/api/inbounds", token)
+    if status != 200:
+        raise ValueError(f"دریافت اینباند‌ها ناموفق: {inbounds_data.get('detail', 'No details')}")
+    set_inbounds_cache(panel_url, inbounds_data)
+    return inbounds_data
+
+def invalidate_inbounds_after_failed_create(panel_url: str):
+    """
+    Drop the cached inbounds after the panel rejected a user creation.
+
+    A stale inbound tag is a common cause, so the next attempt re-reads them.
+    """
+    invalidate_inbounds_cache(panel_url)
+
+async def get_user(panel_url: str, token: str, username: str, force_refresh: bool = False, timeout: Optional[float] = None) -> Tuple[int, dict]:
+    """
+    Read-through lookup of a single user, cached for USER_CACHE_TTL.
+    
+    The cache is also filled by mutation responses and list pages, so a
+    click that follows a write usually costs no extra request.
+    
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        username: Username to look up.
+        force_refresh: Whether to bypass cache.
+        timeout: Optional request timeout in seconds.
+    
+    Returns:
+        Tuple of (status_code, user). The user is a copy and safe to modify.
+    """
+    if not force_refresh:
+        cached_user = get_user_cache(panel_url, token, username, USER_CACHE_TTL)
+        if cached_user is not None:
+            return 200, copy.deepcopy(cached_user)
+    kwargs = {"timeout": timeout} if timeout else {}
+    status, user = await get_client(panel_url).get(f"/api/user/{username}", token, **kwargs)
+    if status == 200 and user.get("username"):
+        set_user_cache(panel_url, token, user)
+        return status, copy.deepcopy(user)
+    return status, user
+
+def new_user_payload(username: str, inbounds_data: dict, data_limit, expire_time: int, note: str) -> dict:
+    """
+    Build the POST /api/user body for a new vless + vmess user on every matching inbound.
+    
+    Args:
+        username: Username of the new user.
+        inbounds_data: Panel inbounds as returned by get_inbounds.
+        data_limit: Data limit in bytes, 0 for unlimited.
+        expire_time: Expiry as a Unix timestamp, 0 for never.
+        note: Note stored with the user.
+    
+    Returns:
+        Request body for the panel.
+    """
+    inbounds_dict = {
+        protocol: [inbound['tag'] for inbound in settings]
+        for protocol, settings in inbounds_data.items()
+        if protocol in ["vless", "vmess"]
+    }
+    return {
+        "username": username,
+        "proxies": {
+            "vless": {"id": str(uuid4())},
+            "vmess": {"id": str(uuid4())}
+        },
+        "inbounds": inbounds_dict,
+        "data_limit": data_limit,
+        "expire": expire_time,
+        "note": note
+    }
+
 async def create_user_logic(chat_id: int, state: FSMContext, note: str) -> Tuple[Optional[str], Optional[str]]:
     """
     Create a new user in the selected Marzban panel.
@@ -45,58 +151,101 @@ async def create_user_logic(chat_id: int, state: FSMContext, note: str) -> Tuple
         return None, "⚠️ پنل انتخاب‌شده یافت نشد."
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}"}
-            
-            # Fetch inbound configurations
-            async with session.get(f"{panel[1].rstrip('/')}/api/inbounds", headers=headers) as response:
-                inbounds_data = await response.json()
-                if response.status != 200:
-                    raise ValueError(f"دریافت اینباند‌ها ناموفق: {inbounds_data.get('detail', 'No details')}")
-                inbounds_dict = {
-                    protocol: [inbound['tag'] for inbound in settings]
-                    for protocol, settings in inbounds_data.items()
-                    if protocol in ["vless", "vmess"]
-                }
-            
-            # Create user data
-            vless_id = str(uuid4())
-            vmess_id = str(uuid4())
-            user_data = {
-                "username": username,
-                "proxies": {
-                    "vless": {"id": vless_id},
-                    "vmess": {"id": vmess_id}
-                },
-                "inbounds": inbounds_dict,
-                "data_limit": data_limit,
-                "expire": expire_time,
-                "note": note
-            }
-            
-            # Create user
-            async with session.post(f"{panel[1].rstrip('/')}/api/user", json=user_data, headers=headers) as response:
-                result = await response.json()
-                if response.status != 200:
-                    raise ValueError(f"ایجاد کاربر ناموفق: {result.get('detail', 'No details')}")
-            
-            # Fetch subscription URL
-            async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                if response.status == 200:
-                    user_data = await response.json()
-                    subscription_url = user_data.get("subscription_url", "ناموجود")
-                    return (
-                        f"✅ کاربر '{username}' با موفقیت ایجاد شد!\n"
-                        f"📊 حجم: {format_traffic(data_limit) if data_limit else 'نامحدود'}\n"
-                        f"⏰ انقضا: {expire_days if expire_days > 0 else 'نامحدود'} روز\n"
-                        f"🔗 لینک اشتراک: {subscription_url}",
-                        None
-                    )
-                return "❌ نتوانستم لینک اشتراک را دریافت کنم.", None
+        client = get_client(panel[1])
+        
+        # Fetch inbound configurations (cached per panel)
+        inbounds_data = await get_inbounds(panel[1], panel[2])
+        user_data = new_user_payload(username, inbounds_data, data_limit, expire_time, note)
+        
+        # Create user
+        status, result = await client.post("/api/user", panel[2], json=user_data)
+        if status != 200:
+            invalidate_inbounds_after_failed_create(panel[1])
+            raise ValueError(f"ایجاد کاربر ناموفق: {result.get('detail', 'No details')}")
+        user_updated(panel[1], panel[2], result)
+        
+        # The created user, including its subscription URL, comes back in the POST response
+        subscription_url = result.get("subscription_url", "ناموجود")
+        return (
+            f"✅ کاربر '{username}' با موفقیت ایجاد شد!\n"
+            f"📊 حجم: {format_traffic(data_limit) if data_limit else 'نامحدود'}\n"
+            f"⏰ انقضا: {expire_days if expire_days > 0 else 'نامحدود'} روز\n"
+            f"🔗 لینک اشتراک: {subscription_url}",
+            None
+        )
     except Exception as e:
         logger.error(f"Create user error for {username}: {str(e)}")
         return None, f"❌ خطا در ایجاد کاربر: {str(e)}"
 
+def bulk_usernames(prefix: str, start: int, count: int, width: int = 0) -> List[str]:
+    """Usernames prefix+counter, with the counter zero-padded to `width` digits (e.g. shop001)."""
+    return [f"{prefix}{str(number).zfill(width)}" for number in range(start, start + count)]
+
+async def bulk_create_users_logic(chat_id: int, state: FSMContext, bot: Bot) -> bool:
+    """
+    Create a batch of users from the template collected in the bulk-create flow.
+    
+    Inbounds are read once for the whole batch, users are created concurrently
+    under the panel's background rate limit, and every subscription link is
+    sent back as one text file.
+    
+    Args:
+        chat_id: Telegram chat ID.
+        state: FSM context holding bulk_prefix, bulk_start, bulk_width, bulk_count,
+            bulk_data_limit and bulk_expire_days.
+        bot: Telegram bot instance.
+    
+    Returns:
+        Boolean indicating whether any user was created.
+    """
+    data = await state.get_data()
+    selected_panel_alias = data.get("selected_panel_alias")
+    panels = get_panels(chat_id)
+    panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+    if not panel:
+        await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+        return False
+    
+    usernames = bulk_usernames(data["bulk_prefix"], data["bulk_start"], data["bulk_count"], data.get("bulk_width", 0))
+    data_limit = data.get("bulk_data_limit", 0)
+    expire_days = data.get("bulk_expire_days", 0)
+    expire_time = int(datetime.now(timezone.utc).timestamp()) + expire_days * 86400 if expire_days > 0 else 0
+    title = f"📦 ایجاد گروهی {len(usernames)} کاربر"
+    
+    try:
+        inbounds_data = await get_inbounds(panel[1], panel[2])
+        payloads = [new_user_payload(username, inbounds_data, data_limit, expire_time, "") for username in usernames]
+        progress_message = await bot.send_message(chat_id, f"{title}\n⏳ پیشرفت: 0/{len(payloads)}")
+        report = make_progress_reporter(bot, chat_id, progress_message.message_id, title, BULK_PROGRESS_INTERVAL)
+        created_users, failed_users = await bulk_create_users(panel[1], panel[2], payloads, BULK_CONCURRENCY, report)
+    except Exception as e:
+        logger.error(f"Bulk create error: {str(e)}")
+        await bot.send_message(chat_id, f"❌ خطا در ایجاد گروهی کاربران: {str(e)}")
+        return False
+    
+    await users_updated(panel[1], panel[2], created_users)
+    if failed_users:
+        invalidate_inbounds_after_failed_create(panel[1])
+    
+    response_text = (
+        f"✅ {len(created_users)} کاربر ایجاد شد.\n"
+        f"📊 حجم: {format_traffic(data_limit) if data_limit else 'نامحدود'}\n"
+        f"⏰ انقضا: {expire_days if expire_days > 0 else 'نامحدود'} روز"
+    )
+    if failed_users:
+        response_text += f"\n⚠️ ایجاد {len(failed_users)} کاربر ناموفق بود:\n" + "\n".join(
+            f"{username}: {error}" for username, error in failed_users[:10]
+        ) + ("\n..." if len(failed_users) > 10 else "")
+    if created_users:
+        # Keep the file in the requested order, whatever order the requests finished in
+        links = {user.get("username"): user.get("subscription_url", "ناموجود") for user in created_users}
+        lines = [f"{username} {links[username]}" for username in usernames if username in links]
+        document = types.BufferedInputFile("\n".join(lines).encode("utf-8"), filename=f"{data['bulk_prefix']}_links.txt")
+        await bot.send_document(chat_id, document, caption=response_text[:1024])
+    else:
+        await bot.send_message(chat_id, response_text)
+    return bool(created_users)
+
 async def show_user_info(query: types.CallbackQuery, state: FSMContext, username: str, chat_id: int, selected_panel_alias: str, bot: Bot):
     """
     Display information about a specific user.
@@ -118,28 +267,27 @@ async def show_user_info(query: types.CallbackQuery, state: FSMContext, username
         return
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}"}
-            async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                if response.status != 200:
-                    result = await response.json()
-                    message = await bot.send_message(chat_id, f"❌ خطا در دریافت اطلاعات: {result.get('detail', 'کاربر یافت نشد')}")
-                    await state.update_data(login_messages=[message.message_id])
-                    return
-                user = await response.json()
-                protocols = ", ".join(user.get("proxies", {}).keys()) or "هیچ"
-                response_text = (
-                    f"👤 نام کاربری: {user['username']}\n"
-                    f"📊 وضعیت: {user['status']}\n"
-                    f"📈 حجم مصرفی: {format_traffic(user.get('used_traffic', 0))}\n"
-                    f"📊 حجم کل: {format_traffic(user.get('data_limit', 0)) if user.get('data_limit') else 'نامحدود'}\n"
-                    f"⏰ زمان انقضا: {format_expire_time(user.get('expire'))}\n"
-                    f"📝 یادداشت: {user.get('note', 'هیچ')}\n"
-                    f"🔌 پروتکل‌ها: {protocols}\n"
-                    f"🔗 لینک اشتراک: {user.get('subscription_url', 'ناموجود')}"
-                )
-                message = await bot.send_message(chat_id, response_text, reply_markup=user_action_menu(username))
-                await state.update_data(login_messages=[message.message_id])
+        status, user = await get_user(panel[1], panel[2], username, timeout=5)
+        if status != 200:
+            message = await bot.send_message(chat_id, f"❌ خطا در دریافت اطلاعات: {user.get('detail', 'کاربر یافت نشد')}")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        protocols = ", ".join(user.get("proxies", {}).keys()) or "هیچ"
+        forecast = await asyncio.to_thread(usage_forecast, panel[1], user["username"], user.get("used_traffic") or 0, user.get("data_limit") or 0)
+        await asyncio.to_thread(record_usage_samples, panel[1], [user])
+        response_text = (
+            f"👤 نام کاربری: {user['username']}\n"
+            f"📊 وضعیت: {user['status']}\n"
+            f"📈 حجم مصرفی: {format_traffic(user.get('used_traffic', 0))}\n"
+            f"📊 حجم کل: {format_traffic(user.get('data_limit', 0)) if user.get('data_limit') else 'نامحدود'}\n"
+            f"{format_usage_forecast(forecast)}"
+            f"⏰ زمان انقضا: {format_expire_time(user.get('expire'))}\n"
+            f"📝 یادداشت: {user.get('note', 'هیچ')}\n"
+            f"🔌 پروتکل‌ها: {protocols}\n"
+            f"🔗 لینک اشتراک: {user.get('subscription_url', 'ناموجود')}"
+        )
+        message = await bot.send_message(chat_id, response_text, reply_markup=user_action_menu(username))
+        await state.update_data(login_messages=[message.message_id])
     except Exception as e:
         logger.error(f"Show user info error for {username}: {str(e)}")
         message = await bot.send_message(chat_id, f"❌ خطا در نمایش اطلاعات: {str(e)}")
@@ -173,15 +321,13 @@ async def delete_user_logic(query: types.CallbackQuery, state: FSMContext, usern
         return
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}"}
-            async with session.delete(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                if response.status == 200:
-                    message = await bot.send_message(chat_id, f"🗑 کاربر '{username}' با موفقیت حذف شد.", reply_markup=main_menu(is_owner(chat_id)))
-                    await state.update_data(login_messages=[message.message_id])
-                else:
-                    result = await response.json()
-                    raise ValueError(f"حذف کاربر ناموفق: {result.get('detail', 'No details')}")
+        status, result = await get_client(panel[1]).delete(f"/api/user/{username}", panel[2], timeout=5)
+        if status == 200:
+            user_deleted(panel[1], panel[2], username)
+            message = await bot.send_message(chat_id, f"🗑 کاربر '{username}' با موفقیت حذف شد.", reply_markup=main_menu(is_owner(chat_id)))
+            await state.update_data(login_messages=[message.message_id])
+        else:
+            raise ValueError(f"حذف کاربر ناموفق: {result.get('detail', 'No details')}")
     except Exception as e:
         logger.error(f"Delete user error for {username}: {str(e)}")
         message = await bot.send_message(chat_id, f"❌ خطا در حذف کاربر: {str(e)}")
@@ -216,22 +362,20 @@ async def disable_user_logic(query: types.CallbackQuery, state: FSMContext, user
         return
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}", "Content-Type": "application/json"}
-            async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                if response.status != 200:
-                    raise ValueError("کاربر یافت نشد")
-                current_user = await response.json()
-            
-            current_user["status"] = "disabled"
-            async with session.put(f"{panel[1].rstrip('/')}/api/user/{username}", json=current_user, headers=headers) as response:
-                if response.status == 200:
-                    message = await bot.send_message(chat_id, f"⏹ کاربر '{username}' با موفقیت غیرفعال شد.")
-                    await state.update_data(login_messages=[message.message_id])
-                    await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
-                else:
-                    result = await response.json()
-                    raise ValueError(f"خاموش کردن کاربر ناموفق: {result.get('detail', 'No details')}")
+        client = get_client(panel[1])
+        status, current_user = await get_user(panel[1], panel[2], username, timeout=5)
+        if status != 200:
+            raise ValueError("کاربر یافت نشد")
+        
+        current_user["status"] = "disabled"
+        status, result = await client.put(f"/api/user/{username}", panel[2], json=current_user, timeout=5)
+        if status == 200:
+            user_updated(panel[1], panel[2], result)
+            message = await bot.send_message(chat_id, f"⏹ کاربر '{username}' با موفقیت غیرفعال شد.")
+            await state.update_data(login_messages=[message.message_id])
+            await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
+        else:
+            raise ValueError(f"خاموش کردن کاربر ناموفق: {result.get('detail', 'No details')}")
     except Exception as e:
         logger.error(f"Disable user error for {username}: {str(e)}")
         message = await bot.send_message(chat_id, f"❌ خطا در غیرفعال کردن کاربر: {str(e)}")
@@ -265,22 +409,20 @@ async def enable_user_logic(query: types.CallbackQuery, state: FSMContext, usern
         return
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}", "Content-Type": "application/json"}
-            async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                if response.status != 200:
-                    raise ValueError("کاربر یافت نشد")
-                current_user = await response.json()
-            
-            current_user["status"] = "active"
-            async with session.put(f"{panel[1].rstrip('/')}/api/user/{username}", json=current_user, headers=headers) as response:
-                if response.status == 200:
-                    message = await bot.send_message(chat_id, f"▶️ کاربر '{username}' با موفقیت فعال شد.")
-                    await state.update_data(login_messages=[message.message_id])
-                    await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
-                else:
-                    result = await response.json()
-                    raise ValueError(f"روشن کردن کاربر ناموفق: {result.get('detail', 'No details')}")
+        client = get_client(panel[1])
+        status, current_user = await get_user(panel[1], panel[2], username, timeout=5)
+        if status != 200:
+            raise ValueError("کاربر یافت نشد")
+        
+        current_user["status"] = "active"
+        status, result = await client.put(f"/api/user/{username}", panel[2], json=current_user, timeout=5)
+        if status == 200:
+            user_updated(panel[1], panel[2], result)
+            message = await bot.send_message(chat_id, f"▶️ کاربر '{username}' با موفقیت فعال شد.")
+            await state.update_data(login_messages=[message.message_id])
+            await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
+        else:
+            raise ValueError(f"روشن کردن کاربر ناموفق: {result.get('detail', 'No details')}")
     except Exception as e:
         logger.error(f"Enable user error for {username}: {str(e)}")
         message = await bot.send_message(chat_id, f"❌ خطا در فعال کردن کاربر: {str(e)}")
@@ -314,31 +456,29 @@ async def delete_configs_logic(query: types.CallbackQuery, state: FSMContext, us
         return
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}", "Content-Type": "application/json"}
-            async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                if response.status != 200:
-                    message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
-                    await state.update_data(login_messages=[message.message_id])
-                    return
-                current_user = await response.json()
-            
-            current_user["inbounds"] = {}
-            async with session.put(f"{panel[1].rstrip('/')}/api/user/{username}", json=current_user, headers=headers) as response:
-                if response.status == 200:
-                    message = await bot.send_message(chat_id, f"🗑 همه کانفیگ‌های کاربر '{username}' با موفقیت حذف شد.")
-                    await state.update_data(login_messages=[message.message_id])
-                    await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
-                else:
-                    result = await response.json()
-                    message = await bot.send_message(chat_id, f"❌ خطا در حذف کانفیگ‌ها: {result.get('detail', 'No details')}")
-                    await state.update_data(login_messages=[message.message_id])
+        client = get_client(panel[1])
+        status, current_user = await get_user(panel[1], panel[2], username, timeout=5)
+        if status != 200:
+            message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        
+        current_user["inbounds"] = {}
+        status, result = await client.put(f"/api/user/{username}", panel[2], json=current_user, timeout=5)
+        if status == 200:
+            user_updated(panel[1], panel[2], result)
+            message = await bot.send_message(chat_id, f"🗑 همه کانفیگ‌های کاربر '{username}' با موفقیت حذف شد.")
+            await state.update_data(login_messages=[message.message_id])
+            await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
+        else:
+            message = await bot.send_message(chat_id, f"❌ خطا در حذف کانفیگ‌ها: {result.get('detail', 'No details')}")
+            await state.update_data(login_messages=[message.message_id])
     except Exception as e:
         logger.error(f"Error deleting configs for {username}: {str(e)}")
         message = await bot.send_message(chat_id, f"❌ خطا: {str(e)}")
         await state.update_data(login_messages=[message.message_id])
 
-async def fetch_users_batch(panel_url: str, token: str, offset: int, limit: int) -> List[dict]:
+async def fetch_users_batch(panel_url: str, token: str, offset: int, limit: int) -> Tuple[List[dict], Optional[int]]:
     """
     Fetch a batch of users from the Marzban API.
     
@@ -349,89 +489,271 @@ async def fetch_users_batch(panel_url: str, token: str, offset: int, limit: int)
         limit: Number of users to fetch.
     
     Returns:
-        List of user dictionaries.
+        Tuple of (list of user dictionaries, total users on the panel or None if not reported).
     """
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-            headers = {"Authorization": f"Bearer {token}"}
-            params = {"offset": offset, "limit": limit}
-            async with session.get(f"{panel_url.rstrip('/')}/api/users", headers=headers, params=params) as response:
-                if response.status != 200:
-                    result = await response.json()
-                    raise ValueError(f"دریافت کاربران ناموفق: {result.get('detail', 'No details')}")
-                users_data = await response.json()
-                if "users" not in users_data:
-                    raise ValueError("پاسخ API شامل کلید 'users' نیست")
-                return users_data.get("users", [])
+        mirror_admin = mirror_owner(panel_url, token)
+        if mirror_admin is not None:
+            key = panel_url.rstrip('/')
+            return get_panel_users_page(key, mirror_admin, offset, limit), count_panel_users(key, mirror_admin)
+        users_data = await fetch_users_page(panel_url, token, offset, limit)
+        users = users_data.get("users", [])
+        for user in users:
+            if user.get("username"):
+                set_user_cache(panel_url, token, user)
+        total = users_data.get("total")
+        if not isinstance(total, int):
+            total = None
+        else:
+            set_users_total_cache(panel_url, token, total)
+        return users, total
     except Exception as e:
         logger.error(f"Error fetching users batch (offset={offset}, limit={limit}): {str(e)}")
         raise
 
-async def get_users_stats(panel_url: str, token: str, force_refresh: bool = False) -> dict:
+_prefetch_tasks = set()
+
+async def get_users_page(chat_id: int, panel_url: str, token: str, page: int, limit: int) -> Tuple[List[dict], Optional[int]]:
+    """
+    Get one page of the user list, from this chat's page cache when it was prefetched.
+    
+    Args:
+        chat_id: Telegram chat ID owning the page cache.
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        page: Zero-based page number.
+        limit: Users per page.
+    
+    Returns:
+        Tuple of (list of user dictionaries, total users on the panel or None if unknown).
+    """
+    users = get_page_cache(chat_id, panel_url, page, limit, PAGE_CACHE_TTL)
+    if users is not None:
+        return users, get_users_total_cache(panel_url, token, CACHE_DURATION)
+    users, total = await fetch_users_batch(panel_url, token, page * limit, limit)
+    set_page_cache(chat_id, panel_url, page, limit, users)
+    return users, total
+
+def prefetch_adjacent_pages(chat_id: int, panel_url: str, token: str, page: int, limit: int, has_next: bool):
+    """Fetch pages page-1 and page+1 into the chat's page cache in the background."""
+    if mirror_owner(panel_url, token) is not None:
+        return  # Pages come from local SQLite; nothing to hide
+    for neighbour in (page + 1 if has_next else -1, page - 1):
+        if neighbour < 0 or get_page_cache(chat_id, panel_url, neighbour, limit, PAGE_CACHE_TTL) is not None:
+            continue
+        task = asyncio.create_task(_prefetch_page(chat_id, panel_url, token, neighbour, limit))
+        _prefetch_tasks.add(task)
+        task.add_done_callback(_prefetch_tasks.discard)
+
+async def _prefetch_page(chat_id: int, panel_url: str, token: str, page: int, limit: int):
+    try:
+        # Speculative reads must not use up the budget of real clicks
+        with background_traffic():
+            users, _ = await fetch_users_batch(panel_url, token, page * limit, limit)
+        set_page_cache(chat_id, panel_url, page, limit, users)
+    except Exception as e:
+        logger.warning(f"Prefetch of users page {page} failed for {panel_url}: {str(e)}")
+
+async def _stats_from_system(panel_url: str, token: str) -> Optional[dict]:
+    """Build stats from the user counters in /api/system, or None if the panel does not report them."""
+    status, data = await get_client(panel_url).get("/api/system", token, timeout=5)
+    required_keys = ["total_user", "users_active", "users_disabled", "users_expired", "users_limited"]
+    if status != 200 or not all(key in data for key in required_keys):
+        return None
+    return {
+        "total": data["total_user"],
+        "active": data["users_active"],
+        "inactive": data["users_disabled"] + data.get("users_on_hold", 0),
+        "expired": data["users_expired"],
+        "limited": data["users_limited"]
+    }
+
+async def _count_users(panel_url: str, token: str, status: Optional[str] = None) -> Optional[int]:
+    """Return the `total` of a one-user /api/users page, optionally filtered by status."""
+    params = {"offset": 0, "limit": 1}
+    if status:
+        params["status"] = status
+    response_status, data = await get_client(panel_url).get("/api/users", token, params=params, timeout=5)
+    if response_status != 200 or not isinstance(data.get("total"), int):
+        return None
+    return data["total"]
+
+async def _stats_from_status_totals(panel_url: str, token: str) -> Optional[dict]:
+    """Build stats from status-filtered /api/users?limit=1 totals, or None if the panel does not report totals."""
+    statuses = [None, "active", "disabled", "on_hold", "expired", "limited"]
+    counts = await asyncio.gather(*[_count_users(panel_url, token, status) for status in statuses])
+    if any(count is None for count in counts):
+        return None
+    total, active, disabled, on_hold, expired, limited = counts
+    return {"total": total, "active": active, "inactive": disabled + on_hold, "expired": expired, "limited": limited}
+
+async def _stats_from_full_scan(panel_url: str, token: str) -> dict:
+    """Build stats by downloading every user. Last resort for panels without server-side counters."""
+    stats = {"total": 0, "active": 0, "inactive": 0, "expired": 0, "limited": 0}
+    now = int(datetime.now(timezone.utc).timestamp())
+    seen = set()
+    alert_admin = panel_admin(panel_url, token)
+    async for users in iter_user_batches(panel_url, token, compact=True):
+        stats["total"] += len(users)
+        # This scan already reads every user, so it also feeds the expiry/quota alerts
+        observe_users(panel_url, alert_admin, users, now)
+        await asyncio.to_thread(record_usage_samples, panel_url, users, now)
+        seen.update(user["username"] for user in users if user.get("username"))
+        for user in users:
+            username = user.get("username") or "unknown"
+            if user.get("status") is None:
+                logger.warning(f"Incomplete user data for {username}: {user}")
+            if user.get("status") == "active":
+                stats["active"] += 1
+            elif user.get("status") in ["disabled", "on_hold"]:
+                stats["inactive"] += 1
+            expire_time = user.get("expire", 0) or 0
+            if expire_time > 0 and expire_time < now:
+                stats["expired"] += 1
+            data_limit = user.get("data_limit", 0) or 0
+            used_traffic = user.get("used_traffic", 0) or 0
+            if data_limit > 0 and used_traffic >= data_limit:
+                stats["limited"] += 1
+    finish_panel_scan(panel_url, alert_admin, seen)
+    return stats
+
+async def get_users_stats(panel_url: str, token: str, force_refresh: bool = False, raise_errors: bool = False) -> dict:
     """
     Get statistics about users in the panel.
     
+    Server-side counters are tried first (/api/system, then the `total` of
+    status-filtered /api/users queries), so a panel of any size costs a
+    handful of requests. Downloading every user is only the last resort.
+    
     Args:
         panel_url: URL of the Marzban panel.
         token: Authorization token for the API.
         force_refresh: Whether to bypass cache.
+        raise_errors: Raise when every source fails instead of returning zeros.
     
     Returns:
         Dictionary with user statistics.
     """
     from utils.cache import get_users_stats_cache, set_users_stats_cache
-    from bot_config import CACHE_DURATION
     
-    cache_key = f"{panel_url}:{token}"
     if not force_refresh:
         cached_stats = get_users_stats_cache(panel_url, token, CACHE_DURATION)
         if cached_stats:
             return cached_stats
     
-    stats = {"total": 0, "active": 0, "inactive": 0, "expired": 0, "limited": 0}
-    try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=3)) as session:
-            headers = {"Authorization": f"Bearer {token}"}
-            async with session.get(f"{panel_url.rstrip('/')}/api/stats", headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    required_keys = ["total", "active", "inactive", "expired", "limited"]
-                    stats = {key: data.get(key, 0) for key in required_keys}
-                else:
-                    raise ValueError("Failed to fetch stats from /api/stats")
-    except Exception:
+    stats = None
+    mirror_admin = mirror_owner(panel_url, token)
+    if mirror_admin is not None:
+        stats = get_panel_users_stats(panel_url.rstrip('/'), mirror_admin, int(datetime.now(timezone.utc).timestamp()))
+    for source in (_stats_from_system, _stats_from_status_totals):
+        if stats is not None:
+            break
+        try:
+            stats = await source(panel_url, token)
+        except Exception as e:
+            logger.warning(f"{source.__name__} failed for {panel_url}: {str(e)}")
+    if stats is None:
         try:
-            offset = 0
-            limit = 200
-            now = int(datetime.now(timezone.utc).timestamp())
-            while True:
-                users = await fetch_users_batch(panel_url, token, offset, limit)
-                if not users:
-                    break
-                stats["total"] += len(users)
-                for user in users:
-                    username = user.get("username", "unknown")
-                    if not all(key in user for key in ["status", "expire", "data_limit", "used_traffic"]):
-                        logger.warning(f"Incomplete user data for {username}: {user}")
-                    if user.get("status") == "active":
-                        stats["active"] += 1
-                    elif user.get("status") in ["disabled", "on_hold"]:
-                        stats["inactive"] += 1
-                    expire_time = user.get("expire", 0) or 0
-                    if expire_time > 0 and expire_time < now:
-                        stats["expired"] += 1
-                    data_limit = user.get("data_limit", 0) or 0
-                    used_traffic = user.get("used_traffic", 0) or 0
-                    if data_limit > 0 and used_traffic >= data_limit:
-                        stats["limited"] += 1
-                offset += limit
+            stats = await _stats_from_full_scan(panel_url, token)
         except Exception as e:
             logger.error(f"Manual count failed: {str(e)}")
-            return stats
+            if raise_errors:
+                raise
+            return {"total": 0, "active": 0, "inactive": 0, "expired": 0, "limited": 0}
     
     set_users_stats_cache(panel_url, token, stats)
     return stats
 
+# Background stats refreshes in flight, keyed like the stats cache
+_stats_refreshes = {}
+
+def refresh_users_stats(panel_url: str, token: str) -> asyncio.Task:
+    """
+    Recompute a panel's stats in the background, sharing a refresh already in flight.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+
+    Returns:
+        The task doing the refresh; awaiting it is optional.
+    """
+    key = f"{panel_url}:{token}"
+    task = _stats_refreshes.get(key)
+    if task is None:
+        async def refresh():
+            with background_traffic():
+                return await get_users_stats(panel_url, token, force_refresh=True, raise_errors=True)
+        task = asyncio.create_task(refresh())
+        _stats_refreshes[key] = task
+        task.add_done_callback(lambda done: _stats_refresh_done(key, panel_url, done))
+    return task
+
+def _stats_refresh_done(key: str, panel_url: str, task: asyncio.Task):
+    _stats_refreshes.pop(key, None)
+    # Retrieving the exception keeps unawaited refreshes from logging "never retrieved"
+    if not task.cancelled() and task.exception():
+        logger.warning(f"Background stats refresh failed for {panel_url}: {str(task.exception())}")
+
+async def get_users_stats_swr(panel_url: str, token: str) -> Tuple[dict, float]:
+    """
+    Get panel stats without waiting on the panel when any cached value exists.
+
+    A cached value older than CACHE_DURATION is still returned, and a
+    background refresh is started so the next call sees fresh numbers. Only
+    a panel with nothing cached yet is computed while the caller waits.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+
+    Returns:
+        Tuple of (stats, age_in_seconds).
+    """
+    from utils.cache import get_users_stats_cache_entry
+
+    entry = get_users_stats_cache_entry(panel_url, token)
+    if entry is None:
+        return await get_users_stats(panel_url, token, force_refresh=True), 0
+    stats, age = entry
+    if age >= CACHE_DURATION:
+        refresh_users_stats(panel_url, token)
+    return stats, age
+
+async def refresh_all_panels_stats():
+    """Recompute the stats of every registered panel, one refresh per panel URL and token."""
+    panels = {(panel_url, token) for _, _, panel_url, token, _, _ in get_all_panels()}
+    results = await asyncio.gather(*(refresh_users_stats(panel_url, token) for panel_url, token in panels), return_exceptions=True)
+    failed = sum(isinstance(result, Exception) for result in results)
+    logger.info(f"Stats refresh: {len(panels) - failed} panels updated, {failed} failed")
+
+async def gather_panels_stats(panels: list, timeout: float = OVERVIEW_PANEL_TIMEOUT) -> List[Optional[dict]]:
+    """
+    Fetch stats for many panels concurrently, each bounded by `timeout`.
+    
+    A panel registered more than once (e.g. by several admins) is queried once.
+    
+    Args:
+        panels: Panel rows (alias, url, token, ...).
+        timeout: Seconds to wait for each panel.
+    
+    Returns:
+        Stats per panel in the same order, or None for panels that failed or timed out.
+    """
+    async def fetch(panel_url: str, token: str) -> Optional[dict]:
+        try:
+            return await asyncio.wait_for(get_users_stats(panel_url, token, raise_errors=True), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stats for {panel_url} timed out after {timeout}s")
+        except Exception as e:
+            logger.warning(f"Stats for {panel_url} failed: {str(e)}")
+        return None
+    
+    keys = list(dict.fromkeys((panel[1].rstrip('/'), panel[2]) for panel in panels))
+    results = await asyncio.gather(*[fetch(panel_url, token) for panel_url, token in keys])
+    by_key = dict(zip(keys, results))
+    return [by_key[(panel[1].rstrip('/'), panel[2])] for panel in panels]
+
 async def request_delete_confirmation(chat_id: int, action: str, selected_panel_alias: str, bot: Bot, state: FSMContext):
     """
     Request confirmation for batch delete operations.
@@ -456,6 +778,36 @@ async def request_delete_confirmation(chat_id: int, action: str, selected_panel_
     )
     await state.update_data(login_messages=[message.message_id], pending_delete_action=action)
 
+async def _delete_matching_users(chat_id: int, panel: tuple, predicate, title: str, bot: Bot) -> Tuple[List[str], List[str]]:
+    """
+    Scan the whole panel for users matching `predicate`, then delete them concurrently.
+
+    Args:
+        chat_id: Telegram chat ID.
+        panel: Panel row (alias, url, token, username, password).
+        predicate: Function returning True for users to delete.
+        title: Title shown on the progress message.
+        bot: Telegram bot instance.
+
+    Returns:
+        Tuple of (deleted_usernames, failed_usernames).
+    """
+    progress_message = await bot.send_message(chat_id, f"{title}\n🔍 در حال بررسی کاربران...")
+    usernames = await collect_usernames(panel[1], panel[2], predicate)
+    report = make_progress_reporter(bot, chat_id, progress_message.message_id, title, BULK_PROGRESS_INTERVAL)
+    await report(0, len(usernames))
+    deleted_users, failed_users = await bulk_delete_users(panel[1], panel[2], usernames, BULK_CONCURRENCY, report)
+    await users_deleted(panel[1], panel[2], deleted_users)
+    return deleted_users, failed_users
+
+def _bulk_delete_summary(deleted_users: List[str], failed_users: List[str], label: str) -> str:
+    response_text = f"🗑 {len(deleted_users)} کاربر {label} با موفقیت حذف شدند."
+    if deleted_users:
+        response_text += f"\nکاربران حذف‌شده: {', '.join(deleted_users[:10])}{'...' if len(deleted_users) > 10 else ''}"
+    if failed_users:
+        response_text += f"\n⚠️ حذف {len(failed_users)} کاربر ناموفق بود: {', '.join(failed_users[:10])}{'...' if len(failed_users) > 10 else ''}"
+    return response_text
+
 async def delete_expired_users(chat_id: int, selected_panel_alias: str, bot: Bot, state: FSMContext, confirm: bool = False) -> bool:
     """
     Delete users whose expiration time has passed.
@@ -481,43 +833,22 @@ async def delete_expired_users(chat_id: int, selected_panel_alias: str, bot: Bot
         return False
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}"}
-            offset = 0
-            limit = 100  # Reduced limit for better performance
-            now = int(datetime.now(timezone.utc).timestamp())
-            deleted_count = 0
-            deleted_users = []
-            
-            while True:
-                params = {"offset": offset, "limit": limit}
-                async with session.get(f"{panel[1].rstrip('/')}/api/users", headers=headers, params=params) as response:
-                    if response.status != 200:
-                        result = await response.json()
-                        await bot.send_message(chat_id, f"❌ خطا در دریافت کاربران: {result.get('detail', 'No details')}")
-                        return False
-                    users_data = await response.json()
-                    users = users_data.get("users", [])
-                    if not users:
-                        break
-                    for user in users:
-                        expire_time = user.get("expire", 0) or 0
-                        if expire_time > 0 and expire_time < now:
-                            username = user.get("username", "unknown")
-                            async with session.delete(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as delete_response:
-                                if delete_response.status == 200:
-                                    deleted_count += 1
-                                    deleted_users.append(username)
-                                else:
-                                    logger.warning(f"Failed to delete user {username}: {await delete_response.json()}")
-                    offset += limit
-            
-            # Prepare response
-            response_text = f"🗑 {deleted_count} کاربر با زمان منقضی با موفقیت حذف شدند."
-            if deleted_users:
-                response_text += f"\nکاربران حذف‌شده: {', '.join(deleted_users[:10])}{'...' if len(deleted_users) > 10 else ''}"
-            await bot.send_message(chat_id, response_text)
-            return True
+        now = datetime.now(timezone.utc)
+        deleted_users = await delete_expired_server_side(panel[1], panel[2], now)
+        # The two paths select differently, so the summary names the rule that was applied
+        if deleted_users is not None:
+            failed_users = []
+            await users_deleted(panel[1], panel[2], deleted_users)
+            label = "با وضعیت منقضی یا محدود و زمان منقضی‌شده (کاربران غیرفعال حذف نشدند)"
+        else:
+            # Older panels have no bulk endpoint; fall back to scanning and deleting one by one
+            now_ts = int(now.timestamp())
+            deleted_users, failed_users = await _delete_matching_users(
+                chat_id, panel, lambda user: 0 < (user.get("expire", 0) or 0) < now_ts, "🗑 حذف کاربران منقضی", bot
+            )
+            label = "با زمان منقضی‌شده (با هر وضعیتی، از جمله غیرفعال)"
+        await bot.send_message(chat_id, _bulk_delete_summary(deleted_users, failed_users, label))
+        return True
     except Exception as e:
         logger.error(f"Error deleting expired users: {str(e)}")
         await bot.send_message(chat_id, f"❌ خطا در حذف کاربران منقضی: {str(e)}")
@@ -548,44 +879,226 @@ async def delete_data_exhausted_users(chat_id: int, selected_panel_alias: str, b
         return False
     
     try:
-        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
-            headers = {"Authorization": f"Bearer {panel[2]}"}
-            offset = 0
-            limit = 100  # Reduced limit for better performance
-            deleted_count = 0
-            deleted_users = []
-            
-            while True:
-                params = {"offset": offset, "limit": limit}
-                async with session.get(f"{panel[1].rstrip('/')}/api/users", headers=headers, params=params) as response:
-                    if response.status != 200:
-                        result = await response.json()
-                        await bot.send_message(chat_id, f"❌ خطا در دریافت کاربران: {result.get('detail', 'No details')}")
-                        return False
-                    users_data = await response.json()
-                    users = users_data.get("users", [])
-                    if not users:
-                        break
-                    for user in users:
-                        data_limit = user.get("data_limit", 0) or 0
-                        used_traffic = user.get("used_traffic", 0) or 0
-                        if data_limit > 0 and used_traffic >= data_limit:
-                            username = user.get("username", "unknown")
-                            async with session.delete(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as delete_response:
-                                if delete_response.status == 200:
-                                    deleted_count += 1
-                                    deleted_users.append(username)
-                                else:
-                                    logger.warning(f"Failed to delete user {username}: {await delete_response.json()}")
-                    offset += limit
-            
-            # Prepare response
-            response_text = f"🗑 {deleted_count} کاربر با حجم مصرف‌شده با موفقیت حذف شدند."
-            if deleted_users:
-                response_text += f"\nکاربران حذف‌شده: {', '.join(deleted_users[:10])}{'...' if len(deleted_users) > 10 else ''}"
-            await bot.send_message(chat_id, response_text)
-            return True
+        def is_exhausted(user: dict) -> bool:
+            data_limit = user.get("data_limit", 0) or 0
+            used_traffic = user.get("used_traffic", 0) or 0
+            return data_limit > 0 and used_traffic >= data_limit
+        deleted_users, failed_users = await _delete_matching_users(chat_id, panel, is_exhausted, "🗑 حذف کاربران بدون حجم", bot)
+        await bot.send_message(chat_id, _bulk_delete_summary(deleted_users, failed_users, "با حجم مصرف‌شده"))
+        return True
     except Exception as e:
         logger.error(f"Error deleting data exhausted users: {str(e)}")
         await bot.send_message(chat_id, f"❌ خطا در حذف کاربران با حجم مصرف‌شده: {str(e)}")
         return False
+
+def _bulk_modify_description(data: dict) -> str:
+    action = data.get("bulk_action")
+    amount = data.get("bulk_amount", 0)
+    text = BULK_MODIFY_LABELS.get(action, action)
+    if action == "extend_expire":
+        text += f" {amount:g} روز"
+    elif action == "add_traffic":
+        text += f" {format_traffic(amount)}"
+    return f"{text}\n🔎 فیلتر: {describe_user_filter(data.get('bulk_filter', {}))}"
+
+async def _collect_bulk_modify_targets(panel: tuple, data: dict) -> List[dict]:
+    user_filter = data.get("bulk_filter", {})
+    now = int(datetime.now(timezone.utc).timestamp())
+    return await collect_users(panel[1], panel[2], lambda user: user_matches(user_filter, user, now), panel_query_params(user_filter))
+
+async def bulk_modify_preview(chat_id: int, state: FSMContext, bot: Bot) -> bool:
+    """
+    Dry run of a bulk modification: count the users it would change and ask for confirmation.
+    
+    Args:
+        chat_id: Telegram chat ID.
+        state: FSM context holding selected_panel_alias, bulk_filter, bulk_action and bulk_amount.
+        bot: Telegram bot instance.
+    
+    Returns:
+        Boolean indicating whether confirmation was requested.
+    """
+    data = await state.get_data()
+    selected_panel_alias = data.get("selected_panel_alias")
+    panels = get_panels(chat_id)
+    panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+    if not panel:
+        await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+        return False
+    
+    try:
+        progress_message = await bot.send_message(chat_id, "🔍 در حال بررسی کاربران...")
+        users = await _collect_bulk_modify_targets(panel, data)
+    except Exception as e:
+        logger.error(f"Bulk modify preview error: {str(e)}")
+        await bot.send_message(chat_id, f"❌ خطا در بررسی کاربران: {str(e)}")
+        return False
+    
+    action = data.get("bulk_action")
+    if action == "reset_usage":
+        applicable = users
+    else:
+        now = int(datetime.now(timezone.utc).timestamp())
+        applicable = [user for user in users if user_modification(user, action, data.get("bulk_amount", 0), now) is not None]
+    response_text = (
+        f"{_bulk_modify_description(data)}\n\n"
+        f"👥 کاربران مطابق فیلتر: {len(users)}\n"
+        f"✏️ کاربرانی که تغییر می‌کنند: {len(applicable)}"
+    )
+    if applicable:
+        sample = [user["username"] for user in applicable[:10]]
+        response_text += f"\nنمونه: {', '.join(sample)}{'...' if len(applicable) > 10 else ''}"
+    if not applicable:
+        await bot.edit_message_text(response_text + "\n\nکاربری برای تغییر وجود ندارد.", chat_id=chat_id, message_id=progress_message.message_id)
+        return False
+    confirm_keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="✅ تأیید", callback_data=f"confirm_bulk_modify:{selected_panel_alias}"),
+            InlineKeyboardButton(text="❌ لغو", callback_data=f"cancel_bulk_modify:{selected_panel_alias}")
+        ]
+    ])
+    await bot.edit_message_text(response_text + "\n\nآیا مطمئنید؟", chat_id=chat_id, message_id=progress_message.message_id, reply_markup=confirm_keyboard)
+    await state.update_data(login_messages=[progress_message.message_id])
+    return True
+
+async def bulk_modify_users_logic(chat_id: int, state: FSMContext, bot: Bot) -> bool:
+    """
+    Apply a confirmed bulk modification to every user matching its filter.
+    
+    The filter is evaluated again at this point, so users changed since the
+    dry run are judged by their current values.
+    
+    Args:
+        chat_id: Telegram chat ID.
+        state: FSM context holding selected_panel_alias, bulk_filter, bulk_action and bulk_amount.
+        bot: Telegram bot instance.
+    
+    Returns:
+        Boolean indicating success.
+    """
+    data = await state.get_data()
+    if not data.get("bulk_action"):
+        await bot.send_message(chat_id, "ℹ️ این ویرایش گروهی قبلاً اعمال شده است.")
+        return False
+    # Consume the request before applying it, so a double tap or a tap on an old preview cannot apply it twice
+    await state.update_data(bulk_action=None, bulk_amount=None, bulk_filter=None)
+    selected_panel_alias = data.get("selected_panel_alias")
+    panels = get_panels(chat_id)
+    panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+    if not panel:
+        await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+        return False
+    
+    title = f"🛠 ویرایش گروهی: {BULK_MODIFY_LABELS.get(data.get('bulk_action'), '')}"
+    try:
+        progress_message = await bot.send_message(chat_id, f"{title}\n🔍 در حال بررسی کاربران...")
+        users = await _collect_bulk_modify_targets(panel, data)
+        report = make_progress_reporter(bot, chat_id, progress_message.message_id, title, BULK_PROGRESS_INTERVAL)
+        await report(0, len(users))
+        modified_users, failed_users, skipped = await bulk_modify_users(
+            panel[1], panel[2], users, data.get("bulk_action"), data.get("bulk_amount", 0), BULK_CONCURRENCY, report
+        )
+    except Exception as e:
+        logger.error(f"Bulk modify error: {str(e)}")
+        await bot.send_message(chat_id, f"❌ خطا در ویرایش گروهی کاربران: {str(e)}")
+        return False
+    
+    await users_updated(panel[1], panel[2], modified_users)
+    response_text = f"{_bulk_modify_description(data)}\n\n✅ {len(modified_users)} کاربر ویرایش شد."
+    if skipped:
+        response_text += f"\n➖ {skipped} کاربر نیازی به تغییر نداشت."
+    if failed_users:
+        response_text += f"\n⚠️ ویرایش {len(failed_users)} کاربر ناموفق بود: {', '.join(failed_users[:10])}{'...' if len(failed_users) > 10 else ''}"
+    await bot.send_message(chat_id, response_text)
+    return True
+
+async def export_users_logic(chat_id: int, selected_panel_alias: str, fmt: str, bot: Bot) -> bool:
+    """
+    Export every user of the selected panel to a CSV or JSON file and send it as a document.
+    
+    Args:
+        chat_id: Telegram chat ID.
+        selected_panel_alias: Alias of the selected panel.
+        fmt: "csv" or "json".
+        bot: Telegram bot instance.
+    
+    Returns:
+        Boolean indicating success.
+    """
+    panels = get_panels(chat_id)
+    panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+    if not panel:
+        await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+        return False
+    
+    progress_message = await bot.send_message(chat_id, "📤 در حال آماده‌سازی فایل خروجی...")
+    fd, path = tempfile.mkstemp(suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        count = await export_users(panel[1], panel[2], path, fmt)
+        filename = f"{selected_panel_alias}_users_{datetime.now(timezone.utc):%Y%m%d}.{fmt}"
+        await bot.send_document(chat_id, types.FSInputFile(path, filename=filename), caption=f"📤 خروجی {count} کاربر از پنل '{selected_panel_alias}'")
+        return True
+    except Exception as e:
+        logger.error(f"Export users error: {str(e)}")
+        await bot.send_message(chat_id, f"❌ خطا در تهیه خروجی کاربران: {str(e)}")
+        return False
+    finally:
+        os.remove(path)
+        try:
+            await bot.delete_message(chat_id, progress_message.message_id)
+        except Exception as e:
+            logger.warning(f"Failed to delete progress message: {str(e)}")
+
+async def usage_report_logic(chat_id: int, selected_panel_alias: str, bot: Bot, force_refresh: bool = False) -> bool:
+    """
+    Send the top consumers and usage distribution report of the selected panel.
+    
+    Args:
+        chat_id: Telegram chat ID.
+        selected_panel_alias: Alias of the selected panel.
+        bot: Telegram bot instance.
+        force_refresh: Whether to rebuild the report instead of using the cached one.
+    
+    Returns:
+        Boolean indicating success.
+    """
+    panels = get_panels(chat_id)
+    panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+    if not panel:
+        await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+        return False
+    
+    progress_message = await bot.send_message(chat_id, "🏆 در حال تهیه گزارش مصرف...")
+    try:
+        report = await get_usage_report(panel[1], panel[2], force_refresh)
+    except Exception as e:
+        logger.error(f"Usage report error: {str(e)}")
+        await bot.send_message(chat_id, f"❌ خطا در تهیه گزارش مصرف: {str(e)}")
+        return False
+    finally:
+        try:
+            await bot.delete_message(chat_id, progress_message.message_id)
+        except Exception as e:
+            logger.warning(f"Failed to delete progress message: {str(e)}")
+    
+    gigabyte = 1024 ** 3
+    lines = [
+        f"🏆 پرمصرف‌ترین کاربران پنل '{selected_panel_alias}'",
+        f"👥 {report['total']} کاربر، مجموع مصرف {report['total_traffic'] / gigabyte:.2f} GB",
+        "",
+    ]
+    for rank, (used_traffic, username, data_limit) in enumerate(report["top"], 1):
+        limit_text = f" از {data_limit / gigabyte:.2f}" if data_limit else ""
+        lines.append(f"{rank}. {username}: {used_traffic / gigabyte:.2f}{limit_text} GB")
+    lines += ["", "📊 توزیع درصد مصرف از حجم:"]
+    for label, count in zip(histogram_labels(), report["histogram"]):
+        lines.append(f"{label}: {count}")
+    lines.append(f"نامحدود: {report['unlimited']}")
+    lines.append(f"\n🕒 تهیه‌شده: {format_age(time.time() - report['generated_at'])}")
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="🔄 بروزرسانی گزارش", callback_data="usage_report:refresh")],
+        [InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_to_panel_action_menu")]
+    ])
+    await bot.send_message(chat_id, "\n".join(lines), reply_markup=keyboard)
+    return True
@@ -0,0 +1,73 @@
+import heapq
+import logging
+import time
+from api.client import background_traffic
+from api.scan import iter_user_batches
+from bot_config import USAGE_REPORT_TOP_K, USAGE_REPORT_TTL
+from utils.cache import get_usage_report_cache, set_usage_report_cache
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (percent of data limit) of the histogram buckets; a last bucket holds users at or over 100%
+USAGE_HISTOGRAM_BOUNDS = (25, 50, 75, 90, 100)
+
+async def build_usage_report(panel_url: str, token: str, k: int = USAGE_REPORT_TOP_K) -> dict:
+    """
+    Find the K heaviest users and the usage distribution in one pass over a panel.
+
+    Only a K-sized min-heap and the bucket counters are kept while pages
+    stream in, so memory does not grow with the number of users.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        k: Number of top consumers to keep.
+
+    Returns:
+        Dictionary with "top" ([(used_traffic, username, data_limit)], largest first),
+        "histogram" (user counts per USAGE_HISTOGRAM_BOUNDS bucket plus one for
+        100% and over), "unlimited", "total", "total_traffic" and "generated_at".
+    """
+    top = []
+    histogram = [0] * (len(USAGE_HISTOGRAM_BOUNDS) + 1)
+    unlimited = total = total_traffic = 0
+    with background_traffic():
+        async for users in iter_user_batches(panel_url, token, compact=True):
+            for user in users:
+                used_traffic = user.get("used_traffic") or 0
+                data_limit = user.get("data_limit") or 0
+                total += 1
+                total_traffic += used_traffic
+                entry = (used_traffic, user.get("username", ""), data_limit)
+                if len(top) < k:
+                    heapq.heappush(top, entry)
+                elif entry > top[0]:
+                    heapq.heapreplace(top, entry)
+                if data_limit <= 0:
+                    unlimited += 1
+                    continue
+                percent = used_traffic * 100 / data_limit
+                histogram[next((i for i, bound in enumerate(USAGE_HISTOGRAM_BOUNDS) if percent < bound), len(USAGE_HISTOGRAM_BOUNDS))] += 1
+    return {
+        "top": sorted(top, reverse=True),
+        "histogram": histogram,
+        "unlimited": unlimited,
+        "total": total,
+        "total_traffic": total_traffic,
+        "generated_at": time.time(),
+    }
+
+async def get_usage_report(panel_url: str, token: str, force_refresh: bool = False) -> dict:
+    """Return the panel's usage report, rebuilding it when older than USAGE_REPORT_TTL or when forced."""
+    if not force_refresh:
+        cached_report = get_usage_report_cache(panel_url, token, USAGE_REPORT_TTL)
+        if cached_report:
+            return cached_report
+    report = await build_usage_report(panel_url, token)
+    set_usage_report_cache(panel_url, token, report)
+    logger.info(f"Usage report built for {panel_url}: {report['total']} users")
+    return report
+
+def histogram_labels() -> list:
+    lower_bounds = (0,) + USAGE_HISTOGRAM_BOUNDS
+    return [f"{low}–{high}٪" for low, high in zip(lower_bounds, USAGE_HISTOGRAM_BOUNDS)] + [f"≥{USAGE_HISTOGRAM_BOUNDS[-1]}٪"]
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+from typing import AsyncIterator, List, Optional, Tuple
+from api.client import get_client
+from bot_config import SCAN_PAGE_SIZE, SCAN_CONCURRENCY
+from models.user import UserRecord
+
+logger = logging.getLogger(__name__)
+
+async def fetch_users_page(panel_url: str, token: str, offset: int, limit: int, params: Optional[dict] = None, compact: bool = False) -> dict:
+    """
+    Fetch one raw page of /api/users.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        offset: Offset for pagination.
+        limit: Number of users to fetch.
+        params: Optional extra query parameters, e.g. {"status": "active"}.
+        compact: Return users as UserRecord instead of full dicts.
+
+    Returns:
+        The decoded response, containing "users" and, on most panels, "total".
+    """
+    query = dict(params or {})
+    query.update({"offset": offset, "limit": limit})
+    status, users_data = await get_client(panel_url).get("/api/users", token, params=query)
+    if status != 200:
+        raise ValueError(f"دریافت کاربران ناموفق: {users_data.get('detail', 'No details')}")
+    if "users" not in users_data:
+        raise ValueError("پاسخ API شامل کلید 'users' نیست")
+    if compact:
+        # Drop proxies, links and inbounds now so only five fields per user outlive the page
+        return {**users_data, "users": [UserRecord.from_dict(user) for user in users_data["users"]]}
+    return users_data
+
+async def iter_user_pages(panel_url: str, token: str, page_size: int = SCAN_PAGE_SIZE, concurrency: int = SCAN_CONCURRENCY, params: Optional[dict] = None, compact: bool = False) -> AsyncIterator[Tuple[int, List[dict]]]:
+    """
+    Yield every page of a panel's users as (offset, users), fetching pages concurrently.
+
+    The first page tells us `total`; the remaining offsets are then fetched
+    with at most `concurrency` requests in flight. Pages are yielded as they
+    arrive, so their order is not guaranteed. Panels that do not report
+    `total` are paged sequentially until a short page.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        token: Authorization token for the API.
+        page_size: Number of users per page.
+        concurrency: Maximum number of pages fetched at once.
+        params: Optional extra query parameters applied to every page.
+        compact: Yield UserRecord instead of full dicts, for scans that only
+            need username, status, expire, data_limit and used_traffic.
+
+    Yields:
+        Tuples of (offset, list of user dictionaries).
+    """
+    first_page = await fetch_users_page(panel_url, token, 0, page_size, params, compact)
+    users = first_page.get("users", [])
+    if users:
+        yield 0, users
+    total = first_page.get("total")
+    if not isinstance(total, int):
+        offset = page_size
+        while len(users) == page_size:
+            users = (await fetch_users_page(panel_url, token, offset, page_size, params, compact)).get("users", [])
+            if users:
+                yield offset, users
+            offset += page_size
+        return
+
+    def fetch(offset: int) -> asyncio.Future:
+        async def run():
+            return offset, await fetch_users_page(panel_url, token, offset, page_size, params, compact)
+        return asyncio.ensure_future(run())
+
+    offsets = iter(range(page_size, total, page_size))
+    pending = set()
+    try:
+        for offset in offsets:
+            pending.add(fetch(offset))
+            if len(pending) >= max(1, concurrency):
+                break
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                next_offset = next(offsets, None)
+                if next_offset is not None:
+                    pending.add(fetch(next_offset))
+                offset, page = task.result()
+                users = page.get("users", [])
+                if users:
+                    yield offset, users
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def iter_user_batches(panel_url: str, token: str, page_size: int = SCAN_PAGE_SIZE, concurrency: int = SCAN_CONCURRENCY, params: Optional[dict] = None, compact: bool = False) -> AsyncIterator[List[dict]]:
+    """
+    Yield every user of a panel in batches, fetching pages concurrently.
+
+    Same as iter_user_pages without the offsets; batch order is not guaranteed.
+    """
+    async for _, users in iter_user_pages(panel_url, token, page_size, concurrency, params, compact):
+        yield users
@@ -9,12 +9,18 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from telegram import InlineKeyboardMarkup
 from bot_config import VERSION, ADMIN_IDS
-from database.db import get_panels, add_admin, remove_admin, get_admins, delete_panel, save_panel, set_log_channel, get_log_channel, set_selected_panel, get_selected_panel
-from bot.menus import config_selection_menu, delete_panel_menu, main_menu, admin_management_menu, note_menu, panel_selection_menu, panel_action_menu, user_action_menu, create_menu_layout, panel_login_menu, protocol_selection_menu, users_list_menu
+from database.db import get_panels, get_all_panels, add_admin, remove_admin, get_admins, delete_panel, save_panel, set_log_channel, get_log_channel, set_selected_panel, get_selected_panel
+from bot.menus import config_selection_menu, delete_panel_menu, main_menu, admin_management_menu, note_menu, panel_selection_menu, panel_action_menu, user_action_menu, create_menu_layout, panel_login_menu, protocol_selection_menu, users_list_menu, bulk_modify_action_menu, export_format_menu
 from bot.states import Form
-from api.marzban_api import create_user_logic, show_user_info, delete_user_logic, disable_user_logic, enable_user_logic, delete_configs_logic, get_users_stats
-from utils.message_utils import cleanup_messages
-from utils.formatting import format_traffic, format_expire_time
+from api.marzban_api import get_inbounds, get_user, create_user_logic, bulk_create_users_logic, bulk_modify_preview, bulk_modify_users_logic, export_users_logic, usage_report_logic, show_user_info, delete_user_logic, disable_user_logic, enable_user_logic, delete_configs_logic, get_users_stats, get_users_stats_swr, gather_panels_stats, get_users_page, prefetch_adjacent_pages, delete_expired_users, delete_data_exhausted_users
+from api.client import get_client, circuit_state
+from api.importer import import_users_logic
+from utils.user_events import user_updated
+from utils.search_index import ensure_username_index
+from utils.user_filter import parse_user_filter
+from bot_config import SEARCH_PAGE_SIZE, BULK_CREATE_MAX_COUNT
+from utils.message_utils import cleanup_messages, split_text
+from utils.formatting import format_traffic, format_expire_time, format_age
 from utils.validation import validate_panel_url
 from utils.activity_logger import log_to_channel
 from marzpy import Marzban
@@ -33,6 +39,9 @@ def is_admin(chat_id: int) -> bool:
     admins = get_admins()
     return chat_id in admins
 
+def panel_states(panels: list) -> dict:
+    return {panel[0]: circuit_state(panel[1]) for panel in panels}
+
 async def start(message: types.Message, state: FSMContext, bot: Bot):
     await cleanup_messages(bot, message.from_user.id, state)
     chat_id = message.from_user.id
@@ -53,39 +62,126 @@ async def start(message: types.Message, state: FSMContext, bot: Bot):
         message = await bot.send_message(chat_id, f"🎉 به ربات مدیر خوش آمدید (نسخه {VERSION})", reply_markup=create_menu_layout(buttons))
         await state.update_data(login_messages=[message.message_id])
 
+def format_panel_stats(stats: dict) -> str:
+    return (
+        f"👥 تعداد کل کاربران: {stats['total']}\n"
+        f"✅ کاربران فعال: {stats['active']}\n"
+        f"⛔ کاربران غیرفعال: {stats['inactive']}\n"
+        f"⌛ کاربران منقضی‌شده: {stats['expired']}\n"
+        f"📉 کاربران محدود شده: {stats['limited']}\n"
+    )
+
+async def send_long_message(bot: Bot, chat_id: int, text: str, reply_markup=None) -> list:
+    chunks = split_text(text)
+    message_ids = []
+    for index, chunk in enumerate(chunks):
+        message = await bot.send_message(chat_id, chunk, reply_markup=reply_markup if index == len(chunks) - 1 else None)
+        message_ids.append(message.message_id)
+    return message_ids
+
 async def show_user_info_for_owner(message: types.Message, state: FSMContext, chat_id: int, bot: Bot):
-    await cleanup_messages(bot, chat_id, state)
+    # chat_id is the admin being inspected; the report goes to the owner who asked
+    owner_id = message.from_user.id
+    await cleanup_messages(bot, owner_id, state)
     panels = get_panels(chat_id)
     if not panels:
-        message = await bot.send_message(chat_id, "⚠️ هیچ پنلی ثبت نشده است.", reply_markup=admin_management_menu())
+        message = await bot.send_message(owner_id, "⚠️ هیچ پنلی ثبت نشده است.", reply_markup=admin_management_menu())
         await state.update_data(login_messages=[message.message_id])
         return
     response_text = f"📊 اطلاعات پنل‌ها برای کاربر {chat_id}:\n\n"
-    for panel in panels:
+    all_stats = await gather_panels_stats(panels)
+    for panel, stats in zip(panels, all_stats):
         alias, panel_url, token, username, password = panel
-        stats = await get_users_stats(panel_url, token)
         response_text += (
             f"📌 پنل: {alias}\n"
             f"🔗 آدرس: {panel_url}\n"
             f"👤 نام کاربری ادمین: {username}\n"
             f"🔑 رمز عبور: {password}\n"
-            f"👥 تعداد کل کاربران: {stats['total']}\n"
-            f"✅ کاربران فعال: {stats['active']}\n"
-            f"⛔ کاربران غیرفعال: {stats['inactive']}\n"
-            f"⌛ کاربران منقضی‌شده: {stats['expired']}\n"
-            f"📉 کاربران محدود شده: {stats['limited']}\n\n"
         )
-    message = await bot.send_message(chat_id, response_text, reply_markup=admin_management_menu())
-    await state.update_data(login_messages=[message.message_id])
+        response_text += format_panel_stats(stats) if stats else "🔴 پنل در دسترس نیست\n"
+        response_text += "\n"
+    message_ids = await send_long_message(bot, owner_id, response_text, reply_markup=admin_management_menu())
     await state.clear()
-    await log_to_channel(bot, chat_id, "مشاهده اطلاعات پنل‌ها", f"کاربر {chat_id} اطلاعات پنل‌ها را مشاهده کرد.")
+    await state.update_data(login_messages=message_ids)
+    await log_to_channel(bot, owner_id, "مشاهده اطلاعات پنل‌ها", f"کاربر {owner_id} اطلاعات پنل‌های کاربر {chat_id} را مشاهده کرد.")
+
+async def show_owner_dashboard(chat_id: int, state: FSMContext, bot: Bot):
+    panels = get_all_panels()
+    if not panels:
+        message = await bot.send_message(chat_id, "⚠️ هیچ پنلی ثبت نشده است.", reply_markup=admin_management_menu())
+        await state.update_data(login_messages=[message.message_id])
+        return
+    progress_message = await bot.send_message(chat_id, f"⏳ در حال دریافت آمار {len(panels)} پنل...")
+    all_stats = await gather_panels_stats([(alias, panel_url, token) for _, alias, panel_url, token, _, _ in panels])
+    totals = {"total": 0, "active": 0, "inactive": 0, "expired": 0, "limited": 0}
+    # The same panel may be registered by several bot users; count each panel admin's users once.
+    # Non-sudo panel admins only see their own users, so different admins on one URL are all counted.
+    counted = set()
+    by_admin = {}
+    unreachable = set()
+    for (admin_id, alias, panel_url, _, panel_admin_username, _), stats in zip(panels, all_stats):
+        key = (panel_url.rstrip('/'), panel_admin_username)
+        if stats is None:
+            unreachable.add(key)
+            line = f"🔴 {alias}: در دسترس نیست"
+        else:
+            line = f"📌 {alias}: 👥 {stats['total']} | ✅ {stats['active']} | ⌛ {stats['expired']} | 📉 {stats['limited']}"
+            if key not in counted:
+                counted.add(key)
+                for total_key in totals:
+                    totals[total_key] += stats.get(total_key, 0)
+        by_admin.setdefault(admin_id, []).append(line)
+    response_text = (
+        f"🌐 داشبورد کل ({len(counted)} اتصال پنل در دسترس، {len(unreachable - counted)} اتصال در دسترس نیست)\n\n"
+        f"{format_panel_stats(totals)}"
+    )
+    for admin_id, lines in by_admin.items():
+        response_text += f"\n\n👤 مدیر {admin_id}:\n" + "\n".join(lines)
+    try:
+        await bot.delete_message(chat_id, progress_message.message_id)
+    except Exception as e:
+        logger.warning(f"Failed to delete progress message: {str(e)}")
+    message_ids = await send_long_message(bot, chat_id, response_text, reply_markup=admin_management_menu())
+    await state.update_data(login_messages=message_ids)
+    await log_to_channel(bot, chat_id, "داشبورد کل", f"کاربر {chat_id} داشبورد همه پنل‌ها را مشاهده کرد.")
+
+USERS_LIST_LEGEND = (
+    "⏰ منقضی\n"
+    "🟠 توقف (on hold)\n"
+    "🚫 محدود (حجم تمام)\n"
+    "✅ فعال\n"
+    "⛔ غیرفعال"
+)
+
+async def show_users_page(chat_id: int, state: FSMContext, bot: Bot, panel: tuple, page: int):
+    limit = 21
+    users, total_count = await get_users_page(chat_id, panel[1], panel[2], page, limit)
+    if total_count is not None and not users and page > 0:
+        # Users were deleted since the page count was shown; land on the new last page
+        page = max(0, (total_count + limit - 1) // limit - 1)
+        users, total_count = await get_users_page(chat_id, panel[1], panel[2], page, limit)
+    has_next = (page + 1) * limit < total_count if total_count is not None else len(users) == limit
+    prefetch_adjacent_pages(chat_id, panel[1], panel[2], page, limit, has_next)
+    header = f"👥 لیست کاربران ({total_count} کاربر):" if total_count is not None else "👥 لیست کاربران:"
+    message = await bot.send_message(chat_id, f"{header}\n\n{USERS_LIST_LEGEND}", reply_markup=users_list_menu(users, page=page, limit=limit, total_count=total_count))
+    await state.update_data(login_messages=[message.message_id], users_page=page)
+
+async def show_search_results(chat_id: int, state: FSMContext, bot: Bot, query_text: str, matches: list, page: int = 0):
+    limit = SEARCH_PAGE_SIZE
+    page_users = matches[page*limit:(page+1)*limit]
+    total_pages = (len(matches) + limit - 1) // limit
+    text = f"🔍 {len(matches)} کاربر برای «{query_text}» یافت شد (صفحه {page+1} از {total_pages}):"
+    message = await bot.send_message(chat_id, text, reply_markup=users_list_menu(page_users, page=page, limit=limit, total_count=len(matches), nav_prefix="search_page"))
+    await state.update_data(login_messages=[message.message_id], search_query=query_text)
 
 async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bot):
     await query.answer()
     chat_id = query.from_user.id
     data = query.data
+    if data == "noop":
+        # Display-only button (the search results page indicator); keep the current message
+        return
     await cleanup_messages(bot, chat_id, state)
-    from api.marzban_api import fetch_users_batch
     if data == "add_server":
         await state.set_state(Form.awaiting_panel_alias)
         message = await bot.send_message(chat_id, "📝 لطفاً یک نام مستعار برای پنل وارد کنید:", reply_markup=panel_login_menu())
@@ -137,6 +233,12 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
         await state.set_state(Form.awaiting_user_info)
         message = await bot.send_message(chat_id, "📊 لطفاً آیدی عددی کاربر را وارد کنید:")
         await state.update_data(login_messages=[message.message_id])
+    elif data == "owner_dashboard":
+        if not is_owner(chat_id):
+            message = await bot.send_message(chat_id, "🚫 فقط مالک می‌تواند داشبورد کل را ببیند.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await show_owner_dashboard(chat_id, state, bot)
     elif data == "set_log_channel":
         if not is_owner(chat_id):
             message = await bot.send_message(chat_id, "🚫 فقط مالک می‌تواند کانال لاگ را تنظیم کند.")
@@ -154,7 +256,7 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.update_data(login_messages=[message.message_id])
             return
         await state.set_state(Form.awaiting_panel_selection)
-        message = await bot.send_message(chat_id, "📌 لطفاً یک پنل انتخاب کنید:", reply_markup=panel_selection_menu(panels))
+        message = await bot.send_message(chat_id, "📌 لطفاً یک پنل انتخاب کنید:", reply_markup=panel_selection_menu(panels, panel_states(panels)))
         await state.update_data(login_messages=[message.message_id])
     elif data == "delete_panel":
         panels = get_panels(chat_id)
@@ -170,7 +272,7 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
         delete_panel(chat_id, alias)
         panels = get_panels(chat_id)
         if panels:
-            message = await bot.send_message(chat_id, f"🗑 پنل '{alias}' با موفقیت حذف شد.", reply_markup=panel_selection_menu(panels))
+            message = await bot.send_message(chat_id, f"🗑 پنل '{alias}' با موفقیت حذف شد.", reply_markup=panel_selection_menu(panels, panel_states(panels)))
             await state.update_data(login_messages=[message.message_id])
         else:
             message = await bot.send_message(chat_id, f"🗑 پنل '{alias}' با موفقیت حذف شد. هیچ پنلی باقی نمانده است.", reply_markup=main_menu(is_owner(chat_id)))
@@ -190,16 +292,19 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.update_data(login_messages=[message.message_id])
             await state.clear()
             return
-        stats = await get_users_stats(panel[1], panel[2], force_refresh=True)
+        stats, stats_age = await get_users_stats_swr(panel[1], panel[2])
         response_text = (
             f"✅ پنل '{alias}' انتخاب شد.\n\n"
             f"👥 تعداد کل کاربران: {stats['total']}\n"
             f"✅ کاربران فعال: {stats['active']}\n"
             f"⛔ کاربران غیرفعال: {stats['inactive']}\n"
             f"⌛ کاربران منقضی‌شده: {stats['expired']}\n"
-            f"📉 کاربران محدود شده: {stats['limited']}\n\n"
+            f"📉 کاربران محدود شده: {stats['limited']}\n"
+            f"🕒 به‌روزرسانی آمار: {format_age(stats_age)}\n\n"
             "لطفاً یک عملیات انتخاب کنید:"
         )
+        if circuit_state(panel[1]) == "open":
+            response_text = "🔴 پنل در حال حاضر در دسترس نیست؛ آمار زیر ممکن است قدیمی یا ناقص باشد.\n\n" + response_text
         message = await bot.send_message(chat_id, response_text, reply_markup=panel_action_menu())
         await state.update_data(login_messages=[message.message_id])
         await log_to_channel(bot, chat_id, "انتخاب پنل", f"پنل با نام مستعار {alias} انتخاب شد.")
@@ -210,7 +315,7 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.update_data(login_messages=[message.message_id])
             return
         await state.set_state(Form.awaiting_panel_selection)
-        message = await bot.send_message(chat_id, "📌 لطفاً یک پنل انتخاب کنید:", reply_markup=panel_selection_menu(panels))
+        message = await bot.send_message(chat_id, "📌 لطفاً یک پنل انتخاب کنید:", reply_markup=panel_selection_menu(panels, panel_states(panels)))
         await state.update_data(login_messages=[message.message_id])
     elif data == "search_user":
         await state.set_state(Form.awaiting_search_username)
@@ -237,23 +342,7 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.update_data(login_messages=[message.message_id])
             return
         try:
-            page = 0
-            limit = 21
-            users = await fetch_users_batch(panel[1], panel[2], page*limit, limit)
-            total_count = None
-            if hasattr(fetch_users_batch, 'get_total_count'):
-                total_count = await fetch_users_batch.get_total_count(panel[1], panel[2])
-            legend = (
-                "👥 لیست کاربران:\n"
-                "\n"
-                "⏰ منقضی\n"
-                "🟠 توقف (on hold)\n"
-                "🚫 محدود (حجم تمام)\n"
-                "✅ فعال\n"
-                "⛔ غیرفعال"
-            )
-            message = await bot.send_message(chat_id, legend, reply_markup=users_list_menu(users, page=page, limit=limit, total_count=total_count))
-            await state.update_data(login_messages=[message.message_id], users_page=page)
+            await show_users_page(chat_id, state, bot, panel, 0)
         except Exception as e:
             message = await bot.send_message(chat_id, f"❌ خطا در دریافت کاربران: {str(e)}")
             await state.update_data(login_messages=[message.message_id])
@@ -278,31 +367,36 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             message = await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
             await state.update_data(login_messages=[message.message_id])
             return
-        limit = 21
         try:
-            users = await fetch_users_batch(panel[1], panel[2], page*limit, limit)
+            await show_users_page(chat_id, state, bot, panel, page)
         except Exception as e:
             message = await bot.send_message(chat_id, f"❌ خطا در دریافت کاربران صفحه {page+1}: {str(e)}")
             await state.update_data(login_messages=[message.message_id])
+        return
+    elif data == "users_page_jump":
+        await state.set_state(Form.awaiting_users_page_number)
+        message = await bot.send_message(chat_id, "🔢 شماره صفحه موردنظر را وارد کنید:")
+        await state.update_data(login_messages=[message.message_id])
+        return
+    elif data.startswith("search_page:"):
+        page = int(data.split(":")[1])
+        user_data = await state.get_data()
+        query_text = user_data.get("search_query")
+        selected_panel_alias = user_data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        panels = get_panels(chat_id)
+        panel = next((p for p in panels if p[0] == selected_panel_alias), None)
+        if not query_text or not panel:
+            message = await bot.send_message(chat_id, "⚠️ جستجو منقضی شده است. لطفاً دوباره جستجو کنید.", reply_markup=panel_action_menu())
+            await state.update_data(login_messages=[message.message_id])
             return
-        total_count = None
-        if hasattr(fetch_users_batch, 'get_total_count'):
-            try:
-                total_count = await fetch_users_batch.get_total_count(panel[1], panel[2])
-            except Exception as e:
-                logger.error(f"Error in get_total_count: {str(e)}")
-        await cleanup_messages(bot, chat_id, state)
-        legend = (
-            "👥 لیست کاربران:\n"
-            "\n"
-            "⏰ منقضی\n"
-            "🟠 توقف (on hold)\n"
-            "🚫 محدود (حجم تمام)\n"
-            "✅ فعال\n"
-            "⛔ غیرفعال"
-        )
-        message = await bot.send_message(chat_id, legend, reply_markup=users_list_menu(users, page=page, limit=limit, total_count=total_count))
-        await state.update_data(login_messages=[message.message_id], users_page=page)
+        try:
+            index = await ensure_username_index(panel[1], panel[2])
+        except Exception as e:
+            logger.error(f"Search index error: {str(e)}")
+            message = await bot.send_message(chat_id, f"❌ خطا در جستجو: {str(e)}")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await show_search_results(chat_id, state, bot, query_text, index.search(query_text), page)
         return
     elif data == "back_to_panel_action_menu":
         user_data = await state.get_data()
@@ -338,18 +432,14 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             return
         limit = 21
         try:
-            users = await fetch_users_batch(panel[1], panel[2], page*limit, limit)
+            users, total_count = await get_users_page(chat_id, panel[1], panel[2], page, limit)
+            has_next = (page + 1) * limit < total_count if total_count is not None else len(users) == limit
+            prefetch_adjacent_pages(chat_id, panel[1], panel[2], page, limit, has_next)
         except Exception as e:
-            logger.error(f"Error in back_to_users_list_menu fetch_users_batch: {str(e)}")
+            logger.error(f"Error in back_to_users_list_menu get_users_page: {str(e)}")
             message = await bot.send_message(chat_id, f"❌ خطا در دریافت کاربران: {str(e)}")
             await state.update_data(login_messages=[message.message_id])
             return
-        total_count = None
-        if hasattr(fetch_users_batch, 'get_total_count'):
-            try:
-                total_count = await fetch_users_batch.get_total_count(panel[1], panel[2])
-            except Exception as e:
-                logger.error(f"Error in get_total_count: {str(e)}")
         await cleanup_messages(bot, chat_id, state)
         try:
             stats = await get_users_stats(panel[1], panel[2])
@@ -357,16 +447,15 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             stats = {}
         total = stats.get('total', total_count if total_count is not None else '?')
         active = stats.get('active', '?')
-        disabled = stats.get('disabled', '?')
+        inactive = stats.get('inactive', '?')
         expired = stats.get('expired', '?')
-        on_hold = stats.get('on_hold', '?')
         total_pages = 1
         if total_count is not None:
-            total_pages = (total_count + limit - 1) // limit
+            total_pages = max(1, (total_count + limit - 1) // limit)
         page_info = f"صفحه {page+1} از {total_pages}"
         legend = (
             f"👥 لیست کاربران ({page_info})\n"
-            f"کل: {total} | ✅فعال: {active} | ⛔غیرفعال: {disabled} | ⏰منقضی: {expired} | 🟠توقف: {on_hold}\n"
+            f"کل: {total} | ✅فعال: {active} | ⛔غیرفعال/توقف: {inactive} | ⏰منقضی: {expired}\n"
             "----------------------\n"
             "⏰ منقضی\n"
             "🟠 توقف (on hold)\n"
@@ -406,6 +495,100 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
         buttons = [InlineKeyboardButton(text="🎲 تولید نام تصادفی", callback_data="random_username")]
         message = await bot.send_message(chat_id, "📝 نام کاربری را وارد کنید:", reply_markup=create_menu_layout(buttons))
         await state.update_data(login_messages=[message.message_id])
+    elif data == "bulk_create_users":
+        user_data = await state.get_data()
+        selected_panel_alias = user_data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        if not selected_panel_alias:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً ابتدا یک پنل انتخاب کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await state.update_data(selected_panel_alias=selected_panel_alias)
+        await state.set_state(Form.awaiting_bulk_prefix)
+        message = await bot.send_message(chat_id, "📝 پیشوند نام کاربری را وارد کنید (فقط حروف انگلیسی کوچک، عدد و _):")
+        await state.update_data(login_messages=[message.message_id])
+    elif data == "bulk_modify":
+        user_data = await state.get_data()
+        selected_panel_alias = user_data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        if not selected_panel_alias:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً ابتدا یک پنل انتخاب کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await state.update_data(selected_panel_alias=selected_panel_alias)
+        await state.set_state(Form.awaiting_bulk_filter)
+        message = await bot.send_message(
+            chat_id,
+            "🔎 فیلتر کاربران را وارد کنید (شرط‌ها با فاصله جدا شوند):\n"
+            "status=active|disabled|on_hold|expired|limited\n"
+            "expiring=7 (انقضا تا ۷ روز آینده)\n"
+            "usage=80 (مصرف حداقل ۸۰٪ حجم)\n"
+            "prefix=shop (نام کاربری با shop شروع شود)\n\n"
+            "مثال: status=active usage=80\n"
+            "برای همه کاربران «همه» را بفرستید."
+        )
+        await state.update_data(login_messages=[message.message_id])
+    elif data.startswith("bulk_action:"):
+        action = data.split(":", 1)[1]
+        await state.update_data(bulk_action=action, bulk_amount=0)
+        if action in ("extend_expire", "add_traffic"):
+            await state.set_state(Form.awaiting_bulk_amount)
+            prompt = "⏰ چند روز به انقضا اضافه شود؟" if action == "extend_expire" else "📊 چند گیگابایت به حجم اضافه شود؟"
+            message = await bot.send_message(chat_id, prompt)
+            await state.update_data(login_messages=[message.message_id])
+        else:
+            await state.set_state(Form.awaiting_action)
+            await bulk_modify_preview(chat_id, state, bot)
+    elif data.startswith("confirm_bulk_modify:"):
+        # Read before applying: the logic clears the bulk request from the state
+        user_data = await state.get_data()
+        success = await bulk_modify_users_logic(chat_id, state, bot)
+        if success:
+            await log_to_channel(bot, chat_id, "ویرایش گروهی کاربران", f"عملیات {user_data.get('bulk_action')} با فیلتر {user_data.get('bulk_filter')} در پنل {user_data.get('selected_panel_alias')} انجام شد.")
+        message = await bot.send_message(chat_id, "منوی عملیات پنل:", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif data.startswith("cancel_bulk_modify:"):
+        message = await bot.send_message(chat_id, "❌ ویرایش گروهی لغو شد.", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif data == "export_users":
+        message = await bot.send_message(chat_id, "📤 قالب فایل خروجی را انتخاب کنید:", reply_markup=export_format_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif data.startswith("export_users:"):
+        fmt = data.split(":", 1)[1]
+        user_data = await state.get_data()
+        selected_panel_alias = user_data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        if not selected_panel_alias:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً ابتدا یک پنل انتخاب کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        if await export_users_logic(chat_id, selected_panel_alias, fmt, bot):
+            await log_to_channel(bot, chat_id, "خروجی کاربران", f"خروجی {fmt} کاربران پنل {selected_panel_alias} تهیه شد.")
+        message = await bot.send_message(chat_id, "منوی عملیات پنل:", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif data == "usage_report" or data == "usage_report:refresh":
+        user_data = await state.get_data()
+        selected_panel_alias = user_data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        if not selected_panel_alias:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً ابتدا یک پنل انتخاب کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        if not await usage_report_logic(chat_id, selected_panel_alias, bot, force_refresh=data.endswith(":refresh")):
+            message = await bot.send_message(chat_id, "منوی عملیات پنل:", reply_markup=panel_action_menu())
+            await state.update_data(login_messages=[message.message_id])
+    elif data == "import_users":
+        user_data = await state.get_data()
+        selected_panel_alias = user_data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        if not selected_panel_alias:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً ابتدا یک پنل انتخاب کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await state.update_data(selected_panel_alias=selected_panel_alias)
+        await state.set_state(Form.awaiting_import_file)
+        message = await bot.send_message(
+            chat_id,
+            "📥 فایل CSV کاربران را ارسال کنید.\n"
+            "ستون username الزامی است؛ ستون‌های data_limit (بایت یا مثلاً 20GB)، expire (تاریخ ISO یا timestamp)، note و status اختیاری‌اند.\n"
+            "فایل خروجی همین ربات را می‌توانید مستقیماً ارسال کنید. کاربران موجود به‌روزرسانی و بقیه ایجاد می‌شوند."
+        )
+        await state.update_data(login_messages=[message.message_id])
     elif data == "random_username":
         random_username = str(uuid.uuid4())[:8]
         await state.update_data(username=random_username)
@@ -474,37 +657,37 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.clear()
             return
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {panel[2]}"}
-                async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                    if response.status == 200:
-                        user_data = await response.json()
-                        current_inbounds = []
-                        for proto, settings in user_data.get("inbounds", {}).items():
-                            if proto == protocol:
-                                for tag in settings:
-                                    current_inbounds.append(f"{proto}:{tag}")
-                    else:
-                        message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
-                        await state.update_data(login_messages=[message.message_id])
-                        await state.clear()
-                        return
-                async with session.get(f"{panel[1].rstrip('/')}/api/inbounds", headers=headers) as response:
-                    if response.status == 200:
-                        inbounds_data = await response.json()
-                        available_inbounds = []
-                        for proto, settings in inbounds_data.items():
-                            if proto == protocol:
-                                for inbound in settings:
-                                    available_inbounds.append(f"{proto}:{inbound['tag']}")
-                    else:
-                        message = await bot.send_message(chat_id, "❌ نتوانستم اینباند‌ها را دریافت کنم.")
-                        await state.update_data(login_messages=[message.message_id])
-                        await state.clear()
-                        return
-                await state.update_data(selected_inbounds=current_inbounds, available_inbounds=available_inbounds, selected_panel_alias=selected_panel_alias)
-                message = await bot.send_message(chat_id, f"⚙️ انتخاب اینباندهای {protocol} برای کاربر {username}:", reply_markup=config_selection_menu(available_inbounds, current_inbounds, username))
+            status, user_data = await get_user(panel[1], panel[2], username)
+            if status == 200:
+                current_inbounds = []
+                for proto, settings in user_data.get("inbounds", {}).items():
+                    if proto == protocol:
+                        for tag in settings:
+                            current_inbounds.append(f"{proto}:{tag}")
+            else:
+                message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
+                await state.update_data(login_messages=[message.message_id])
+                await state.clear()
+                return
+            try:
+                inbounds_data = await get_inbounds(panel[1], panel[2])
+                if not inbounds_data.get(protocol):
+                    # The protocol may have been added on the panel after the cache was filled
+                    inbounds_data = await get_inbounds(panel[1], panel[2], force_refresh=True)
+            except ValueError as e:
+                logger.error(f"Error fetching inbounds: {str(e)}")
+                message = await bot.send_message(chat_id, "❌ نتوانستم اینباند‌ها را دریافت کنم.")
                 await state.update_data(login_messages=[message.message_id])
+                await state.clear()
+                return
+            available_inbounds = []
+            for proto, settings in inbounds_data.items():
+                if proto == protocol:
+                    for inbound in settings:
+                        available_inbounds.append(f"{proto}:{inbound['tag']}")
+            await state.update_data(selected_inbounds=current_inbounds, available_inbounds=available_inbounds, selected_panel_alias=selected_panel_alias)
+            message = await bot.send_message(chat_id, f"⚙️ انتخاب اینباندهای {protocol} برای کاربر {username}:", reply_markup=config_selection_menu(available_inbounds, current_inbounds, username))
+            await state.update_data(login_messages=[message.message_id])
         except Exception as e:
             logger.error(f"Error managing inbounds: {str(e)}")
             message = await bot.send_message(chat_id, f"❌ خطا در مدیریت اینباند‌ها: {str(e)}")
@@ -580,29 +763,26 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.clear()
             return
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {panel[2]}", "Content-Type": "application/json"}
-                async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                    if response.status == 200:
-                        current_user = await response.json()
-                    else:
-                        message = await bot.send_message(chat_id, "❌ نتوانستم داده کاربر را دریافت کنم.")
-                        await state.update_data(login_messages=[message.message_id])
-                        await state.clear()
-                        return
-                inbounds_dict = current_user.get("inbounds", {})
-                inbounds_dict[protocol] = [inbound.split(":")[1] for inbound in selected_inbounds if inbound.startswith(protocol + ":")]
-                current_user["inbounds"] = inbounds_dict
-                async with session.put(f"{panel[1].rstrip('/')}/api/user/{username}", json=current_user, headers=headers) as response:
-                    if response.status == 200:
-                        message = await bot.send_message(chat_id, f"✅ اینباندهای {protocol} برای کاربر '{username}' با موفقیت به‌روزرسانی شد.")
-                        await state.update_data(login_messages=[message.message_id])
-                        await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
-                        await log_to_channel(bot, chat_id, "به‌روزرسانی اینباند‌ها", f"اینباندهای {protocol} برای کاربر {username} به‌روزرسانی شد.")
-                    else:
-                        result = await response.json()
-                        message = await bot.send_message(chat_id, f"❌ خطا در به‌روزرسانی اینباند‌ها: {result.get('detail', 'No details')}")
-                        await state.update_data(login_messages=[message.message_id])
+            client = get_client(panel[1])
+            status, current_user = await get_user(panel[1], panel[2], username)
+            if status != 200:
+                message = await bot.send_message(chat_id, "❌ نتوانستم داده کاربر را دریافت کنم.")
+                await state.update_data(login_messages=[message.message_id])
+                await state.clear()
+                return
+            inbounds_dict = current_user.get("inbounds", {})
+            inbounds_dict[protocol] = [inbound.split(":")[1] for inbound in selected_inbounds if inbound.startswith(protocol + ":")]
+            current_user["inbounds"] = inbounds_dict
+            status, result = await client.put(f"/api/user/{username}", panel[2], json=current_user)
+            if status == 200:
+                user_updated(panel[1], panel[2], result)
+                message = await bot.send_message(chat_id, f"✅ اینباندهای {protocol} برای کاربر '{username}' با موفقیت به‌روزرسانی شد.")
+                await state.update_data(login_messages=[message.message_id])
+                await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
+                await log_to_channel(bot, chat_id, "به‌روزرسانی اینباند‌ها", f"اینباندهای {protocol} برای کاربر {username} به‌روزرسانی شد.")
+            else:
+                message = await bot.send_message(chat_id, f"❌ خطا در به‌روزرسانی اینباند‌ها: {result.get('detail', 'No details')}")
+                await state.update_data(login_messages=[message.message_id])
             await state.clear()
         except Exception as e:
             logger.error(f"Error confirming inbounds: {str(e)}")
@@ -647,29 +827,29 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
             await state.update_data(login_messages=[message.message_id])
             return
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {panel[2]}"}
-                async with session.post(f"{panel[1].rstrip('/')}/api/user/{username}/revoke_sub", headers=headers) as response:
-                    if response.status != 200:
-                        result = await response.json()
-                        message = await bot.send_message(chat_id, f"❌ خطا در لغو اشتراک: {result.get('detail', 'No details')}")
-                        await state.update_data(login_messages=[message.message_id])
-                        return
-                async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                    if response.status == 200:
-                        user_data = await response.json()
-                        subscription_url = user_data.get("subscription_url", None)
-                        if subscription_url:
-                            message = await bot.send_message(chat_id, f"🔄 لینک جدید برای کاربر '{username}':\n{subscription_url}")
-                            await state.update_data(login_messages=[message.message_id])
-                            await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
-                            await log_to_channel(bot, chat_id, "تولید لینک جدید", f"لینک اشتراک برای کاربر {username} تولید شد.")
-                        else:
-                            message = await bot.send_message(chat_id, "❌ لینک اشتراک در دسترس نیست.")
-                            await state.update_data(login_messages=[message.message_id])
-                    else:
-                        message = await bot.send_message(chat_id, "❌ نتوانستم داده کاربر را دریافت کنم.")
-                        await state.update_data(login_messages=[message.message_id])
+            client = get_client(panel[1])
+            status, user_data = await client.post(f"/api/user/{username}/revoke_sub", panel[2])
+            if status != 200:
+                message = await bot.send_message(chat_id, f"❌ خطا در لغو اشتراک: {user_data.get('detail', 'No details')}")
+                await state.update_data(login_messages=[message.message_id])
+                return
+            if user_data.get("username"):
+                user_updated(panel[1], panel[2], user_data)
+            else:
+                status, user_data = await get_user(panel[1], panel[2], username, force_refresh=True)
+            if status == 200:
+                subscription_url = user_data.get("subscription_url", None)
+                if subscription_url:
+                    message = await bot.send_message(chat_id, f"🔄 لینک جدید برای کاربر '{username}':\n{subscription_url}")
+                    await state.update_data(login_messages=[message.message_id])
+                    await show_user_info(query, state, username, chat_id, selected_panel_alias, bot)
+                    await log_to_channel(bot, chat_id, "تولید لینک جدید", f"لینک اشتراک برای کاربر {username} تولید شد.")
+                else:
+                    message = await bot.send_message(chat_id, "❌ لینک اشتراک در دسترس نیست.")
+                    await state.update_data(login_messages=[message.message_id])
+            else:
+                message = await bot.send_message(chat_id, "❌ نتوانستم داده کاربر را دریافت کنم.")
+                await state.update_data(login_messages=[message.message_id])
         except Exception as e:
             logger.error(f"Error regenerating link: {str(e)}")
             message = await bot.send_message(chat_id, f"❌ خطا: {str(e)}")
@@ -686,6 +866,36 @@ async def button_callback(query: types.CallbackQuery, state: FSMContext, bot: Bo
         await state.set_state(Form.awaiting_new_expire_time)
         message = await bot.send_message(chat_id, f"⏰ زمان انقضای جدید (به روز) برای کاربر '{username}' را وارد کنید (برای نامحدود، 0 وارد کنید):")
         await state.update_data(login_messages=[message.message_id])
+    elif data in ("delete_expired_users", "delete_exhausted_users"):
+        user_data = await state.get_data()
+        selected_panel_alias = user_data.get("selected_panel_alias")
+        if not selected_panel_alias:
+            selected_panel_alias = get_selected_panel(chat_id)
+            if selected_panel_alias:
+                await state.update_data(selected_panel_alias=selected_panel_alias)
+        if not selected_panel_alias:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً ابتدا یک پنل انتخاب کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        if data == "delete_expired_users":
+            await delete_expired_users(chat_id, selected_panel_alias, bot, state)
+        else:
+            await delete_data_exhausted_users(chat_id, selected_panel_alias, bot, state)
+    elif data.startswith("confirm_delete:"):
+        _, action, selected_panel_alias = data.split(":", 2)
+        if action == "expired":
+            success = await delete_expired_users(chat_id, selected_panel_alias, bot, state, confirm=True)
+            log_action = "حذف کاربران منقضی"
+        else:
+            success = await delete_data_exhausted_users(chat_id, selected_panel_alias, bot, state, confirm=True)
+            log_action = "حذف کاربران بدون حجم"
+        if success:
+            await log_to_channel(bot, chat_id, log_action, f"عملیات {log_action} در پنل {selected_panel_alias} انجام شد.")
+        message = await bot.send_message(chat_id, "منوی عملیات پنل:", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif data.startswith("cancel_delete:"):
+        message = await bot.send_message(chat_id, "❌ عملیات حذف لغو شد.", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
     elif data == "back_to_main":
         await state.clear()
         message = await bot.send_message(chat_id, "🏠 به منوی اصلی بازگشتید:", reply_markup=main_menu(is_owner(chat_id)))
@@ -813,28 +1023,33 @@ async def message_handler(message: types.Message, state: FSMContext, bot: Bot):
             await state.clear()
             return
         try:
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {panel[2]}"}
-                async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers, timeout=5) as response:
-                    if response.status != 200:
-                        result = await response.json()
-                        message = await bot.send_message(chat_id, f"❌ خطا در جستجو: {result.get('detail', 'کاربر یافت نشد')}")
-                        await state.update_data(login_messages=[message.message_id])
-                        await state.clear()
-                        return
-                    user = await response.json()
-                    response_text = (
-                        f"👤 نام کاربری: {user['username']}\n"
-                        f"📊 وضعیت: {user['status']}\n"
-                        f"📈 حجم مصرفی: {format_traffic(user.get('used_traffic', 0))}\n"
-                        f"📊 حجم کل: {format_traffic(user.get('data_limit', 0)) if user.get('data_limit') else 'نامحدود'}\n"
-                        f"⏰ زمان انقضا: {format_expire_time(user.get('expire'))}\n"
-                        f"📝 یادداشت: {user.get('note', 'هیچ')}\n"
-                        f"🔗 لینک اشتراک: {user.get('subscription_url', 'ناموجود')}"
-                    )
-                    message = await bot.send_message(chat_id, response_text, reply_markup=user_action_menu(username))
-                    await state.update_data(login_messages=[message.message_id])
-                    await log_to_channel(bot, chat_id, "جستجوی کاربر", f"کاربر {username} جستجو شد.")
+            matches = (await ensure_username_index(panel[1], panel[2])).search(username)
+        except Exception as e:
+            logger.warning(f"Search index unavailable, falling back to exact lookup: {str(e)}")
+            matches = []
+        if len(matches) > 1 or (matches and matches[0]["username"].lower() != username):
+            await show_search_results(chat_id, state, bot, username, matches)
+            await log_to_channel(bot, chat_id, "جستجوی کاربر", f"عبارت {username} جستجو شد ({len(matches)} نتیجه).")
+            return
+        try:
+            status, user = await get_user(panel[1], panel[2], username, timeout=5)
+            if status != 200:
+                message = await bot.send_message(chat_id, f"❌ خطا در جستجو: {user.get('detail', 'کاربر یافت نشد')}")
+                await state.update_data(login_messages=[message.message_id])
+                await state.clear()
+                return
+            response_text = (
+                f"👤 نام کاربری: {user['username']}\n"
+                f"📊 وضعیت: {user['status']}\n"
+                f"📈 حجم مصرفی: {format_traffic(user.get('used_traffic', 0))}\n"
+                f"📊 حجم کل: {format_traffic(user.get('data_limit', 0)) if user.get('data_limit') else 'نامحدود'}\n"
+                f"⏰ زمان انقضا: {format_expire_time(user.get('expire'))}\n"
+                f"📝 یادداشت: {user.get('note', 'هیچ')}\n"
+                f"🔗 لینک اشتراک: {user.get('subscription_url', 'ناموجود')}"
+            )
+            message = await bot.send_message(chat_id, response_text, reply_markup=user_action_menu(username))
+            await state.update_data(login_messages=[message.message_id])
+            await log_to_channel(bot, chat_id, "جستجوی کاربر", f"کاربر {username} جستجو شد.")
         except Exception as e:
             logger.error(f"Search user error: {str(e)}")
             message = await bot.send_message(chat_id, f"❌ خطا در جستجو: {str(e)}")
@@ -881,6 +1096,128 @@ async def message_handler(message: types.Message, state: FSMContext, bot: Bot):
             message = await bot.send_message(chat_id, error_msg)
             await state.update_data(login_messages=[message.message_id])
         await state.clear()
+    elif current_state == Form.awaiting_bulk_prefix.state:
+        prefix = text.strip()
+        if not re.fullmatch(r"[a-z0-9_]{1,28}", prefix):
+            message = await bot.send_message(chat_id, "⚠️ پیشوند فقط می‌تواند شامل حروف انگلیسی کوچک، عدد و _ باشد (حداکثر ۲۸ کاراکتر).")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await state.update_data(bulk_prefix=prefix)
+        await state.set_state(Form.awaiting_bulk_start)
+        message = await bot.send_message(chat_id, "🔢 شماره شروع شمارنده را وارد کنید (مثلاً 1، یا 001 برای شماره‌های سه‌رقمی):")
+        await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_bulk_start.state:
+        start_text = text.strip()
+        if not start_text.isdigit():
+            message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد معتبر وارد کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        # A leading zero (e.g. 001) asks for a fixed-width counter
+        width = len(start_text) if start_text.startswith("0") and len(start_text) > 1 else 0
+        await state.update_data(bulk_start=int(start_text), bulk_width=width)
+        await state.set_state(Form.awaiting_bulk_count)
+        message = await bot.send_message(chat_id, f"👥 تعداد کاربران را وارد کنید (حداکثر {BULK_CREATE_MAX_COUNT}):")
+        await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_bulk_count.state:
+        try:
+            count = int(text.strip())
+        except ValueError:
+            count = 0
+        if not 1 <= count <= BULK_CREATE_MAX_COUNT:
+            message = await bot.send_message(chat_id, f"⚠️ تعداد باید بین 1 و {BULK_CREATE_MAX_COUNT} باشد.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        data = await state.get_data()
+        first_username = f"{data['bulk_prefix']}{str(data['bulk_start']).zfill(data['bulk_width'])}"
+        last_username = f"{data['bulk_prefix']}{str(data['bulk_start'] + count - 1).zfill(data['bulk_width'])}"
+        if len(first_username) < 3 or len(last_username) > 32:
+            message = await bot.send_message(chat_id, "⚠️ نام‌های کاربری باید بین ۳ تا ۳۲ کاراکتر باشند. پیشوند یا شمارنده را تغییر دهید.")
+            await state.update_data(login_messages=[message.message_id])
+            await state.set_state(Form.awaiting_bulk_prefix)
+            return
+        await state.update_data(bulk_count=count)
+        await state.set_state(Form.awaiting_bulk_data_limit)
+        message = await bot.send_message(chat_id, f"👤 {first_username} تا {last_username}\n📊 حجم هر کاربر (به گیگابایت) را وارد کنید (برای نامحدود، 0 وارد کنید):")
+        await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_bulk_data_limit.state:
+        try:
+            data_limit = int(float(text.strip()) * 1e9) if float(text.strip()) > 0 else 0
+            await state.update_data(bulk_data_limit=data_limit)
+            await state.set_state(Form.awaiting_bulk_expire_days)
+            message = await bot.send_message(chat_id, "⏰ زمان انقضا (به روز) را وارد کنید (برای نامحدود، 0 وارد کنید):")
+            await state.update_data(login_messages=[message.message_id])
+        except ValueError:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد معتبر وارد کنید.")
+            await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_bulk_expire_days.state:
+        try:
+            expire_days = int(text.strip())
+        except ValueError:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد معتبر وارد کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await state.update_data(bulk_expire_days=expire_days)
+        await state.set_state(Form.awaiting_action)
+        success = await bulk_create_users_logic(chat_id, state, bot)
+        if success:
+            data = await state.get_data()
+            await log_to_channel(bot, chat_id, "ایجاد گروهی کاربر", f"ایجاد گروهی {data['bulk_count']} کاربر با پیشوند {data['bulk_prefix']} در پنل {data['selected_panel_alias']} انجام شد.")
+        message = await bot.send_message(chat_id, "منوی عملیات پنل:", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_bulk_filter.state:
+        try:
+            user_filter = parse_user_filter(text)
+        except ValueError as e:
+            message = await bot.send_message(chat_id, f"⚠️ {str(e)}")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        await state.update_data(bulk_filter=user_filter)
+        await state.set_state(Form.awaiting_action)
+        message = await bot.send_message(chat_id, "🛠 چه تغییری روی این کاربران اعمال شود؟", reply_markup=bulk_modify_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_bulk_amount.state:
+        try:
+            amount = float(text.strip())
+            if amount <= 0:
+                raise ValueError
+        except ValueError:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد مثبت وارد کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        data = await state.get_data()
+        await state.update_data(bulk_amount=amount * 1024 ** 3 if data.get("bulk_action") == "add_traffic" else amount)
+        await state.set_state(Form.awaiting_action)
+        await bulk_modify_preview(chat_id, state, bot)
+    elif current_state == Form.awaiting_import_file.state:
+        if not message.document:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً فایل CSV را به صورت سند (document) ارسال کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        selected_panel_alias = data.get("selected_panel_alias")
+        await state.set_state(Form.awaiting_action)
+        if await import_users_logic(chat_id, selected_panel_alias, message.document, bot):
+            await log_to_channel(bot, chat_id, "ورود کاربران از CSV", f"فایل {message.document.file_name} در پنل {selected_panel_alias} اعمال شد.")
+        message = await bot.send_message(chat_id, "منوی عملیات پنل:", reply_markup=panel_action_menu())
+        await state.update_data(login_messages=[message.message_id])
+    elif current_state == Form.awaiting_users_page_number.state:
+        try:
+            page = int(text.strip()) - 1
+        except ValueError:
+            message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد معتبر وارد کنید.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        selected_panel_alias = data.get("selected_panel_alias") or get_selected_panel(chat_id)
+        panel = next((p for p in get_panels(chat_id) if p[0] == selected_panel_alias), None)
+        await state.set_state(Form.awaiting_action)
+        if not panel:
+            message = await bot.send_message(chat_id, "⚠️ پنل انتخاب‌شده یافت نشد.")
+            await state.update_data(login_messages=[message.message_id])
+            return
+        try:
+            await show_users_page(chat_id, state, bot, panel, max(0, page))
+        except Exception as e:
+            message = await bot.send_message(chat_id, f"❌ خطا در دریافت کاربران صفحه {page+1}: {str(e)}")
+            await state.update_data(login_messages=[message.message_id])
     elif current_state == Form.awaiting_new_data_limit.state:
         data = await state.get_data()
         username = data.get("existing_username")
@@ -903,36 +1240,32 @@ async def message_handler(message: types.Message, state: FSMContext, bot: Bot):
         try:
             input_value = text.strip()
             new_data_limit = int(float(input_value) * 1024 ** 3) if float(input_value) > 0 else 0
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {panel[2]}", "Content-Type": "application/json"}
-                async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                    if response.status == 200:
-                        current_user = await response.json()
-                    else:
-                        message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
-                        await state.update_data(login_messages=[message.message_id])
-                        return
-                current_user["data_limit"] = new_data_limit
-                current_user["used_traffic"] = 0
-                if "status" not in current_user or current_user["status"] not in ["active", "disabled", "on_hold"]:
-                    current_user["status"] = "active"
-                logger.debug(f"Sending data to API: {current_user}")
-                async with session.put(f"{panel[1].rstrip('/')}/api/user/{username}", json=current_user, headers=headers) as response:
-                    if response.status == 200:
-                        reset_url = f"{panel[1].rstrip('/')}/api/user/{username}/reset"
-                        async with session.post(reset_url, headers=headers) as reset_response:
-                            if reset_response.status == 200:
-                                message = await bot.send_message(chat_id, f"✅ حجم کاربر '{username}' به {format_traffic(new_data_limit) if new_data_limit else 'نامحدود'} تنظیم و ترافیک ریست شد.", reply_markup=user_action_menu(username))
-                                await state.update_data(login_messages=[message.message_id])
-                                await log_to_channel(bot, chat_id, "تغییر حجم کاربر", f"حجم کاربر {username} به {format_traffic(new_data_limit) if new_data_limit else 'نامحدود'} تنظیم و ترافیک ریست شد.")
-                            else:
-                                message = await bot.send_message(chat_id, f"⚠️ حجم تنظیم شد اما ریست ترافیک انجام نشد! ({reset_response.status})")
-                                await state.update_data(login_messages=[message.message_id])
-                        await state.set_state(Form.awaiting_user_action)
-                    else:
-                        result = await response.json()
-                        message = await bot.send_message(chat_id, f"❌ خطا در تنظیم حجم: {result.get('detail', 'No details')}")
-                        await state.update_data(login_messages=[message.message_id])
+            client = get_client(panel[1])
+            status, current_user = await get_user(panel[1], panel[2], username)
+            if status != 200:
+                message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
+                await state.update_data(login_messages=[message.message_id])
+                return
+            current_user["data_limit"] = new_data_limit
+            current_user["used_traffic"] = 0
+            if "status" not in current_user or current_user["status"] not in ["active", "disabled", "on_hold"]:
+                current_user["status"] = "active"
+            logger.debug(f"Sending data to API: {current_user}")
+            status, result = await client.put(f"/api/user/{username}", panel[2], json=current_user)
+            if status == 200:
+                reset_status, reset_result = await client.post(f"/api/user/{username}/reset", panel[2])
+                user_updated(panel[1], panel[2], reset_result if reset_status == 200 else result)
+                if reset_status == 200:
+                    message = await bot.send_message(chat_id, f"✅ حجم کاربر '{username}' به {format_traffic(new_data_limit) if new_data_limit else 'نامحدود'} تنظیم و ترافیک ریست شد.", reply_markup=user_action_menu(username))
+                    await state.update_data(login_messages=[message.message_id])
+                    await log_to_channel(bot, chat_id, "تغییر حجم کاربر", f"حجم کاربر {username} به {format_traffic(new_data_limit) if new_data_limit else 'نامحدود'} تنظیم و ترافیک ریست شد.")
+                else:
+                    message = await bot.send_message(chat_id, f"⚠️ حجم تنظیم شد اما ریست ترافیک انجام نشد! ({reset_status})")
+                    await state.update_data(login_messages=[message.message_id])
+                await state.set_state(Form.awaiting_user_action)
+            else:
+                message = await bot.send_message(chat_id, f"❌ خطا در تنظیم حجم: {result.get('detail', 'No details')}")
+                await state.update_data(login_messages=[message.message_id])
         except ValueError:
             message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد معتبر وارد کنید.")
             await state.update_data(login_messages=[message.message_id])
@@ -964,31 +1297,28 @@ async def message_handler(message: types.Message, state: FSMContext, bot: Bot):
             input_value = text.strip()
             new_expire_days = int(input_value)
             new_expire_time = int(datetime.now(timezone.utc).timestamp()) + new_expire_days * 86400 if new_expire_days > 0 else 0
-            async with aiohttp.ClientSession() as session:
-                headers = {"Authorization": f"Bearer {panel[2]}", "Content-Type": "application/json"}
-                async with session.get(f"{panel[1].rstrip('/')}/api/user/{username}", headers=headers) as response:
-                    if response.status == 200:
-                        current_user = await response.json()
-                    else:
-                        message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
-                        await state.update_data(login_messages=[message.message_id])
-                        await state.clear()
-                        return
-                current_user["expire"] = new_expire_time
-                if "status" not in current_user or current_user["status"] not in ["active", "disabled", "on_hold"]:
-                    current_user["status"] = "active"
-                logger.debug(f"Sending data to API: {current_user}")
-                async with session.put(f"{panel[1].rstrip('/')}/api/user/{username}", json=current_user, headers=headers) as response:
-                    if response.status == 200:
-                        message = await bot.send_message(chat_id, f"✅ زمان انقضای کاربر '{username}' به {new_expire_days if new_expire_days > 0 else 'نامحدود'} روز تنظیم شد.", reply_markup=user_action_menu(username))
-                        await state.update_data(login_messages=[message.message_id])
-                        await log_to_channel(bot, chat_id, "تغییر زمان انقضا", f"زمان انقضای کاربر {username} به {new_expire_days if new_expire_days > 0 else 'نامحدود'} روز تنظیم شد.")
-                        await state.clear()
-                    else:
-                        result = await response.json()
-                        message = await bot.send_message(chat_id, f"❌ خطا در تنظیم زمان انقضا: {result.get('detail', 'No details')}")
-                        await state.update_data(login_messages=[message.message_id])
-                        await state.clear()
+            client = get_client(panel[1])
+            status, current_user = await get_user(panel[1], panel[2], username)
+            if status != 200:
+                message = await bot.send_message(chat_id, "❌ کاربر یافت نشد.")
+                await state.update_data(login_messages=[message.message_id])
+                await state.clear()
+                return
+            current_user["expire"] = new_expire_time
+            if "status" not in current_user or current_user["status"] not in ["active", "disabled", "on_hold"]:
+                current_user["status"] = "active"
+            logger.debug(f"Sending data to API: {current_user}")
+            status, result = await client.put(f"/api/user/{username}", panel[2], json=current_user)
+            if status == 200:
+                user_updated(panel[1], panel[2], result)
+                message = await bot.send_message(chat_id, f"✅ زمان انقضای کاربر '{username}' به {new_expire_days if new_expire_days > 0 else 'نامحدود'} روز تنظیم شد.", reply_markup=user_action_menu(username))
+                await state.update_data(login_messages=[message.message_id])
+                await log_to_channel(bot, chat_id, "تغییر زمان انقضا", f"زمان انقضای کاربر {username} به {new_expire_days if new_expire_days > 0 else 'نامحدود'} روز تنظیم شد.")
+                await state.clear()
+            else:
+                message = await bot.send_message(chat_id, f"❌ خطا در تنظیم زمان انقضا: {result.get('detail', 'No details')}")
+                await state.update_data(login_messages=[message.message_id])
+                await state.clear()
         except ValueError:
             message = await bot.send_message(chat_id, "⚠️ لطفاً یک عدد معتبر وارد کنید.")
             await state.update_data(login_messages=[message.message_id])
@@ -1,5 +1,5 @@
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 def create_menu_layout(buttons: List[Optional[InlineKeyboardButton]], row_width: int = 2) -> InlineKeyboardMarkup:
     menu = InlineKeyboardMarkup(inline_keyboard=[], row_width=row_width)
@@ -29,6 +29,7 @@ def admin_management_menu() -> InlineKeyboardMarkup:
         InlineKeyboardButton(text="➕ افزودن مدیر", callback_data="add_admin"),
         InlineKeyboardButton(text="🗑 حذف مدیر", callback_data="remove_admin"),
         InlineKeyboardButton(text="📊 اطلاعات کاربر", callback_data="user_info"),
+        InlineKeyboardButton(text="🌐 داشبورد کل", callback_data="owner_dashboard"),
         InlineKeyboardButton(text="📋 تنظیم کانال لاگ", callback_data="set_log_channel"),
         InlineKeyboardButton(text="🔙 بازگشت به منوی اصلی", callback_data="back_to_main")
     ]
@@ -40,9 +41,13 @@ def panel_login_menu() -> InlineKeyboardMarkup:
     ]
     return create_menu_layout(buttons, row_width=1)
 
-def panel_selection_menu(panels: list) -> InlineKeyboardMarkup:
+PANEL_STATE_ICONS = {"closed": "📌", "half_open": "🟡", "open": "🔴"}
+
+def panel_selection_menu(panels: list, states: Optional[Dict[str, str]] = None) -> InlineKeyboardMarkup:
+    # states maps alias -> circuit breaker state, so admins can see a panel is down before clicking it
+    states = states or {}
     buttons = [
-        InlineKeyboardButton(text=f"📌 {alias}", callback_data=f"select_panel:{alias}")
+        InlineKeyboardButton(text=f"{PANEL_STATE_ICONS.get(states.get(alias), '📌')} {alias}", callback_data=f"select_panel:{alias}")
         for alias, _, _, _, _ in panels
     ]
     buttons.extend([
@@ -63,13 +68,45 @@ def panel_action_menu() -> InlineKeyboardMarkup:
     buttons = [
         InlineKeyboardButton(text="🔍 جستجوی کاربر", callback_data="search_user"),
         InlineKeyboardButton(text="➕ ایجاد کاربر", callback_data="create_user"),
+        InlineKeyboardButton(text="📦 ایجاد گروهی کاربر", callback_data="bulk_create_users"),
+        InlineKeyboardButton(text="🛠 ویرایش گروهی کاربران", callback_data="bulk_modify"),
+        InlineKeyboardButton(text="📤 خروجی کاربران", callback_data="export_users"),
+        InlineKeyboardButton(text="📥 ورود کاربران از CSV", callback_data="import_users"),
+        InlineKeyboardButton(text="🏆 پرمصرف‌ترین کاربران", callback_data="usage_report"),
         InlineKeyboardButton(text="👥 کاربران", callback_data="list_users"),
+        InlineKeyboardButton(text="⌛ حذف کاربران منقضی", callback_data="delete_expired_users"),
+        InlineKeyboardButton(text="📉 حذف کاربران بدون حجم", callback_data="delete_exhausted_users"),
         InlineKeyboardButton(text="🔙 بازگشت به انتخاب پنل", callback_data="back_to_panel_selection")
     ]
     return create_menu_layout(buttons, row_width=2)
 
-def users_list_menu(users: list, page: int = 0, limit: int = 21, total_count: int = None, stats: dict = None, total_pages: int = None) -> InlineKeyboardMarkup:
+BULK_MODIFY_LABELS = {
+    "extend_expire": "⏰ افزایش انقضا",
+    "add_traffic": "📊 افزایش حجم",
+    "reset_usage": "🔄 ریست مصرف",
+    "enable": "✅ فعال‌سازی",
+    "disable": "⛔ غیرفعال‌سازی",
+}
+
+def export_format_menu() -> InlineKeyboardMarkup:
+    buttons = [
+        InlineKeyboardButton(text="📄 CSV", callback_data="export_users:csv"),
+        InlineKeyboardButton(text="🧾 JSON", callback_data="export_users:json"),
+        InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_to_panel_action_menu")
+    ]
+    return create_menu_layout(buttons, row_width=2)
+
+def bulk_modify_action_menu() -> InlineKeyboardMarkup:
+    buttons = [
+        InlineKeyboardButton(text=label, callback_data=f"bulk_action:{action}")
+        for action, label in BULK_MODIFY_LABELS.items()
+    ]
+    buttons.append(InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_to_panel_action_menu"))
+    return create_menu_layout(buttons, row_width=2)
+
+def users_list_menu(users: list, page: int = 0, limit: int = 21, total_count: int = None, stats: dict = None, total_pages: int = None, nav_prefix: str = None) -> InlineKeyboardMarkup:
     # users: list of user dicts
+    # nav_prefix: callback prefix for both page buttons (e.g. "search_page"); defaults to prev/next_users_page
     def get_status_emoji(user):
         status = user.get('status', '').lower()
         expire = user.get('expire')
@@ -97,26 +134,30 @@ def users_list_menu(users: list, page: int = 0, limit: int = 21, total_count: in
         username = user.get('username', '-')
         emoji = get_status_emoji(user)
         buttons.append(InlineKeyboardButton(text=f"{emoji} {username}", callback_data=f"user_info:{username}"))
-    # Pagination controls
-    nav_buttons = []
-    # Show prev if not first page
-    if page > 0:
-        nav_buttons.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"prev_users_page:{page-1}"))
-    # Show next if there are more users after this page
-    has_next = False
+    menu = create_menu_layout(buttons, row_width=3)
+    # Pagination controls; with a known total there is no guessing and no trailing empty page
     if total_count is not None:
-        if (page + 1) * limit < total_count:
-            has_next = True
-    elif len(users) == limit:
-        has_next = True
+        total_pages = max(1, (total_count + limit - 1) // limit)
+    has_next = page + 1 < total_pages if total_pages else len(users) == limit
+    prev_prefix = nav_prefix or 'prev_users_page'
+    next_prefix = nav_prefix or 'next_users_page'
+    nav_row = []
+    if page > 1 and total_pages:
+        nav_row.append(InlineKeyboardButton(text="⏮", callback_data=f"{prev_prefix}:0"))
+    if page > 0:
+        nav_row.append(InlineKeyboardButton(text="⬅️ قبلی", callback_data=f"{prev_prefix}:{page-1}"))
+    if total_pages:
+        # Tapping the indicator on the users list asks for a page number to jump to
+        nav_row.append(InlineKeyboardButton(text=f"📄 {page+1}/{total_pages}", callback_data="users_page_jump" if nav_prefix is None else "noop"))
     if has_next:
-        nav_buttons.append(InlineKeyboardButton(text="بعدی ➡️", callback_data=f"next_users_page:{page+1}"))
-    if nav_buttons:
-        buttons.extend(nav_buttons)
+        nav_row.append(InlineKeyboardButton(text="بعدی ➡️", callback_data=f"{next_prefix}:{page+1}"))
+    if has_next and total_pages and page + 2 < total_pages:
+        nav_row.append(InlineKeyboardButton(text="⏭", callback_data=f"{next_prefix}:{total_pages-1}"))
+    if nav_row:
+        menu.inline_keyboard.append(nav_row)
     # Add back button to user list
-    buttons.append(InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_to_panel_action_menu"))
-    # 7 rows, 3 per row
-    return create_menu_layout(buttons, row_width=3)
+    menu.inline_keyboard.append([InlineKeyboardButton(text="🔙 بازگشت", callback_data="back_to_panel_action_menu")])
+    return menu
 
 def user_action_menu(username: str) -> InlineKeyboardMarkup:
     menu = InlineKeyboardMarkup(inline_keyboard=[], row_width=2)
@@ -21,4 +21,12 @@ class Form(StatesGroup):
     awaiting_new_expire_time = State()
     awaiting_log_channel = State()
     awaiting_user_action = State()
-
+    awaiting_bulk_prefix = State()
+    awaiting_bulk_start = State()
+    awaiting_bulk_count = State()
+    awaiting_bulk_data_limit = State()
+    awaiting_bulk_expire_days = State()
+    awaiting_bulk_filter = State()
+    awaiting_bulk_amount = State()
+    awaiting_import_file = State()
+    awaiting_users_page_number = State()
@@ -4,3 +4,97 @@ ADMIN_IDS = [123456789]
 VERSION = "v1.1.4"
 DB_PATH = "data/bot_data.db"
 CACHE_DURATION = 300
+
+# Marzban HTTP client connection pool
+HTTP_TIMEOUT = 10
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 20
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 60
+
+# Bulk operations
+BULK_CONCURRENCY = 10
+BULK_PROGRESS_INTERVAL = 2
+
+# Full-panel scans
+SCAN_PAGE_SIZE = 200
+SCAN_CONCURRENCY = 8
+
+# Local SQLite mirror of panel users
+USER_MIRROR_ENABLED = False
+USER_MIRROR_SYNC_INTERVAL = 300
+
+# Username search index
+SEARCH_INDEX_TTL = 600
+SEARCH_PAGE_SIZE = 21
+
+# Panel inbounds cache
+INBOUNDS_CACHE_TTL = 3600
+
+# Short-lived per-user cache
+USER_CACHE_TTL = 30
+
+# Panel retries and circuit breaker
+HTTP_RETRY_ATTEMPTS = 3
+HTTP_RETRY_BASE_DELAY = 0.5
+HTTP_RETRY_MAX_DELAY = 4
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_TIMEOUT = 30
+
+# Per-panel rate limits: requests per second, burst size and max requests in flight.
+# Interactive (button clicks) and background (bulk jobs, mirror sync) traffic have separate budgets.
+PANEL_INTERACTIVE_RATE = 20
+PANEL_INTERACTIVE_BURST = 20
+PANEL_INTERACTIVE_MAX_INFLIGHT = 10
+PANEL_BACKGROUND_RATE = 10
+PANEL_BACKGROUND_BURST = 10
+PANEL_BACKGROUND_MAX_INFLIGHT = 8
+
+# Panel access tokens are refreshed this many seconds before they expire
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_REFRESH_RETRY_INTERVAL = 60
+
+# Bulk user creation
+BULK_CREATE_MAX_COUNT = 500
+
+# Seconds to wait for each panel in multi-panel overviews
+OVERVIEW_PANEL_TIMEOUT = 8
+
+# Largest CSV accepted for user import (Telegram bots can download up to 20 MB)
+IMPORT_MAX_FILE_SIZE = 20 * 1024 * 1024
+
+# Prefetched user-list pages are served from memory for this many seconds
+PAGE_CACHE_TTL = 60
+
+# Panel stats are recomputed in the background this often; panel selection shows the cached value
+STATS_REFRESH_ENABLED = True
+STATS_REFRESH_INTERVAL = 240
+
+# Expiry and quota alerts. They are fed by scans that already read every user
+# (mirror sync, full-scan stats) and by changes made through the bot. Panels
+# that report /api/system counters are never fully scanned for stats, so
+# without the mirror the alerts only see users edited through the bot.
+ALERTS_ENABLED = USER_MIRROR_ENABLED
+ALERT_LEAD_TIME = 24 * 3600
+ALERT_BATCH_WINDOW = 3600
+ALERT_MIN_USAGE_WINDOW = 600
+ALERT_DIGEST_MAX_NAMES = 20
+
+# Per-user traffic samples for usage rates and exhaustion forecasts.
+# Raw samples are downsampled to hourly, then daily, then dropped.
+USAGE_STORE_DIR = "data/usage"
+USAGE_SAMPLE_INTERVAL = 900
+USAGE_RAW_RETENTION = 2 * 86400
+USAGE_HOURLY_RETENTION = 30 * 86400
+USAGE_DAILY_RETENTION = 365 * 86400
+USAGE_COMPACT_INTERVAL = 3600
+USAGE_FORECAST_WINDOW = 7 * 86400
+USAGE_FORECAST_MIN_SPAN = 3600
+# Samples come from a periodic compact scan of every panel, once per USAGE_SAMPLE_INTERVAL.
+# The mirror sync records them too, so the sampler only runs while the mirror is off;
+# with both off, only users opened in the bot are sampled and most forecasts lack data.
+USAGE_SAMPLER_ENABLED = True
+
+# Top consumers report
+USAGE_REPORT_TOP_K = 10
+USAGE_REPORT_TTL = 600
@@ -49,6 +49,39 @@ def init_db():
                 FOREIGN KEY (chat_id, selected_panel_alias) REFERENCES panels (chat_id, alias)
             )
         ''')
+        # Mirror tables from before they were scoped per panel admin; they are only a cache, so rebuild them
+        c.execute("SELECT name FROM pragma_table_info('panel_users') WHERE name = 'admin_username'")
+        if c.fetchone() is None:
+            c.execute('DROP TABLE IF EXISTS panel_users')
+            c.execute('DROP TABLE IF EXISTS panel_mirror_state')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS panel_users (
+                panel_url TEXT,
+                admin_username TEXT,
+                username TEXT,
+                status TEXT,
+                expire INTEGER,
+                data_limit INTEGER,
+                used_traffic INTEGER,
+                note TEXT,
+                subscription_url TEXT,
+                position INTEGER,
+                updated_at INTEGER,
+                PRIMARY KEY (panel_url, admin_username, username)
+            )
+        ''')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_panel_users_status ON panel_users (panel_url, admin_username, status)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_panel_users_expire ON panel_users (panel_url, admin_username, expire)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_panel_users_used_traffic ON panel_users (panel_url, admin_username, used_traffic)')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_panel_users_position ON panel_users (panel_url, admin_username, position)')
+        c.execute('''
+            CREATE TABLE IF NOT EXISTS panel_mirror_state (
+                panel_url TEXT,
+                admin_username TEXT,
+                synced_at INTEGER,
+                PRIMARY KEY (panel_url, admin_username)
+            )
+        ''')
         conn.commit()
         logger.info(f"Database initialized successfully at {DB_PATH}")
     except sqlite3.Error as e:
@@ -92,6 +125,21 @@ def get_panels(chat_id: int) -> list:
         if 'conn' in locals():
             conn.close()
 
+def get_all_panels() -> list:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('SELECT chat_id, alias, panel_url, token, username, password FROM panels')
+        panels = c.fetchall()
+        logger.info(f"Fetched {len(panels)} panels for all admins")
+        return panels
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching all panels: {e}")
+        return []
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
 def delete_panel(chat_id: int, alias: str):
     try:
         conn = sqlite3.connect(DB_PATH)
@@ -106,6 +154,41 @@ def delete_panel(chat_id: int, alias: str):
         if 'conn' in locals():
             conn.close()
 
+def get_panel_credentials(panel_url: str, token: str) -> tuple:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('''
+            SELECT username, password FROM panels
+            WHERE rtrim(panel_url, '/') = ? AND token = ?
+            LIMIT 1
+        ''', (panel_url.rstrip('/'), token))
+        return c.fetchone()
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching credentials for panel {panel_url}: {e}")
+        return None
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def update_panel_token(panel_url: str, old_token: str, new_token: str) -> int:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('''
+            UPDATE panels SET token = ?
+            WHERE rtrim(panel_url, '/') = ? AND token = ?
+        ''', (new_token, panel_url.rstrip('/'), old_token))
+        conn.commit()
+        logger.info(f"Token refreshed for {c.rowcount} panel rows of {panel_url}")
+        return c.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error updating token for panel {panel_url}: {e}")
+        return 0
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
 def add_admin(chat_id: int):
     try:
         conn = sqlite3.connect(DB_PATH)
@@ -205,6 +288,162 @@ def get_selected_panel(chat_id: int) -> str:
         if 'conn' in locals():
             conn.close()
 
+def _panel_user_row(panel_url: str, admin_username: str, user: dict, position, updated_at: int) -> tuple:
+    return (
+        panel_url, admin_username, user.get("username"), user.get("status"), user.get("expire") or 0,
+        user.get("data_limit") or 0, user.get("used_traffic") or 0, user.get("note"),
+        user.get("subscription_url"), position, updated_at
+    )
+
+def upsert_panel_users(panel_url: str, admin_username: str, users: list, updated_at: int, start_position: int = None) -> int:
+    """Insert new mirrored users and update changed ones; unchanged rows are not written. Returns rows written."""
+    rows = [
+        _panel_user_row(panel_url, admin_username, user, start_position + i if start_position is not None else None, updated_at)
+        for i, user in enumerate(users) if user.get("username")
+    ]
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.executemany('''
+            INSERT INTO panel_users (panel_url, admin_username, username, status, expire, data_limit, used_traffic, note, subscription_url, position, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (panel_url, admin_username, username) DO UPDATE SET
+                status = excluded.status,
+                expire = excluded.expire,
+                data_limit = excluded.data_limit,
+                used_traffic = excluded.used_traffic,
+                note = excluded.note,
+                subscription_url = COALESCE(excluded.subscription_url, panel_users.subscription_url),
+                position = COALESCE(excluded.position, panel_users.position),
+                updated_at = excluded.updated_at
+            WHERE panel_users.status IS NOT excluded.status
+                OR panel_users.expire IS NOT excluded.expire
+                OR panel_users.data_limit IS NOT excluded.data_limit
+                OR panel_users.used_traffic IS NOT excluded.used_traffic
+                OR panel_users.note IS NOT excluded.note
+                OR (excluded.subscription_url IS NOT NULL AND panel_users.subscription_url IS NOT excluded.subscription_url)
+                OR (excluded.position IS NOT NULL AND panel_users.position IS NOT excluded.position)
+        ''', rows)
+        conn.commit()
+        return c.rowcount
+    except sqlite3.Error as e:
+        logger.error(f"Error mirroring {len(rows)} users for panel {panel_url}: {e}")
+        return 0
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def get_panel_usernames(panel_url: str, admin_username: str) -> set:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('SELECT username FROM panel_users WHERE panel_url = ? AND admin_username = ?', (panel_url, admin_username))
+        return {row[0] for row in c.fetchall()}
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching mirrored usernames for panel {panel_url}: {e}")
+        return set()
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def delete_panel_users(panel_url: str, admin_username: str, usernames: list):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.executemany(
+            'DELETE FROM panel_users WHERE panel_url = ? AND admin_username = ? AND username = ?',
+            [(panel_url, admin_username, username) for username in usernames]
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error deleting {len(usernames)} mirrored users for panel {panel_url}: {e}")
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def set_mirror_synced_at(panel_url: str, admin_username: str, synced_at: int):
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute(
+            'INSERT OR REPLACE INTO panel_mirror_state (panel_url, admin_username, synced_at) VALUES (?, ?, ?)',
+            (panel_url, admin_username, synced_at)
+        )
+        conn.commit()
+    except sqlite3.Error as e:
+        logger.error(f"Error saving mirror state for panel {panel_url}: {e}")
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def get_mirror_synced_at(panel_url: str, admin_username: str) -> int:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('SELECT synced_at FROM panel_mirror_state WHERE panel_url = ? AND admin_username = ?', (panel_url, admin_username))
+        result = c.fetchone()
+        return result[0] if result else None
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching mirror state for panel {panel_url}: {e}")
+        return None
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def get_panel_users_page(panel_url: str, admin_username: str, offset: int, limit: int) -> list:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        conn.row_factory = sqlite3.Row
+        c = conn.cursor()
+        c.execute('''
+            SELECT username, status, expire, data_limit, used_traffic, note, subscription_url
+            FROM panel_users WHERE panel_url = ? AND admin_username = ?
+            ORDER BY position IS NULL, position, username
+            LIMIT ? OFFSET ?
+        ''', (panel_url, admin_username, limit, offset))
+        return [dict(row) for row in c.fetchall()]
+    except sqlite3.Error as e:
+        logger.error(f"Error fetching mirrored users for panel {panel_url}: {e}")
+        return []
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def count_panel_users(panel_url: str, admin_username: str) -> int:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('SELECT COUNT(*) FROM panel_users WHERE panel_url = ? AND admin_username = ?', (panel_url, admin_username))
+        return c.fetchone()[0]
+    except sqlite3.Error as e:
+        logger.error(f"Error counting mirrored users for panel {panel_url}: {e}")
+        return None
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
+def get_panel_users_stats(panel_url: str, admin_username: str, now: int) -> dict:
+    try:
+        conn = sqlite3.connect(DB_PATH)
+        c = conn.cursor()
+        c.execute('''
+            SELECT
+                COUNT(*),
+                SUM(status = 'active'),
+                SUM(status IN ('disabled', 'on_hold')),
+                SUM(expire > 0 AND expire < ?),
+                SUM(data_limit > 0 AND used_traffic >= data_limit)
+            FROM panel_users WHERE panel_url = ? AND admin_username = ?
+        ''', (now, panel_url, admin_username))
+        total, active, inactive, expired, limited = c.fetchone()
+        return {"total": total or 0, "active": active or 0, "inactive": inactive or 0, "expired": expired or 0, "limited": limited or 0}
+    except sqlite3.Error as e:
+        logger.error(f"Error computing mirrored stats for panel {panel_url}: {e}")
+        return None
+    finally:
+        if 'conn' in locals():
+            conn.close()
+
 try:
     init_db()
 except Exception as e:
@@ -1,40 +1,59 @@
+import asyncio
 import logging
-import telebot
-from telebot import types
-from bot.handlers import TelebotHandlers
-from bot_config import TOKEN
-import threading
-import time
+from aiogram import Bot, Dispatcher
+from aiogram.filters import Command
+from aiogram.fsm.storage.memory import MemoryStorage
+from bot.handlers import start, button_callback, message_handler
+from bot_config import TOKEN, USER_MIRROR_ENABLED, STATS_REFRESH_ENABLED, STATS_REFRESH_INTERVAL, ALERTS_ENABLED, USAGE_SAMPLER_ENABLED
 from database.db import init_db
+from api.client import close_clients
+from api.marzban_api import refresh_all_panels_stats
+from utils.user_mirror import run_mirror_sync
+from utils.scheduler import run_periodic
+from utils.alerts import run_alert_engine
+from utils.usage_store import run_usage_sampler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def main():
-    bot = telebot.TeleBot(TOKEN)
-    handlers = TelebotHandlers(bot)
-    
+background_tasks = []
+
+async def on_startup(bot: Bot):
+    if USER_MIRROR_ENABLED:
+        background_tasks.append(asyncio.create_task(run_mirror_sync()))
+    if USAGE_SAMPLER_ENABLED and not USER_MIRROR_ENABLED:
+        background_tasks.append(asyncio.create_task(run_usage_sampler()))
+    if STATS_REFRESH_ENABLED:
+        background_tasks.append(asyncio.create_task(run_periodic(refresh_all_panels_stats, STATS_REFRESH_INTERVAL, "stats refresh")))
+    if ALERTS_ENABLED:
+        if not USER_MIRROR_ENABLED:
+            logger.warning("Alerts are enabled without the user mirror; only users changed through the bot or seen by a full-scan stats fallback will be covered")
+        background_tasks.append(asyncio.create_task(run_alert_engine(bot)))
+
+async def on_shutdown():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    background_tasks.clear()
+    await close_clients()
+
+async def main():
+    bot = Bot(token=TOKEN)
+    dp = Dispatcher(storage=MemoryStorage())
+
     # Register handlers
-    @bot.message_handler(commands=['start'])
-    def start_handler(message):
-        handlers.start(message)
-    
-    @bot.callback_query_handler(func=lambda call: True)
-    def callback_handler(call):
-        handlers.button_callback(call)
-    
-    @bot.message_handler(func=lambda message: True, content_types=['text'])
-    def message_handler(message):
-        handlers.message_handler(message)
-    
+    dp.message.register(start, Command("start"))
+    dp.callback_query.register(button_callback)
+    dp.message.register(message_handler)
+    dp.startup.register(on_startup)
+    dp.shutdown.register(on_shutdown)
+
     try:
         logger.info("Starting bot...")
-        bot.infinity_polling(none_stop=True, interval=0)
-    except Exception as e:
-        logger.error(f"Bot error: {e}")
-        time.sleep(15)
-        main()
+        await dp.start_polling(bot)
+    finally:
+        await bot.session.close()
 
 if __name__ == "__main__":
     init_db()
-    main()
+    asyncio.run(main())
@@ -0,0 +1,29 @@
+from dataclasses import dataclass
+from typing import Any, Optional
+
+@dataclass(slots=True)
+class UserRecord:
+    """
+    The fields of an /api/users entry that full-panel scans need.
+
+    A panel's user dict also carries proxies, links and inbounds; a scan that
+    keeps users around holds these instead. get() and [] behave like the
+    dict, so code written for user dicts reads a record unchanged.
+    """
+    username: Optional[str]
+    status: Optional[str]
+    expire: Optional[int]
+    data_limit: Optional[int]
+    used_traffic: Optional[int]
+
+    @classmethod
+    def from_dict(cls, user: dict) -> "UserRecord":
+        return cls(user.get("username"), user.get("status"), user.get("expire"), user.get("data_limit"), user.get("used_traffic"))
+
+    def get(self, field: str, default: Any = None) -> Any:
+        return getattr(self, field) if field in self.__slots__ else default
+
+    def __getitem__(self, field: str) -> Any:
+        if field not in self.__slots__:
+            raise KeyError(field)
+        return getattr(self, field)
@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from aiogram import Bot
+from bot_config import ALERT_LEAD_TIME, ALERT_BATCH_WINDOW, ALERT_MIN_USAGE_WINDOW, ALERT_DIGEST_MAX_NAMES
+from database.db import get_all_panels
+from utils.message_utils import split_text
+
+logger = logging.getLogger(__name__)
+
+EXPIRE = "expire"
+QUOTA = "quota"
+
+# Everything below is kept per scope, a (panel_url, panel admin username) pair: non-sudo
+# admins only see their own users, so events are only reported to chats using the same admin.
+# Per scope: username -> (used_traffic, observed_at), the usage sample quota projections are measured from
+_usage_samples: Dict[Tuple[str, str], Dict[str, Tuple[int, float]]] = {}
+# Per scope: (username, kind) -> (event_at, marker) for every upcoming event
+_events: Dict[Tuple[str, str], Dict[Tuple[str, str], Tuple[int, int]]] = {}
+# Per scope: heap of (notify_at, event_at, username, kind, marker); entries no longer in _events are skipped
+_heaps: Dict[Tuple[str, str], List[tuple]] = {}
+# Per scope: (username, kind) -> marker already alerted, so an event is reported once
+_alerted: Dict[Tuple[str, str], Dict[Tuple[str, str], int]] = {}
+_wakeup: Optional[asyncio.Event] = None
+
+def _set_event(scope: Tuple[str, str], username: str, kind: str, event: Optional[Tuple[int, int]]):
+    events = _events.setdefault(scope, {})
+    key = (username, kind)
+    if event is None:
+        events.pop(key, None)
+        _alerted.get(scope, {}).pop(key, None)
+        return
+    if events.get(key) == event:
+        return
+    events[key] = event
+    event_at, marker = event
+    if _alerted.get(scope, {}).get(key) not in (None, marker):
+        # Renewed or recharged since the last alert: the next event is a new one
+        _alerted[scope].pop(key)
+    heap = _heaps.setdefault(scope, [])
+    heapq.heappush(heap, (event_at - ALERT_LEAD_TIME, event_at, username, kind, marker))
+    if len(heap) > 2 * len(events) + 64:
+        _heaps[scope] = [(at - ALERT_LEAD_TIME, at, name, k, m) for (name, k), (at, m) in events.items()]
+        heapq.heapify(_heaps[scope])
+    if _wakeup is not None and _heaps[scope][0][0] == event_at - ALERT_LEAD_TIME:
+        _wakeup.set()
+
+def observe_user(panel_url: str, admin_username: Optional[str], user: dict, now: Optional[float] = None):
+    """
+    Update a user's upcoming expiry and projected quota exhaustion.
+
+    Expiry is the user's `expire`. Exhaustion is projected from the usage
+    growth since an earlier sample at least ALERT_MIN_USAGE_WINDOW seconds
+    old, so it needs the user to have been seen by two scans.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        admin_username: Panel admin whose credentials the user was read with;
+            None (an unregistered token) ignores the user.
+        user: User dictionary or record.
+        now: Observation time; defaults to the current time.
+    """
+    username = user.get("username")
+    if not username or admin_username is None:
+        return
+    scope = (panel_url.rstrip('/'), admin_username)
+    now = time.time() if now is None else now
+    active = user.get("status") == "active"
+
+    expire = user.get("expire") or 0
+    _set_event(scope, username, EXPIRE, (expire, expire) if active and expire > now else None)
+
+    data_limit = user.get("data_limit") or 0
+    used_traffic = user.get("used_traffic") or 0
+    samples = _usage_samples.setdefault(scope, {})
+    sample = samples.get(username)
+    if sample is None or used_traffic < sample[0]:
+        # First sighting or a usage reset: start measuring again
+        samples[username] = (used_traffic, now)
+        _set_event(scope, username, QUOTA, None)
+        return
+    previous_used, observed_at = sample
+    if now - observed_at < ALERT_MIN_USAGE_WINDOW:
+        return
+    samples[username] = (used_traffic, now)
+    if not active or data_limit <= 0 or used_traffic >= data_limit or used_traffic == previous_used:
+        _set_event(scope, username, QUOTA, None)
+        return
+    rate = (used_traffic - previous_used) / (now - observed_at)
+    _set_event(scope, username, QUOTA, (int(now + (data_limit - used_traffic) / rate), data_limit))
+
+def observe_users(panel_url: str, admin_username: Optional[str], users: List[dict], now: Optional[float] = None):
+    now = time.time() if now is None else now
+    for user in users:
+        observe_user(panel_url, admin_username, user, now)
+
+def forget_user(panel_url: str, admin_username: Optional[str], username: str):
+    scope = (panel_url.rstrip('/'), admin_username)
+    _usage_samples.get(scope, {}).pop(username, None)
+    for kind in (EXPIRE, QUOTA):
+        _set_event(scope, username, kind, None)
+
+def finish_panel_scan(panel_url: str, admin_username: Optional[str], seen: set):
+    """Drop users a complete scan with this admin's credentials no longer found on the panel."""
+    scope = (panel_url.rstrip('/'), admin_username)
+    for username in set(_usage_samples.get(scope, {})) - seen:
+        forget_user(panel_url, admin_username, username)
+
+def _next_notify_at() -> Optional[float]:
+    heads = [heap[0][0] for heap in _heaps.values() if heap]
+    return min(heads) if heads else None
+
+def _pop_due(until: float) -> Dict[Tuple[str, str], Dict[str, List[Tuple[str, int]]]]:
+    """Pop every current, not yet alerted event due by `until`, as scope -> kind -> [(username, event_at)]."""
+    due = {}
+    now = time.time()
+    for scope, heap in _heaps.items():
+        events = _events.get(scope, {})
+        alerted = _alerted.setdefault(scope, {})
+        while heap and heap[0][0] <= until:
+            _, event_at, username, kind, marker = heapq.heappop(heap)
+            key = (username, kind)
+            if events.get(key) != (event_at, marker) or alerted.get(key) == marker or event_at <= now:
+                continue
+            alerted[key] = marker
+            due.setdefault(scope, {}).setdefault(kind, []).append((username, event_at))
+    return due
+
+def _format_group(title: str, entries: List[Tuple[str, int]], now: float) -> str:
+    entries.sort(key=lambda entry: entry[1])
+    names = "، ".join(
+        f"{username} ({max(1, round((event_at - now) / 3600))} ساعت)" for username, event_at in entries[:ALERT_DIGEST_MAX_NAMES]
+    )
+    more = f" و {len(entries) - ALERT_DIGEST_MAX_NAMES} کاربر دیگر" if len(entries) > ALERT_DIGEST_MAX_NAMES else ""
+    return f"{title.format(count=len(entries))}\n{names}{more}"
+
+def build_digests(due: Dict[Tuple[str, str], Dict[str, List[Tuple[str, int]]]]) -> Dict[int, str]:
+    """One digest text per chat, covering the panels it registered with the credentials that produced the events."""
+    now = time.time()
+    hours = ALERT_LEAD_TIME // 3600
+    sections: Dict[int, List[str]] = {}
+    for chat_id, alias, panel_url, _, admin_username, _ in get_all_panels():
+        kinds = due.get((panel_url.rstrip('/'), admin_username))
+        if not kinds:
+            continue
+        lines = [f"📌 پنل '{alias}':"]
+        if kinds.get(EXPIRE):
+            lines.append(_format_group(f"⌛ {{count}} کاربر تا {hours} ساعت آینده منقضی می‌شوند:", kinds[EXPIRE], now))
+        if kinds.get(QUOTA):
+            lines.append(_format_group(f"📉 {{count}} کاربر احتمالاً تا {hours} ساعت آینده به سقف حجم می‌رسند:", kinds[QUOTA], now))
+        sections.setdefault(chat_id, []).append("\n".join(lines))
+    return {chat_id: "🔔 هشدار کاربران\n\n" + "\n\n".join(parts) for chat_id, parts in sections.items()}
+
+async def run_alert_engine(bot: Bot):
+    """
+    Background task: send alert digests as events come due.
+
+    The task sleeps until the earliest queued event reaches its notice time,
+    or until a scan queues an earlier one. Everything due within the next
+    ALERT_BATCH_WINDOW seconds goes into the same digest.
+    """
+    global _wakeup
+    _wakeup = asyncio.Event()
+    while True:
+        _wakeup.clear()
+        next_at = _next_notify_at()
+        if next_at is not None and next_at <= time.time():
+            for chat_id, text in build_digests(_pop_due(time.time() + ALERT_BATCH_WINDOW)).items():
+                try:
+                    for chunk in split_text(text):
+                        await bot.send_message(chat_id, chunk)
+                except Exception as e:
+                    logger.error(f"Failed to send alert digest to {chat_id}: {str(e)}")
+            continue
+        timeout = None if next_at is None else next_at - time.time()
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
@@ -1,4 +1,6 @@
+from collections import OrderedDict
 from datetime import datetime, timezone
+from typing import Optional, Tuple
 
 users_stats_cache = {}
 
@@ -11,10 +13,133 @@ def get_users_stats_cache(panel_url: str, token: str, cache_duration: int) -> di
             return cache_entry["stats"]
     return None
 
+def get_users_stats_cache_entry(panel_url: str, token: str) -> Optional[Tuple[dict, float]]:
+    """Cached stats with their age in seconds, however old they are."""
+    cache_entry = users_stats_cache.get(f"{panel_url}:{token}")
+    if cache_entry is None:
+        return None
+    return cache_entry["stats"], (datetime.now(timezone.utc) - cache_entry["timestamp"]).total_seconds()
+
 def set_users_stats_cache(panel_url: str, token: str, stats: dict):
     global users_stats_cache
     cache_key = f"{panel_url}:{token}"
     users_stats_cache[cache_key] = {
         "stats": stats,
         "timestamp": datetime.now(timezone.utc)
-    }
\ No newline at end of file
+    }
+
+inbounds_cache = {}
+
+def get_inbounds_cache(panel_url: str, cache_duration: int) -> dict:
+    cache_key = panel_url.rstrip('/')
+    if cache_key in inbounds_cache:
+        cache_entry = inbounds_cache[cache_key]
+        if (datetime.now(timezone.utc) - cache_entry["timestamp"]).total_seconds() < cache_duration:
+            return cache_entry["inbounds"]
+    return None
+
+def set_inbounds_cache(panel_url: str, inbounds: dict):
+    inbounds_cache[panel_url.rstrip('/')] = {
+        "inbounds": inbounds,
+        "timestamp": datetime.now(timezone.utc)
+    }
+
+def invalidate_inbounds_cache(panel_url: str):
+    inbounds_cache.pop(panel_url.rstrip('/'), None)
+
+
+user_cache = {}
+USER_CACHE_MAX_ENTRIES = 10000
+
+def get_user_cache(panel_url: str, token: str, username: str, cache_duration: int) -> dict:
+    cache_key = (panel_url.rstrip('/'), username)
+    if cache_key in user_cache:
+        cache_entry = user_cache[cache_key]
+        # Only the admin whose token fetched the user may read it; the panel checks ownership per admin
+        if cache_entry["token"] != token:
+            return None
+        if (datetime.now(timezone.utc) - cache_entry["timestamp"]).total_seconds() < cache_duration:
+            return cache_entry["user"]
+        del user_cache[cache_key]
+    return None
+
+def set_user_cache(panel_url: str, token: str, user: dict):
+    cache_key = (panel_url.rstrip('/'), user["username"])
+    # Re-insert so dict order stays oldest-first and overflow evicts the oldest entries.
+    # One slot per user: a newer copy fetched with any token replaces older ones, which are now stale.
+    user_cache.pop(cache_key, None)
+    user_cache[cache_key] = {
+        "user": user,
+        "token": token,
+        "timestamp": datetime.now(timezone.utc)
+    }
+    while len(user_cache) > USER_CACHE_MAX_ENTRIES:
+        del user_cache[next(iter(user_cache))]
+
+def invalidate_user_cache(panel_url: str, username: str):
+    user_cache.pop((panel_url.rstrip('/'), username), None)
+
+
+# Per-chat LRU of rendered user-list pages: {chat_id: OrderedDict[(panel_url, page, limit)] -> entry}
+page_cache = {}
+PAGE_CACHE_MAX_PAGES = 5
+
+def get_page_cache(chat_id: int, panel_url: str, page: int, limit: int, cache_duration: int) -> list:
+    chat_pages = page_cache.get(chat_id)
+    cache_key = (panel_url.rstrip('/'), page, limit)
+    if chat_pages is None or cache_key not in chat_pages:
+        return None
+    cache_entry = chat_pages[cache_key]
+    if (datetime.now(timezone.utc) - cache_entry["timestamp"]).total_seconds() >= cache_duration:
+        del chat_pages[cache_key]
+        return None
+    chat_pages.move_to_end(cache_key)
+    return cache_entry["users"]
+
+def set_page_cache(chat_id: int, panel_url: str, page: int, limit: int, users: list):
+    chat_pages = page_cache.setdefault(chat_id, OrderedDict())
+    cache_key = (panel_url.rstrip('/'), page, limit)
+    chat_pages[cache_key] = {
+        "users": users,
+        "timestamp": datetime.now(timezone.utc)
+    }
+    chat_pages.move_to_end(cache_key)
+    while len(chat_pages) > PAGE_CACHE_MAX_PAGES:
+        chat_pages.popitem(last=False)
+
+def invalidate_page_cache(panel_url: str):
+    # A user changed, so any cached page of this panel may show stale values
+    panel_key = panel_url.rstrip('/')
+    for chat_pages in page_cache.values():
+        for cache_key in [key for key in chat_pages if key[0] == panel_key]:
+            del chat_pages[cache_key]
+
+# Latest `total` reported by /api/users per panel and token: non-sudo admins only count their own users
+users_total_cache = {}
+
+def get_users_total_cache(panel_url: str, token: str, cache_duration: int) -> int:
+    cache_entry = users_total_cache.get(f"{panel_url}:{token}")
+    if cache_entry and (datetime.now(timezone.utc) - cache_entry["timestamp"]).total_seconds() < cache_duration:
+        return cache_entry["total"]
+    return None
+
+def set_users_total_cache(panel_url: str, token: str, total: int):
+    users_total_cache[f"{panel_url}:{token}"] = {
+        "total": total,
+        "timestamp": datetime.now(timezone.utc)
+    }
+
+# Top consumers / usage distribution report per panel and token
+usage_report_cache = {}
+
+def get_usage_report_cache(panel_url: str, token: str, cache_duration: int) -> dict:
+    cache_entry = usage_report_cache.get(f"{panel_url.rstrip('/')}:{token}")
+    if cache_entry and (datetime.now(timezone.utc) - cache_entry["timestamp"]).total_seconds() < cache_duration:
+        return cache_entry["report"]
+    return None
+
+def set_usage_report_cache(panel_url: str, token: str, report: dict):
+    usage_report_cache[f"{panel_url.rstrip('/')}:{token}"] = {
+        "report": report,
+        "timestamp": datetime.now(timezone.utc)
+    }
@@ -10,4 +10,24 @@ def format_expire_time(expire_timestamp: int) -> str:
 
 def format_traffic(traffic: int) -> str:
     # Use binary GB (1 GB = 1024 ** 3 bytes)
-    return f"{traffic / (1024 ** 3):.2f} GB 📊"
\ No newline at end of file
+    return f"{traffic / (1024 ** 3):.2f} GB 📊"
+
+
+def format_age(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds < 60:
+        return f"{seconds} ثانیه پیش"
+    if seconds < 3600:
+        return f"{seconds // 60} دقیقه پیش"
+    return f"{seconds // 3600} ساعت پیش"
+
+def format_usage_forecast(forecast) -> str:
+    """Usage rate and exhaustion estimate lines for the user info view."""
+    if forecast is None:
+        return "📉 میانگین مصرف: داده کافی نیست\n"
+    rate, seconds_left = forecast
+    text = f"📉 میانگین مصرف: {rate * 86400 / (1024 ** 3):.2f} GB در روز\n"
+    if seconds_left is not None:
+        days_left = seconds_left / 86400
+        text += f"⏳ اتمام حجم: {'کمتر از یک روز دیگر' if days_left < 1 else f'حدود {round(days_left)} روز دیگر'}\n"
+    return text
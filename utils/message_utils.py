@@ -1,4 +1,5 @@
 import asyncio
+import time
 import logging
 from aiogram import Bot
 from aiogram.fsm.context import FSMContext
@@ -19,3 +20,36 @@ async def cleanup_messages(bot: Bot, chat_id: int, state: FSMContext):
                     await asyncio.sleep(1)  # Wait before retrying
     await asyncio.gather(*[delete_message(message_id) for message_id in login_messages], return_exceptions=True)
     await state.update_data(login_messages=[])
+
+def make_progress_reporter(bot: Bot, chat_id: int, message_id: int, title: str, interval: float = 2):
+    """Return a (done, total) callback that edits a progress message at most once per `interval` seconds."""
+    last_edit = {"at": 0.0}
+    async def report(done: int, total: int):
+        now = time.monotonic()
+        if done < total and now - last_edit["at"] < interval:
+            return
+        last_edit["at"] = now
+        try:
+            await bot.edit_message_text(f"{title}\n⏳ پیشرفت: {done}/{total}", chat_id=chat_id, message_id=message_id)
+        except Exception as e:
+            logger.warning(f"Failed to update progress message {message_id}: {str(e)}")
+    return report
+
+def split_text(text: str, limit: int = 4000) -> list:
+    """Split text into chunks under Telegram's message limit, breaking at blank lines where possible."""
+    chunks = []
+    current = ""
+    for block in text.split("\n\n"):
+        candidate = f"{current}\n\n{block}" if current else block
+        if len(candidate) <= limit:
+            current = candidate
+            continue
+        if current:
+            chunks.append(current)
+        while len(block) > limit:
+            chunks.append(block[:limit])
+            block = block[limit:]
+        current = block
+    if current:
+        chunks.append(current)
+    return chunks
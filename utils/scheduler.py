@@ -0,0 +1,24 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+async def run_periodic(job: Callable[[], Awaitable], interval: float, name: str, initial_delay: float = 0):
+    """
+    Run `job` every `interval` seconds until cancelled.
+
+    A failing run is logged and does not stop the schedule. The interval is
+    measured from the end of one run to the start of the next, so a slow run
+    never overlaps the following one.
+    """
+    if initial_delay:
+        await asyncio.sleep(initial_delay)
+    while True:
+        try:
+            await job()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Scheduled job '{name}' failed: {str(e)}")
+        await asyncio.sleep(interval)
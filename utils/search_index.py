@@ -0,0 +1,123 @@
+import asyncio
+import bisect
+import logging
+import time
+from typing import Dict, List, Optional, Set, Tuple
+from api.auth import current_token
+from api.scan import iter_user_batches
+from bot_config import SEARCH_INDEX_TTL
+
+logger = logging.getLogger(__name__)
+
+# Fields kept per user; enough to draw the status emoji in users_list_menu
+INDEX_FIELDS = ("username", "status", "expire", "data_limit", "used_traffic")
+
+class UsernameIndex:
+    """
+    Prefix and substring index over one panel's usernames.
+
+    Prefix queries bisect a sorted list of lowercased names. Substring
+    queries intersect the trigram posting sets of the query and verify the
+    few surviving candidates, so neither walks the whole panel.
+    """
+
+    def __init__(self):
+        self._sorted: List[str] = []
+        self._users: Dict[str, dict] = {}
+        self._trigrams: Dict[str, Set[str]] = {}
+        self.built_at: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+    @staticmethod
+    def _grams(key: str) -> Set[str]:
+        return {key[i:i + 3] for i in range(len(key) - 2)}
+
+    def add(self, user: dict):
+        username = user.get("username")
+        if not username:
+            return
+        key = username.lower()
+        if key not in self._users:
+            bisect.insort(self._sorted, key)
+            for gram in self._grams(key):
+                self._trigrams.setdefault(gram, set()).add(key)
+        self._users[key] = {field: user.get(field) for field in INDEX_FIELDS}
+
+    def remove(self, username: str):
+        key = username.lower()
+        if self._users.pop(key, None) is None:
+            return
+        position = bisect.bisect_left(self._sorted, key)
+        if position < len(self._sorted) and self._sorted[position] == key:
+            del self._sorted[position]
+        for gram in self._grams(key):
+            postings = self._trigrams.get(gram)
+            if postings is not None:
+                postings.discard(key)
+                if not postings:
+                    del self._trigrams[gram]
+
+    def get(self, username: str) -> Optional[dict]:
+        return self._users.get(username.lower())
+
+    def prefix(self, query: str) -> List[str]:
+        query = query.lower()
+        matches = []
+        for key in self._sorted[bisect.bisect_left(self._sorted, query):]:
+            if not key.startswith(query):
+                break
+            matches.append(key)
+        return matches
+
+    def substring(self, query: str) -> List[str]:
+        query = query.lower()
+        grams = self._grams(query)
+        if not grams:
+            return [key for key in self._sorted if query in key]
+        postings = sorted((self._trigrams.get(gram, set()) for gram in grams), key=len)
+        candidates = set.intersection(*postings) if postings[0] else set()
+        return sorted(key for key in candidates if query in key)
+
+    def search(self, query: str) -> List[dict]:
+        """Prefix matches first, then the remaining substring matches, as index records."""
+        prefix_keys = self.prefix(query)
+        seen = set(prefix_keys)
+        keys = prefix_keys + [key for key in self.substring(query) if key not in seen]
+        return [self._users[key] for key in keys]
+
+# Keyed by (panel_url, token): non-sudo admins only see their own users, so each credential gets its own index
+_indexes: Dict[Tuple[str, str], UsernameIndex] = {}
+_build_locks: Dict[Tuple[str, str], asyncio.Lock] = {}
+
+def _index_key(panel_url: str, token: str) -> Tuple[str, str]:
+    return panel_url.rstrip('/'), current_token(token)
+
+def get_username_index(panel_url: str, token: str) -> Optional[UsernameIndex]:
+    """Return the index built with this token, or None if it has not been built yet."""
+    return _indexes.get(_index_key(panel_url, token))
+
+async def ensure_username_index(panel_url: str, token: str) -> UsernameIndex:
+    """Return the index for this panel and token, (re)building it from a streamed scan when missing or older than SEARCH_INDEX_TTL."""
+    key = _index_key(panel_url, token)
+    index = _indexes.get(key)
+    if index is not None and time.time() - index.built_at < SEARCH_INDEX_TTL:
+        return index
+    lock = _build_locks.setdefault(key, asyncio.Lock())
+    async with lock:
+        index = _indexes.get(key)
+        if index is not None and time.time() - index.built_at < SEARCH_INDEX_TTL:
+            return index
+        started = time.monotonic()
+        index = UsernameIndex()
+        async for users in iter_user_batches(panel_url, token, compact=True):
+            for user in users:
+                index.add(user)
+        index.built_at = time.time()
+        # Drop expired indexes, e.g. ones built with a token that has since been refreshed
+        for stale_key in [k for k, i in _indexes.items() if index.built_at - i.built_at >= SEARCH_INDEX_TTL]:
+            del _indexes[stale_key]
+        _indexes[key] = index
+        logger.info(f"Built username index for {key[0]}: {len(index)} users in {time.monotonic() - started:.2f}s")
+        return index
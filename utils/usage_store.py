@@ -0,0 +1,343 @@
+import asyncio
+import hashlib
+import logging
+import os
+import shutil
+import struct
+import threading
+import time
+from array import array
+from typing import BinaryIO, Dict, Iterator, List, Optional, Tuple
+from bot_config import (
+    USAGE_STORE_DIR, USAGE_SAMPLE_INTERVAL, USAGE_RAW_RETENTION, USAGE_HOURLY_RETENTION,
+    USAGE_DAILY_RETENTION, USAGE_COMPACT_INTERVAL, USAGE_FORECAST_WINDOW, USAGE_FORECAST_MIN_SPAN
+)
+from api.client import background_traffic
+from api.scan import iter_user_batches
+from database.db import get_all_panels
+from utils.scheduler import run_periodic
+
+logger = logging.getLogger(__name__)
+
+# One sample: user id, Unix time, used_traffic in bytes (16 bytes, little endian)
+RECORD = struct.Struct("<IIQ")
+# Idle users still get a sample this often, so a forecast window always has an anchor close before it
+IDLE_SAMPLE_INTERVAL = 86400
+# Records read at a time when streaming a file, so compaction never holds a whole file in memory
+CHUNK_RECORDS = 65536
+
+# Layout of a panel directory:
+#   users.txt            usernames, the line number is the user id
+#   raw.bin              samples in time order, appended by every scan
+#   hourly/START-END.bin samples compacted from raw, one file per compaction,
+#   daily/START-END.bin  sorted by (user id, time) so a user is found by binary search
+_lock = threading.Lock()
+# Per panel directory: username -> id, the line number in users.txt
+_user_ids: Dict[str, Dict[str, int]] = {}
+# Per panel directory: user id -> record numbers of its samples in raw.bin
+_raw_offsets: Dict[str, Dict[int, array]] = {}
+# Per panel directory: user id -> (time, used_traffic) of the last sample written
+_last_samples: Dict[str, Dict[int, Tuple[int, int]]] = {}
+_last_compaction: Dict[str, float] = {}
+
+def _panel_dir(panel_url: str) -> str:
+    return os.path.join(USAGE_STORE_DIR, hashlib.sha1(panel_url.rstrip('/').encode()).hexdigest()[:16])
+
+def _raw_path(directory: str) -> str:
+    return os.path.join(directory, "raw.bin")
+
+def _load_user_ids(directory: str) -> Dict[str, int]:
+    ids = _user_ids.get(directory)
+    if ids is None:
+        ids = {}
+        path = os.path.join(directory, "users.txt")
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as names:
+                for line in names:
+                    ids.setdefault(line.rstrip("\n"), len(ids))
+        _user_ids[directory] = ids
+    return ids
+
+def _iter_records(source: BinaryIO, count: int) -> Iterator[Tuple[int, int, int]]:
+    """Yield up to `count` records from the current position of `source`, read in chunks."""
+    while count > 0:
+        chunk = source.read(min(count, CHUNK_RECORDS) * RECORD.size)
+        usable = len(chunk) - len(chunk) % RECORD.size
+        if not usable:
+            return
+        yield from RECORD.iter_unpack(chunk[:usable])
+        count -= usable // RECORD.size
+
+def _raw_index(directory: str) -> Dict[int, array]:
+    """Offsets of each user's samples in raw.bin, built by one pass over the file on first use."""
+    index = _raw_offsets.get(directory)
+    if index is None:
+        index = {}
+        path = _raw_path(directory)
+        if os.path.exists(path):
+            with open(path, "r+b") as source:
+                size = os.fstat(source.fileno()).st_size
+                if size % RECORD.size:
+                    # Drop a partial record left by an interrupted append, or every later offset is off
+                    source.truncate(size - size % RECORD.size)
+                for position, (user_id, _, _) in enumerate(_iter_records(source, size // RECORD.size)):
+                    index.setdefault(user_id, array("I")).append(position)
+        _raw_offsets[directory] = index
+    return index
+
+def _segments(directory: str, tier: str) -> List[Tuple[int, int, str]]:
+    """(start, end, path) of a tier's segment files, oldest first."""
+    tier_dir = os.path.join(directory, tier)
+    if not os.path.isdir(tier_dir):
+        return []
+    segments = []
+    for name in os.listdir(tier_dir):
+        if not name.endswith(".bin"):
+            continue
+        start, _, end = name[:-4].partition("-")
+        segments.append((int(start), int(end), os.path.join(tier_dir, name)))
+    segments.sort()
+    return segments
+
+def _write_segment(directory: str, tier: str, records, start: int, end: int):
+    tier_dir = os.path.join(directory, tier)
+    os.makedirs(tier_dir, exist_ok=True)
+    path = os.path.join(tier_dir, f"{start}-{end}.bin")
+    with open(path + ".tmp", "wb") as output:
+        output.write(b"".join(RECORD.pack(*record) for record in sorted(records)))
+    os.replace(path + ".tmp", path)
+
+def _compact(directory: str, now: int):
+    """
+    Move samples past a tier's retention into the next tier, keeping the last one per bucket.
+
+    used_traffic is a running counter, so the last sample of an hour or a day
+    loses nothing a rate needs. Each compaction writes one new segment, and
+    hourly segments move to the daily tier whole once they pass retention.
+    """
+    path = _raw_path(directory)
+    if os.path.exists(path):
+        with open(path, "rb") as source:
+            count = os.fstat(source.fileno()).st_size // RECORD.size
+            cutoff = (now - USAGE_RAW_RETENTION) // 3600 * 3600
+            # raw.bin is in time order: binary search for the first record to keep
+            low, high = 0, count
+            while low < high:
+                middle = (low + high) // 2
+                source.seek(middle * RECORD.size)
+                if RECORD.unpack(source.read(RECORD.size))[1] < cutoff:
+                    low = middle + 1
+                else:
+                    high = middle
+            if low:
+                latest = {}
+                source.seek(0)
+                for record in _iter_records(source, low):
+                    latest[(record[0], record[1] // 3600)] = record
+                source.seek(0)
+                start = RECORD.unpack(source.read(RECORD.size))[1] // 3600 * 3600
+                _write_segment(directory, "hourly", latest.values(), start, cutoff)
+                source.seek(low * RECORD.size)
+                with open(path + ".tmp", "wb") as output:
+                    shutil.copyfileobj(source, output, CHUNK_RECORDS * RECORD.size)
+                os.replace(path + ".tmp", path)
+                _raw_offsets.pop(directory, None)
+
+    cutoff = (now - USAGE_HOURLY_RETENTION) // 86400 * 86400
+    expired = [segment for segment in _segments(directory, "hourly") if segment[1] <= cutoff]
+    if expired:
+        latest = {}
+        # Segments are oldest first and sorted by time per user, so the last record seen per day wins
+        for _, _, segment_path in expired:
+            with open(segment_path, "rb") as source:
+                for record in _iter_records(source, os.fstat(source.fileno()).st_size // RECORD.size):
+                    latest[(record[0], record[1] // 86400)] = record
+        _write_segment(directory, "daily", latest.values(), expired[0][0], expired[-1][1])
+        for _, _, segment_path in expired:
+            os.remove(segment_path)
+
+    for _, end, segment_path in _segments(directory, "daily"):
+        if end <= now - USAGE_DAILY_RETENTION:
+            os.remove(segment_path)
+
+def record_usage_samples(panel_url: str, users: List[dict], now: Optional[int] = None) -> int:
+    """
+    Append a usage sample for each user whose traffic changed since its last sample.
+
+    A user gets at most one sample every USAGE_SAMPLE_INTERVAL seconds, and
+    idle users one every IDLE_SAMPLE_INTERVAL, so a scan over a large panel
+    writes little. Old samples are downsampled to hourly and then daily
+    records, at most once every USAGE_COMPACT_INTERVAL seconds.
+
+    Args:
+        panel_url: URL of the Marzban panel.
+        users: User dictionaries as returned by /api/users.
+        now: Sample time; defaults to the current time.
+
+    Returns:
+        Number of samples written.
+    """
+    now = int(time.time() if now is None else now)
+    directory = _panel_dir(panel_url)
+    with _lock:
+        try:
+            os.makedirs(directory, exist_ok=True)
+            ids = _load_user_ids(directory)
+            index = _raw_index(directory)
+            last_samples = _last_samples.setdefault(directory, {})
+            new_names = []
+            user_ids = []
+            records = []
+            for user in users:
+                username = user.get("username")
+                if not username:
+                    continue
+                used_traffic = user.get("used_traffic") or 0
+                user_id = ids.get(username)
+                if user_id is None:
+                    user_id = ids[username] = len(ids)
+                    new_names.append(username)
+                last = last_samples.get(user_id)
+                if last is not None and (
+                    now - last[0] < USAGE_SAMPLE_INTERVAL
+                    or (last[1] == used_traffic and now - last[0] < IDLE_SAMPLE_INTERVAL)
+                ):
+                    continue
+                last_samples[user_id] = (now, used_traffic)
+                user_ids.append(user_id)
+                records.append(RECORD.pack(user_id, now, used_traffic))
+            if new_names:
+                with open(os.path.join(directory, "users.txt"), "a", encoding="utf-8") as names:
+                    names.write("".join(f"{name}\n" for name in new_names))
+            if records:
+                path = _raw_path(directory)
+                first = os.path.getsize(path) // RECORD.size if os.path.exists(path) else 0
+                with open(path, "ab") as output:
+                    output.write(b"".join(records))
+                for position, user_id in enumerate(user_ids, first):
+                    index.setdefault(user_id, array("I")).append(position)
+            if now - _last_compaction.get(directory, 0) >= USAGE_COMPACT_INTERVAL:
+                _compact(directory, now)
+                _last_compaction[directory] = now
+            return len(records)
+        except OSError as e:
+            logger.error(f"Usage store write failed for {panel_url}: {str(e)}")
+            return 0
+
+def _segment_samples(source: BinaryIO, user_id: int, since: int) -> List[Tuple[int, int]]:
+    """A user's samples in a segment file, found by binary search on the user id."""
+    low, high = 0, os.fstat(source.fileno()).st_size // RECORD.size
+    while low < high:
+        middle = (low + high) // 2
+        source.seek(middle * RECORD.size)
+        if RECORD.unpack(source.read(RECORD.size))[0] < user_id:
+            low = middle + 1
+        else:
+            high = middle
+    source.seek(low * RECORD.size)
+    samples = []
+    while True:
+        chunk = source.read(RECORD.size)
+        if len(chunk) < RECORD.size:
+            break
+        record_id, sampled_at, used_traffic = RECORD.unpack(chunk)
+        if record_id != user_id:
+            break
+        if sampled_at >= since:
+            samples.append((sampled_at, used_traffic))
+    return samples
+
+def read_usage_series(panel_url: str, username: str, since: int) -> List[Tuple[int, int]]:
+    """Return a user's (time, used_traffic) samples from `since` on, oldest first."""
+    directory = _panel_dir(panel_url)
+    # Only the lookups and opening the files need the lock: compaction replaces
+    # files with os.replace, so an open handle keeps reading the version it opened.
+    segment_files = []
+    raw_file = None
+    with _lock:
+        try:
+            user_id = _load_user_ids(directory).get(username)
+            if user_id is None:
+                return []
+            for tier in ("daily", "hourly"):
+                for _, end, path in _segments(directory, tier):
+                    if end > since:
+                        segment_files.append(open(path, "rb"))
+            offsets = array("I", _raw_index(directory).get(user_id, ()))
+            if offsets:
+                raw_file = open(_raw_path(directory), "rb")
+        except OSError as e:
+            for source in segment_files:
+                source.close()
+            logger.error(f"Usage store read failed for {panel_url}: {str(e)}")
+            return []
+    series = []
+    try:
+        for source in segment_files:
+            series.extend(_segment_samples(source, user_id, since))
+        if raw_file is not None:
+            for position in offsets:
+                raw_file.seek(position * RECORD.size)
+                _, sampled_at, used_traffic = RECORD.unpack(raw_file.read(RECORD.size))
+                if sampled_at >= since:
+                    series.append((sampled_at, used_traffic))
+    except (OSError, struct.error) as e:
+        logger.error(f"Usage store read failed for {panel_url}: {str(e)}")
+    finally:
+        for source in segment_files:
+            source.close()
+        if raw_file is not None:
+            raw_file.close()
+    series.sort()
+    return series
+
+def usage_forecast(panel_url: str, username: str, used_traffic: int, data_limit: int, now: Optional[int] = None) -> Optional[Tuple[float, Optional[float]]]:
+    """
+    Estimate a user's usage rate and when their data limit runs out.
+
+    The rate is the traffic growth over the last USAGE_FORECAST_WINDOW
+    seconds, counted from the last usage reset if there was one. The last
+    sample before the window anchors it; idle users get a sample every
+    IDLE_SAMPLE_INTERVAL, so only that much before the window is read.
+
+    Returns:
+        Tuple of (bytes_per_second, seconds_until_exhausted or None), or None
+        without at least USAGE_FORECAST_MIN_SPAN seconds of samples.
+    """
+    now = int(time.time() if now is None else now)
+    series = read_usage_series(panel_url, username, now - USAGE_FORECAST_WINDOW - IDLE_SAMPLE_INTERVAL)
+    window_start = next((i for i, (sampled_at, _) in enumerate(series) if sampled_at >= now - USAGE_FORECAST_WINDOW), len(series))
+    series = series[max(0, window_start - 1):]
+    series.append((now, used_traffic))
+    start = 0
+    for i in range(1, len(series)):
+        if series[i][1] < series[i - 1][1]:
+            start = i
+    first_at, first_used = series[start]
+    span = now - first_at
+    if span < USAGE_FORECAST_MIN_SPAN:
+        return None
+    rate = max(0, used_traffic - first_used) / span
+    seconds_left = None
+    if data_limit > 0 and rate > 0 and used_traffic < data_limit:
+        seconds_left = (data_limit - used_traffic) / rate
+    return rate, seconds_left
+
+async def sample_all_panels():
+    """Record usage samples for every registered panel with one compact scan per panel admin."""
+    credentials = {}
+    for _, _, panel_url, token, admin_username, _ in get_all_panels():
+        credentials.setdefault((panel_url.rstrip('/'), admin_username), token)
+    for (panel_url, admin_username), token in credentials.items():
+        try:
+            written = 0
+            with background_traffic():
+                async for users in iter_user_batches(panel_url, token, compact=True):
+                    written += await asyncio.to_thread(record_usage_samples, panel_url, users)
+            logger.info(f"Usage sampling for {panel_url} ({admin_username}): {written} samples written")
+        except Exception as e:
+            logger.error(f"Usage sampling failed for {panel_url} ({admin_username}): {str(e)}")
+
+async def run_usage_sampler(interval: int = USAGE_SAMPLE_INTERVAL):
+    """Background task: sample every registered panel every `interval` seconds."""
+    await run_periodic(sample_all_panels, interval, "usage sampling")
@@ -0,0 +1,54 @@
+import asyncio
+from typing import List
+from utils.cache import set_user_cache, invalidate_user_cache, invalidate_page_cache
+from utils.user_mirror import mirror_users, mirror_users_deleted
+from utils.search_index import get_username_index
+from utils.alerts import observe_user, forget_user
+from api.auth import panel_admin
+
+def _update_memory(panel_url: str, token: str, users: List[dict]):
+    admin_username = panel_admin(panel_url, token)
+    index = get_username_index(panel_url, token)
+    for user in users:
+        set_user_cache(panel_url, token, user)
+        observe_user(panel_url, admin_username, user)
+        if index is not None:
+            index.add(user)
+    invalidate_page_cache(panel_url)
+
+def _delete_from_memory(panel_url: str, token: str, usernames: List[str]):
+    admin_username = panel_admin(panel_url, token)
+    index = get_username_index(panel_url, token)
+    for username in usernames:
+        invalidate_user_cache(panel_url, username)
+        forget_user(panel_url, admin_username, username)
+        if index is not None:
+            index.remove(username)
+    invalidate_page_cache(panel_url)
+
+def user_updated(panel_url: str, token: str, user: dict):
+    """Propagate a user returned by a panel mutation to every local copy."""
+    if not isinstance(user, dict) or not user.get("username"):
+        return
+    _update_memory(panel_url, token, [user])
+    mirror_users(panel_url, token, [user])
+
+def user_deleted(panel_url: str, token: str, username: str):
+    """Drop a user deleted on the panel from every local copy."""
+    _delete_from_memory(panel_url, token, [username])
+    mirror_users_deleted(panel_url, token, [username])
+
+async def users_updated(panel_url: str, token: str, users: List[dict]):
+    """Like user_updated for a bulk operation: the mirror is written in one transaction, off the event loop."""
+    users = [user for user in users if isinstance(user, dict) and user.get("username")]
+    if not users:
+        return
+    _update_memory(panel_url, token, users)
+    await asyncio.to_thread(mirror_users, panel_url, token, users)
+
+async def users_deleted(panel_url: str, token: str, usernames: List[str]):
+    """Like user_deleted for a bulk operation: the mirror is written in one transaction, off the event loop."""
+    if not usernames:
+        return
+    _delete_from_memory(panel_url, token, usernames)
+    await asyncio.to_thread(mirror_users_deleted, panel_url, token, usernames)
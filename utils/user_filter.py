@@ -0,0 +1,85 @@
+from typing import Optional
+
+USER_STATUSES = ("active", "disabled", "on_hold", "expired", "limited")
+
+def parse_user_filter(text: str) -> dict:
+    """
+    Parse a filter such as "status=active expiring=7 usage=80 prefix=shop".
+
+    Keys:
+        status: Marzban user status.
+        expiring: Expires within this many days (users without expiry never match).
+        usage: Used at least this percentage of the data limit (unlimited users never match).
+        prefix: Username starts with this text.
+
+    "all" or "همه" matches every user.
+
+    Raises:
+        ValueError: With a Persian message describing the invalid part.
+    """
+    user_filter = {}
+    text = text.strip().lower()
+    if text in ("all", "همه"):
+        return user_filter
+    for part in text.split():
+        key, sep, value = part.partition("=")
+        if not sep or not value:
+            raise ValueError(f"بخش «{part}» باید به شکل کلید=مقدار باشد.")
+        if key == "status":
+            if value not in USER_STATUSES:
+                raise ValueError(f"وضعیت باید یکی از {', '.join(USER_STATUSES)} باشد.")
+            user_filter["status"] = value
+        elif key in ("expiring", "usage"):
+            try:
+                number = float(value)
+            except ValueError:
+                raise ValueError(f"مقدار {key} باید عدد باشد.")
+            if number < 0:
+                raise ValueError(f"مقدار {key} نمی‌تواند منفی باشد.")
+            user_filter[key] = number
+        elif key == "prefix":
+            user_filter["prefix"] = value
+        else:
+            raise ValueError(f"کلید ناشناخته «{key}». کلیدهای مجاز: status، expiring، usage، prefix")
+    return user_filter
+
+def user_matches(user_filter: dict, user: dict, now: int) -> bool:
+    """Whether a user dict from /api/users matches a parsed filter."""
+    if "status" in user_filter and user.get("status") != user_filter["status"]:
+        return False
+    if "prefix" in user_filter and not user.get("username", "").startswith(user_filter["prefix"]):
+        return False
+    if "expiring" in user_filter:
+        expire = user.get("expire") or 0
+        if not now < expire <= now + user_filter["expiring"] * 86400:
+            return False
+    if "usage" in user_filter:
+        data_limit = user.get("data_limit") or 0
+        used_traffic = user.get("used_traffic") or 0
+        if data_limit <= 0 or used_traffic * 100 < user_filter["usage"] * data_limit:
+            return False
+    return True
+
+def panel_query_params(user_filter: dict) -> Optional[dict]:
+    """Query parameters that let the panel pre-filter /api/users for this filter."""
+    params = {}
+    if "status" in user_filter:
+        params["status"] = user_filter["status"]
+    if "prefix" in user_filter:
+        # Marzban's search is a substring match; user_matches still checks the prefix
+        params["search"] = user_filter["prefix"]
+    return params or None
+
+def describe_user_filter(user_filter: dict) -> str:
+    if not user_filter:
+        return "همه کاربران"
+    parts = []
+    if "status" in user_filter:
+        parts.append(f"وضعیت {user_filter['status']}")
+    if "expiring" in user_filter:
+        parts.append(f"انقضا تا {user_filter['expiring']:g} روز آینده")
+    if "usage" in user_filter:
+        parts.append(f"مصرف حداقل {user_filter['usage']:g}٪")
+    if "prefix" in user_filter:
+        parts.append(f"پیشوند «{user_filter['prefix']}»")
+    return "، ".join(parts)
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import time
+from typing import Dict, List, Optional, Tuple
+from api.auth import panel_admin
+from api.client import background_traffic
+from api.scan import iter_user_pages
+from utils.alerts import observe_users, finish_panel_scan
+from utils.scheduler import run_periodic
+from utils.usage_store import record_usage_samples
+from bot_config import USER_MIRROR_ENABLED, USER_MIRROR_SYNC_INTERVAL
+from database.db import get_all_panels, upsert_panel_users, get_panel_usernames, delete_panel_users, set_mirror_synced_at, get_mirror_synced_at
+
+logger = logging.getLogger(__name__)
+
+# (panel_url, admin_username) -> time of the last completed sync, so serving reads need no DB query
+_synced_at: Dict[Tuple[str, str], Optional[int]] = {}
+
+def _mirror_synced_at(panel_url: str, admin_username: str) -> Optional[int]:
+    key = (panel_url, admin_username)
+    if key not in _synced_at:
+        _synced_at[key] = get_mirror_synced_at(panel_url, admin_username)
+    return _synced_at[key]
+
+def mirror_owner(panel_url: str, token: str) -> Optional[str]:
+    """
+    Return the panel admin whose mirror the holder of `token` may read, or None.
+
+    Non-sudo Marzban admins only see their own users, so each panel admin has
+    a separate mirror, and a caller is only served the one synced with their
+    own credentials, and only while it is fresh. Both lookups are memoized, so
+    this does not touch the database on the serving path.
+    """
+    if not USER_MIRROR_ENABLED:
+        return None
+    admin_username = panel_admin(panel_url, token)
+    if admin_username is None:
+        return None
+    synced_at = _mirror_synced_at(panel_url.rstrip('/'), admin_username)
+    if synced_at is None or time.time() - synced_at >= 2 * USER_MIRROR_SYNC_INTERVAL:
+        return None
+    return admin_username
+
+def mirror_users(panel_url: str, token: str, users: List[dict]):
+    """Write users returned by panel mutations through to the mirror of the admin who made them, in one transaction."""
+    if USER_MIRROR_ENABLED and users:
+        admin_username = panel_admin(panel_url, token)
+        if admin_username is not None:
+            upsert_panel_users(panel_url.rstrip('/'), admin_username, users, int(time.time()))
+
+def mirror_users_deleted(panel_url: str, token: str, usernames: List[str]):
+    if USER_MIRROR_ENABLED and usernames:
+        admin_username = panel_admin(panel_url, token)
+        if admin_username is not None:
+            delete_panel_users(panel_url.rstrip('/'), admin_username, usernames)
+
+async def sync_panel_mirror(panel_url: str, admin_username: str, token: str) -> Tuple[int, int]:
+    """
+    Bring one panel admin's mirror of a panel up to date.
+
+    Marzban has no "changed since" filter, so every user is read, but only
+    new or changed rows are written and only users gone from the panel are
+    deleted.
+
+    Returns:
+        Tuple of (rows_written, rows_deleted).
+    """
+    key = panel_url.rstrip('/')
+    started = int(time.time())
+    seen = set()
+    written = 0
+    with background_traffic():
+        async for offset, users in iter_user_pages(key, token):
+            seen.update(user["username"] for user in users if user.get("username"))
+            written += await asyncio.to_thread(upsert_panel_users, key, admin_username, users, started, offset)
+            observe_users(key, admin_username, users, started)
+            await asyncio.to_thread(record_usage_samples, key, users, started)
+    finish_panel_scan(key, admin_username, seen)
+    stale = await asyncio.to_thread(get_panel_usernames, key, admin_username) - seen
+    if stale:
+        await asyncio.to_thread(delete_panel_users, key, admin_username, list(stale))
+    await asyncio.to_thread(set_mirror_synced_at, key, admin_username, started)
+    _synced_at[(key, admin_username)] = started
+    return written, len(stale)
+
+async def sync_all_mirrors():
+    """Refresh the mirror of every registered panel once per panel admin."""
+    credentials = {}
+    for _, _, panel_url, token, admin_username, _ in get_all_panels():
+        credentials.setdefault((panel_url.rstrip('/'), admin_username), token)
+    for (panel_url, admin_username), token in credentials.items():
+        try:
+            written, deleted = await sync_panel_mirror(panel_url, admin_username, token)
+            logger.info(f"Mirror sync for {panel_url} ({admin_username}): {written} rows written, {deleted} removed")
+        except Exception as e:
+            logger.error(f"Mirror sync failed for {panel_url} ({admin_username}): {str(e)}")
+
+async def run_mirror_sync(interval: int = USER_MIRROR_SYNC_INTERVAL):
+    """Background task: refresh the mirror of every registered panel every `interval` seconds."""
+    await run_periodic(sync_all_mirrors, interval, "mirror sync")